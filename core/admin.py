@@ -1,3 +1,4 @@
 from django.contrib import admin
 from .models import *
-admin.site.register([Instrument, Folder, Source, SourceVersion, PDFFragment, VideoFragment, ImageFragment, AccessGrant, AccessRequest, ChatSession, ChatTurn, Attachment, Citation, Feedback, Connector])
+admin.site.register([Instrument, Folder, Source, SourceVersion, Upload, PDFFragment, PackedFragmentPage, VideoFragment, ImageFragment, AccessGrant, AccessRequest, ChatSession, ChatTurn, Attachment, Citation, Feedback, Connector, ConnectorItem,
+                     InstrumentDailyStats, FeedbackTagDailyStats, SourceCitationDailyStats, SourceCount])
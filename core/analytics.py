@@ -0,0 +1,101 @@
+# core/analytics.py
+"""
+Incremental chat analytics rollups.
+
+Turn counts, ratings, feedback tags and cited sources are aggregated per
+instrument per day into small summary tables as turns are created and rated,
+so dashboards read a handful of rows instead of scanning ChatTurn.
+"""
+from collections import Counter
+from datetime import timedelta
+from typing import Dict, Iterable, Optional
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.utils.timezone import localdate
+
+from .models import InstrumentDailyStats, FeedbackTagDailyStats, SourceCitationDailyStats
+
+
+def bump(model, lookup: Dict, **deltas):
+    """Add `deltas` to the row matching `lookup`, creating it on first use (one UPDATE when it exists)."""
+    deltas = {k: v for k, v in deltas.items() if v}
+    if not deltas:
+        return
+    updates = {k: F(k) + v for k, v in deltas.items()}
+    if model.objects.filter(**lookup).update(**updates):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**lookup, **deltas)
+    except IntegrityError:
+        # Lost the race to create the row; it exists now.
+        model.objects.filter(**lookup).update(**updates)
+
+
+def _decrement(model, lookup: Dict, field: str):
+    """Take one off `field` of the row matching `lookup`, if it exists and is positive."""
+    # the rating/tag being replaced may predate the rollups or their last rebuild
+    model.objects.filter(**lookup, **{f"{field}__gt": 0}).update(**{field: F(field) - 1})
+
+
+def _rating_deltas(rating: Optional[str], sign: int) -> Dict[str, int]:
+    if rating == "like":
+        return {"likes": sign}
+    if rating == "dislike":
+        return {"dislikes": sign}
+    return {}
+
+
+def record_turn(turn, instrument_id):
+    """Count a newly created ChatTurn."""
+    field = "assistant_turns" if turn.role == "assistant" else "user_turns"
+    bump(InstrumentDailyStats, {"instrument_id": instrument_id, "day": localdate(turn.created_at)}, **{field: 1})
+
+
+def record_citations(turn, instrument_id, source_ids: Iterable):
+    """Count the sources cited by an assistant turn."""
+    counts = Counter(str(s) for s in source_ids)
+    if not counts:
+        return
+    day = localdate(turn.created_at)
+    bump(InstrumentDailyStats, {"instrument_id": instrument_id, "day": day}, citations=sum(counts.values()))
+    for source_id, n in counts.items():
+        bump(SourceCitationDailyStats, {"instrument_id": instrument_id, "day": day, "source_id": source_id}, count=n)
+
+
+def record_feedback(turn, instrument_id, old_rating, old_tag, new_rating, new_tag):
+    """Apply the difference between a turn's previous and new rating/tag."""
+    day = localdate(turn.created_at)
+    if old_rating != new_rating:
+        lookup = {"instrument_id": instrument_id, "day": day}
+        for field in _rating_deltas(old_rating, -1):
+            _decrement(InstrumentDailyStats, lookup, field)
+        bump(InstrumentDailyStats, lookup, **_rating_deltas(new_rating, 1))
+    if old_tag != new_tag:
+        if old_tag:
+            _decrement(FeedbackTagDailyStats, {"instrument_id": instrument_id, "day": day, "tag": old_tag}, "count")
+        if new_tag:
+            bump(FeedbackTagDailyStats, {"instrument_id": instrument_id, "day": day, "tag": new_tag}, count=1)
+
+
+def instrument_summary(instrument_id, days: int = 30) -> Dict:
+    """Dashboard payload for the last `days` days, read from the rollup tables only."""
+    since = localdate() - timedelta(days=days - 1)
+    rows = list(InstrumentDailyStats.objects.filter(instrument_id=instrument_id, day__gte=since)
+                .order_by("day").values("day", "user_turns", "assistant_turns", "likes", "dislikes", "citations"))
+    totals = {k: sum(r[k] for r in rows) for k in ("user_turns", "assistant_turns", "likes", "dislikes", "citations")}
+    rated = totals["likes"] + totals["dislikes"]
+    totals["like_ratio"] = round(totals["likes"] / rated, 3) if rated else None
+    tags = (FeedbackTagDailyStats.objects.filter(instrument_id=instrument_id, day__gte=since)
+            .values("tag").annotate(n=Sum("count")).order_by("-n"))
+    top_sources = (SourceCitationDailyStats.objects.filter(instrument_id=instrument_id, day__gte=since)
+                   .values("source_id", "source__title").annotate(n=Sum("count")).order_by("-n")[:10])
+    return {
+        "instrument_id": str(instrument_id),
+        "since": since.isoformat(),
+        "totals": totals,
+        "days": [{**r, "day": r["day"].isoformat()} for r in rows],
+        "feedback_tags": {t["tag"]: t["n"] for t in tags if t["n"]},
+        "top_sources": [{"source_id": str(s["source_id"]), "title": s["source__title"], "citations": s["n"]} for s in top_sources],
+    }
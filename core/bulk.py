@@ -0,0 +1,190 @@
+# core/bulk.py
+"""
+Bulk source operations: archive, move, retag, recategorize.
+
+Each operation is one UPDATE over the selected sources (an ID list or the same
+filters SourceViewSet.list takes), followed by one cache invalidation per
+affected instrument. Queryset .update() skips the per-row Source signals, so
+the invalidation (and the Knowledge Store counter rebuild) is done here, once.
+
+Selections above BULK_SYNC_LIMIT run as a background job that updates in
+chunks of BULK_CHUNK_SIZE ids (short row locks); the caller gets a job id to
+poll.
+"""
+import threading
+import uuid
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.contrib.postgres.fields import ArrayField
+from django.core.cache import cache
+from django.db import connections, models
+from django.db.models import F, Func, Q
+from django.utils.timezone import now
+
+from .models import Folder, Source, CATEGORY_CHOICES
+from .folders import subtree_root
+from .source_stats import rebuild_counts
+from .versioning import bump_version
+
+OPS = ("archive", "move", "retag", "recategorize")
+_JOB_TTL = 24 * 3600
+_TAGS = ArrayField(models.CharField(max_length=64))
+
+
+class BulkError(Exception):
+    pass
+
+
+class _MergeTags(Func):
+    """model_tags followed by the given tags it does not already contain (order kept)."""
+    output_field = _TAGS
+
+    def __init__(self, tags: List[str]):
+        super().__init__(F("model_tags"))
+        self.tags = tags
+
+    def as_sql(self, compiler, connection, **extra):
+        sql, params = compiler.compile(self.source_expressions[0])
+        return (f"array_cat({sql}, ARRAY(SELECT t FROM unnest(%s::varchar(64)[]) WITH ORDINALITY u(t, i) "
+                f"WHERE NOT t = ANY({sql}) ORDER BY i))", [*params, self.tags, *params])
+
+
+class _RemoveTags(Func):
+    """model_tags without the given tags (order kept)."""
+    output_field = _TAGS
+
+    def __init__(self, tags: List[str]):
+        super().__init__(F("model_tags"))
+        self.tags = tags
+
+    def as_sql(self, compiler, connection, **extra):
+        sql, params = compiler.compile(self.source_expressions[0])
+        return (f"ARRAY(SELECT t FROM unnest({sql}) WITH ORDINALITY u(t, i) "
+                f"WHERE NOT t = ANY(%s::varchar(64)[]) ORDER BY i)", [*params, self.tags])
+
+
+def filter_sources(qs, params):
+    """The list filters of SourceViewSet: instrument, folder, folder_subtree, q, type, status, category."""
+    instrument = params.get("instrument")
+    q = params.get("q"); typ = params.get("type"); status_f = params.get("status"); folder = params.get("folder")
+    category = params.get("category"); subtree = params.get("folder_subtree")
+    if instrument: qs = qs.filter(instrument_id=instrument)
+    if folder: qs = qs.filter(folder_id=folder)
+    if subtree:
+        # the folder and everything below it: one prefix match on the materialized path,
+        # scoped to the folder's instrument so folder_path_idx (instrument, path) applies
+        root = subtree_root(subtree)
+        qs = qs.filter(instrument_id=root["instrument_id"], folder__instrument_id=root["instrument_id"],
+                       folder__path__startswith=root["path"]) if root else qs.none()
+    if q: qs = qs.filter(Q(title__icontains=q)|Q(version__icontains=q)|Q(model_tags__icontains=q))
+    if typ: qs = qs.filter(type=typ)
+    if status_f: qs = qs.filter(status=status_f)
+    if category: qs = qs.filter(category=category)
+    return qs
+
+
+def selection(data: Dict):
+    """Sources selected by {"ids": [...]} or {"filter": {...}}; a filter must name an instrument."""
+    ids, filters = data.get("ids"), data.get("filter")
+    if ids:
+        try:
+            ids = [uuid.UUID(str(i)) for i in ids]
+        except ValueError:
+            raise BulkError("invalid id in ids")
+        return Source.objects.filter(id__in=ids)
+    if isinstance(filters, dict) and filters.get("instrument"):
+        return filter_sources(Source.objects.all(), filters)
+    raise BulkError("pass ids, or a filter with at least an instrument")
+
+
+def _changes(op: str, data: Dict, qs):
+    """(queryset narrowed to valid targets, UPDATE kwargs) for an operation."""
+    if op == "archive":
+        return qs.filter(archived=False), {"archived": True, "archived_at": now(), "status": "archived"}
+    if op == "move":
+        folder_id = data.get("folder_id")
+        if not folder_id:
+            return qs, {"folder_id": None}
+        folder = Folder.objects.filter(id=folder_id).values("id", "instrument_id").first()
+        if not folder:
+            raise BulkError("folder not found")
+        # a folder belongs to one instrument; sources of other instruments are left alone
+        return qs.filter(instrument_id=folder["instrument_id"]), {"folder_id": folder["id"]}
+    if op == "retag":
+        tags = [str(t)[:64] for t in data.get("model_tags") or []]
+        mode = data.get("mode", "set")
+        if mode == "set":
+            return qs, {"model_tags": tags}
+        if not tags:
+            raise BulkError("model_tags is required")
+        if mode == "add":
+            return qs.exclude(model_tags__contains=tags), {"model_tags": _MergeTags(tags)}
+        if mode == "remove":
+            return qs.filter(model_tags__overlap=tags), {"model_tags": _RemoveTags(tags)}
+        raise BulkError("mode must be set, add or remove")
+    if op == "recategorize":
+        category = data.get("category")
+        if category not in dict(CATEGORY_CHOICES) and category is not None:
+            raise BulkError(f"unknown category: {category}")
+        return qs, {"category": category}
+    raise BulkError(f"op must be one of {', '.join(OPS)}")
+
+
+def _invalidate(instrument_ids, op=None):
+    rebuild_counts(instrument_ids)
+    for instrument_id in set(instrument_ids):
+        bump_version("sources", instrument_id)
+        if op in ("archive", "retag"):
+            # model tags and the active source set feed the query entity matcher
+            bump_version("entities", instrument_id)
+    bump_version("sources", "all")
+
+
+def _job_key(job_id) -> str:
+    return f"bulkjob:{job_id}"
+
+
+def get_job(job_id) -> Optional[Dict]:
+    return cache.get(_job_key(job_id))
+
+
+def _run_chunked(job: Dict, ids: List, updates: Dict, instrument_ids):
+    key = _job_key(job["job_id"])
+    try:
+        size = settings.BULK_CHUNK_SIZE
+        for i in range(0, len(ids), size):
+            job["updated"] += Source.objects.filter(id__in=ids[i:i + size]).update(**updates)
+            job["processed"] = min(i + size, len(ids))
+            cache.set(key, job, _JOB_TTL)
+        job["status"] = "done"
+    except Exception as e:
+        job["status"], job["error"] = "failed", str(e)[:500]
+    finally:
+        _invalidate(instrument_ids, job["op"])
+        job["finished_at"] = now().isoformat()
+        cache.set(key, job, _JOB_TTL)
+        connections.close_all()
+
+
+def run_bulk(op: str, data: Dict) -> Dict:
+    """
+    Apply `op` to the selection in `data`. Returns {"updated": n} when done inline,
+    or a job record ({"job_id", "status": "running", ...}) for large selections.
+    """
+    qs, updates = _changes(op, data, selection(data))
+    matched = qs.count()
+    if data.get("dry_run"):
+        return {"op": op, "matched": matched, "dry_run": True}
+    if matched <= settings.BULK_SYNC_LIMIT:
+        instrument_ids = list(qs.order_by().values_list("instrument_id", flat=True).distinct())
+        updated = qs.update(**updates)
+        _invalidate(instrument_ids, op)
+        return {"op": op, "matched": matched, "updated": updated, "status": "done"}
+    rows = list(qs.values_list("id", "instrument_id"))
+    job = {"job_id": str(uuid.uuid4()), "op": op, "status": "running", "matched": len(rows), "processed": 0,
+           "updated": 0, "started_at": now().isoformat()}
+    cache.set(_job_key(job["job_id"]), job, _JOB_TTL)
+    threading.Thread(target=_run_chunked, args=(dict(job), [r[0] for r in rows], updates, [r[1] for r in rows]),
+                     name=f"bulk-{job['job_id']}", daemon=True).start()
+    return job
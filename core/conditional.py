@@ -0,0 +1,75 @@
+# core/conditional.py
+"""
+Conditional GET and a shared response cache for read-heavy catalog endpoints.
+
+A response is identified by the endpoint name, its query string, the negotiated
+format and the version counters of everything it is built from (see
+core.versioning), so the ETag is computed without touching the database. A
+matching If-None-Match (or an If-Modified-Since no older than the cached build)
+gets a 304 before any query runs; otherwise the serialized data is served from
+the shared cache, and only built on a miss.
+
+Session-scoped responses pass vary_session=True: the session key becomes part
+of the ETag and cache key, and they are sent with "Vary: Cookie" and
+"Cache-Control: private".
+"""
+import hashlib
+import time
+from typing import Callable, Iterable, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import http_date, parse_http_date_safe
+from rest_framework.response import Response
+
+from .dbrouter import primary
+from .versioning import get_version
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == "*":
+        return True
+    return any(t.strip().removeprefix("W/") == etag for t in header.split(","))
+
+
+def _headers(resp, etag: str, vary_session: bool, modified=None):
+    resp["ETag"] = etag
+    if modified:
+        resp["Last-Modified"] = http_date(modified)
+    # always revalidate: the ETag makes that a cheap 304
+    resp["Cache-Control"] = "private, no-cache" if vary_session else "public, no-cache"
+    patch_vary_headers(resp, ("Accept", "Cookie") if vary_session else ("Accept",))
+    return resp
+
+
+def cached_response(request, name: str, scopes: Iterable[Tuple[str, object]], build: Callable,
+                    extra: str = "", vary_session: bool = False):
+    """
+    Response for `build()` (JSON-serializable data), conditional on the versions of `scopes`
+    (e.g. [("sources", instrument_id)]). `extra` is mixed into the ETag for data that
+    is not versioned by a counter (e.g. a hash of static content).
+    """
+    versions = [get_version(scope, key) for scope, key in scopes]
+    fmt = getattr(getattr(request, "accepted_renderer", None), "format", "")
+    session = (request.session.session_key or "") if vary_session else ""
+    query = sorted((k, v) for k, vs in request.GET.lists() for v in vs)
+    digest = hashlib.sha1(repr((name, query, fmt, versions, extra, session)).encode()).hexdigest()[:24]
+    etag = f'"{digest}"'
+
+    inm = request.headers.get("If-None-Match")
+    if inm and _etag_matches(inm, etag):
+        return _headers(HttpResponseNotModified(), etag, vary_session)
+
+    key = f"resp:{name}:{digest}"
+    entry = cache.get(key)
+    ims = parse_http_date_safe(request.headers.get("If-Modified-Since") or "")
+    if entry and not inm and ims and ims >= entry["modified"]:
+        return _headers(HttpResponseNotModified(), etag, vary_session, entry["modified"])
+    if entry is None:
+        # built from the primary: a lagging replica could hold data older than these versions
+        with primary():
+            entry = {"data": build(), "modified": int(time.time())}
+        cache.set(key, entry, settings.RESPONSE_CACHE_TTL)
+    return _headers(Response(entry["data"]), etag, vary_session, entry["modified"])
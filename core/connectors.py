@@ -0,0 +1,426 @@
+# core/connectors.py
+"""
+Connector sync engine: mirror files from an external drive into Sources.
+
+Each provider lists changes since a persisted delta cursor (Drive changes
+page token, Microsoft Graph deltaLink, or a directory scan). Changes whose
+ETag matches the one stored on ConnectorItem are skipped. The rest are
+streamed into upload storage by a bounded thread pool, hashing on the way.
+New or changed PDFs are then ingested; an existing PDF goes through the
+incremental SourceVersion path. .vtt/.srt files are ingested as the
+transcript of the video with the same name.
+
+Connector.config_json:
+  instrument_id (required), folder_id (optional), and per provider:
+    local_directory: {"path": "/data/manuals"}  (inside CONNECTOR_LOCAL_ROOT)
+    google_drive:    {"drive_folder_id": "...", "access_token": "..."}
+    sharepoint:      {"drive_id": "...", "access_token": "..."}
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import now
+
+from .models import Connector, ConnectorItem, Source
+from .source_stats import rebuild_counts
+from .versioning import bump_version
+from .storage import get_storage, resolve, open_mmap, HashingReader
+
+_TYPES = {
+    "pdf": (".pdf",),
+    "video": (".mp4", ".mov", ".m4v", ".webm", ".mkv", ".avi"),
+    "image": (".png", ".jpg", ".jpeg", ".gif", ".webp", ".tif", ".tiff"),
+}
+_TRANSCRIPTS = (".vtt", ".srt")
+_UNSAFE = re.compile(r"[^\w.\-]+")
+
+
+class ConnectorError(Exception):
+    pass
+
+
+class Change(NamedTuple):
+    external_id: str
+    name: str
+    etag: str
+    modified_at: Optional[datetime]
+    size: Optional[int]
+    deleted: bool = False
+
+
+def source_type(name: str) -> Optional[str]:
+    ext = os.path.splitext(name)[1].lower()
+    return next((t for t, exts in _TYPES.items() if ext in exts), None)
+
+
+# --- providers ---
+class LocalDirectoryProvider:
+    """
+    A directory tree under CONNECTOR_LOCAL_ROOT; ETag is mtime+size. Every sync
+    rescans, which also finds deletions. Paths are resolved through symlinks, so
+    neither the configured path nor a file in it can reach outside the root.
+    """
+
+    def __init__(self, config: Dict):
+        allowed = settings.CONNECTOR_LOCAL_ROOT
+        if not allowed:
+            raise ConnectorError("local_directory connectors are disabled (set CONNECTOR_LOCAL_ROOT)")
+        self.allowed = os.path.realpath(allowed)
+        self.root = os.path.realpath(config.get("path") or "")
+        if not self._inside(self.root):
+            raise ConnectorError(f"path must be inside {self.allowed}")
+        if not os.path.isdir(self.root):
+            raise ConnectorError(f"not a directory: {self.root}")
+
+    def _inside(self, path: str) -> bool:
+        return os.path.commonpath([self.allowed, path]) == self.allowed
+
+    def changes(self, cursor: Optional[str]) -> Tuple[List[Change], str, bool]:
+        out = []
+        for folder, dirs, files in os.walk(self.root):
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
+            for name in files:
+                if name.startswith("."):
+                    continue
+                path = os.path.join(folder, name)
+                st = os.stat(path)
+                out.append(Change(os.path.relpath(path, self.root), name, f"{st.st_mtime_ns}-{st.st_size}",
+                                  datetime.fromtimestamp(st.st_mtime, tz=timezone.utc), st.st_size))
+        return out, now().isoformat(), True
+
+    def open(self, change: Change):
+        path = os.path.realpath(os.path.join(self.root, change.external_id))
+        if not self._inside(path):
+            raise ConnectorError(f"{change.name} links outside {self.allowed}")
+        return open(path, "rb")
+
+
+class _HTTPProvider:
+    base = ""
+
+    def __init__(self, config: Dict):
+        self.token = config.get("access_token")
+        if not self.token:
+            raise ConnectorError("config.access_token is required")
+
+    def _request(self, url: str):
+        if not url.startswith("http"):
+            url = self.base + url
+        req = urllib.request.Request(url, headers={"Authorization": f"Bearer {self.token}"})
+        try:
+            return urllib.request.urlopen(req, timeout=60)
+        except urllib.error.HTTPError as e:
+            raise ConnectorError(f"{e.code} from {url.split('?')[0]}")
+
+    def _json(self, url: str) -> Dict:
+        with self._request(url) as resp:
+            return json.loads(resp.read().decode("utf-8"))
+
+
+class GoogleDriveProvider(_HTTPProvider):
+    """Drive v3: a full listing of the folder first, then the changes feed from a saved page token."""
+    base = "https://www.googleapis.com/drive/v3"
+    _FIELDS = "id,name,md5Checksum,modifiedTime,size,mimeType,trashed,parents"
+
+    def __init__(self, config: Dict):
+        super().__init__(config)
+        self.folder = config.get("drive_folder_id")
+        if not self.folder:
+            raise ConnectorError("config.drive_folder_id is required")
+
+    def _change(self, f: Dict, removed: bool = False) -> Change:
+        return Change(f["id"], f.get("name", f["id"]), f.get("md5Checksum") or f.get("modifiedTime", ""),
+                      parse_datetime(f["modifiedTime"]) if f.get("modifiedTime") else None,
+                      int(f["size"]) if f.get("size") else None, removed or bool(f.get("trashed")))
+
+    def changes(self, cursor: Optional[str]) -> Tuple[List[Change], str, bool]:
+        if not cursor:
+            start = self._json("/changes/startPageToken")["startPageToken"]
+            out, page = [], None
+            q = urllib.parse.quote(f"'{self.folder}' in parents and trashed=false")
+            while True:
+                data = self._json(f"/files?q={q}&pageSize=1000&fields=nextPageToken,files({self._FIELDS})"
+                                  + (f"&pageToken={page}" if page else ""))
+                out += [self._change(f) for f in data.get("files", [])]
+                page = data.get("nextPageToken")
+                if not page:
+                    return out, start, True
+        out, page = [], cursor
+        while True:
+            data = self._json(f"/changes?pageToken={page}&pageSize=1000"
+                              f"&fields=nextPageToken,newStartPageToken,changes(fileId,removed,file({self._FIELDS}))")
+            for c in data.get("changes", []):
+                f = c.get("file") or {"id": c["fileId"]}
+                if c.get("removed") or self.folder in f.get("parents", []):
+                    out.append(self._change(f, removed=bool(c.get("removed"))))
+            if data.get("newStartPageToken"):
+                return out, data["newStartPageToken"], False
+            page = data["nextPageToken"]
+
+    def open(self, change: Change):
+        return self._request(f"/files/{change.external_id}?alt=media")
+
+
+class SharePointProvider(_HTTPProvider):
+    """Microsoft Graph driveItem delta; the deltaLink of the last page is the cursor."""
+    base = "https://graph.microsoft.com/v1.0"
+
+    def __init__(self, config: Dict):
+        super().__init__(config)
+        self.drive = config.get("drive_id")
+        if not self.drive:
+            raise ConnectorError("config.drive_id is required")
+
+    def changes(self, cursor: Optional[str]) -> Tuple[List[Change], str, bool]:
+        out, url = [], cursor or f"/drives/{self.drive}/root/delta"
+        while True:
+            data = self._json(url)
+            for item in data.get("value", []):
+                if "folder" in item or "root" in item:
+                    continue
+                modified = item.get("lastModifiedDateTime")
+                out.append(Change(item["id"], item.get("name", item["id"]), item.get("cTag") or item.get("eTag", ""),
+                                  parse_datetime(modified) if modified else None, item.get("size"), "deleted" in item))
+            if "@odata.deltaLink" in data:
+                return out, data["@odata.deltaLink"], cursor is None
+            url = data["@odata.nextLink"]
+
+    def open(self, change: Change):
+        return self._request(f"/drives/{self.drive}/items/{change.external_id}/content")
+
+
+PROVIDERS = {
+    "local_directory": LocalDirectoryProvider,
+    "google_drive": GoogleDriveProvider,
+    "sharepoint": SharePointProvider,
+}
+
+
+def get_provider(connector: Connector):
+    cls = PROVIDERS.get(connector.provider)
+    if cls is None:
+        raise ConnectorError(f"unknown provider: {connector.provider}")
+    return cls(connector.config_json or {})
+
+
+# --- engine ---
+def _fetch(provider, connector_id, change: Change) -> Tuple[Change, str, str, int]:
+    """Stream one file into upload storage; runs in the worker pool, no DB access."""
+    storage = get_storage()
+    name = _UNSAFE.sub("_", change.name).strip("._") or "file"
+    # one key per (file, ETag): older SourceVersions keep their object and cached copies never go stale
+    revision = hashlib.sha1(change.etag.encode()).hexdigest()[:12]
+    key = f"connectors/{connector_id}/{_UNSAFE.sub('_', change.external_id)[:120]}/{revision}/{name}"
+    with provider.open(change) as src:
+        reader = HashingReader(src)
+        storage.put(key, reader)
+    return change, storage.uri(key), reader.sha256.hexdigest(), reader.size
+
+
+def _ingest(source: Source, previous_checksum: Optional[str], change: Change):
+    from .ingest import ingest_pdf, ingest_pdf_version
+
+    if source.type != "pdf":
+        return
+    with open_mmap(source.storage_uri) as data:
+        if previous_checksum:
+            ingest_pdf_version(source, data, version=(change.modified_at or now()).strftime("%Y-%m-%d %H:%M"),
+                               storage_uri=source.storage_uri)
+        else:
+            ingest_pdf(source, data)
+
+
+def _apply_transcript(connector: Connector, change: Change, uri: str) -> bool:
+    from .ingest import ingest_video_transcript
+
+    stem = os.path.splitext(change.name)[0].split(".")[0]
+    video = (ConnectorItem.objects.filter(connector=connector, source__type="video", name__startswith=stem + ".")
+             .select_related("source").first())
+    if not video or not video.source:
+        return False
+    backend, key = resolve(uri)
+    with backend.open(key) as fh:
+        ingest_video_transcript(video.source, fh.read().decode("utf-8-sig", errors="replace"))
+    return True
+
+
+def sync_connector(connector: Connector, max_workers: Optional[int] = None) -> Dict:
+    """
+    Run one incremental sync. Persists the new cursor, per-item ETags and the stats
+    it returns (throughput, skipped-as-unchanged, lag).
+    """
+    config = connector.config_json or {}
+    instrument_id = config.get("instrument_id")
+    if not instrument_id:
+        raise ConnectorError("config.instrument_id is required")
+    provider = get_provider(connector)
+    started, t0 = now(), time.monotonic()
+    changes, cursor, full_listing = provider.changes(connector.cursor)
+
+    known = {i.external_id: i for i in ConnectorItem.objects.filter(connector=connector).select_related("source")}
+    stats = {"listed": len(changes), "fetched": 0, "skipped_unchanged": 0, "unsupported": 0, "deleted": 0,
+             "failed": 0, "bytes": 0, "errors": []}
+    to_fetch, seen = [], set()
+    for change in changes:
+        seen.add(change.external_id)
+        item = known.get(change.external_id)
+        if change.deleted:
+            if item:
+                if item.source_id:
+                    Source.objects.filter(id=item.source_id).update(archived=True, archived_at=now(), status="archived")
+                item.delete()
+                stats["deleted"] += 1
+        elif item and item.etag == change.etag:
+            stats["skipped_unchanged"] += 1
+        elif not source_type(change.name) and not change.name.lower().endswith(_TRANSCRIPTS):
+            stats["unsupported"] += 1
+        else:
+            to_fetch.append(change)
+    if full_listing:
+        # a full listing also reveals deletions: anything known that was not listed is gone
+        gone = [i for eid, i in known.items() if eid not in seen]
+        Source.objects.filter(id__in=[i.source_id for i in gone if i.source_id]).update(
+            archived=True, archived_at=now(), status="archived")
+        ConnectorItem.objects.filter(id__in=[i.id for i in gone]).delete()
+        stats["deleted"] += len(gone)
+
+    lags, transcripts = [], []
+    workers = max_workers or settings.CONNECTOR_MAX_WORKERS
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_fetch, provider, connector.id, c) for c in to_fetch]
+        for future in as_completed(futures):
+            try:
+                change, uri, checksum, size = future.result()
+            except Exception as e:
+                stats["failed"] += 1
+                stats["errors"].append(str(e)[:200])
+                continue
+            stats["fetched"] += 1
+            stats["bytes"] += size
+            if change.modified_at:
+                lags.append((now() - change.modified_at).total_seconds())
+            if change.name.lower().endswith(_TRANSCRIPTS):
+                transcripts.append((change, uri))
+                continue
+            item = known.get(change.external_id)
+            source = item.source if item else None
+            previous = source.checksum if source else None
+            etag = change.etag
+            if source is None:
+                source = Source.objects.create(
+                    instrument_id=instrument_id, folder_id=config.get("folder_id"), type=source_type(change.name),
+                    title=change.name[:255], storage_uri=uri, checksum=checksum, status="uploaded")
+            elif previous != checksum:
+                changed = {"storage_uri": uri, "checksum": checksum}
+                if source.archived:
+                    # the file is back: un-archive it as a fresh upload, the ingestion below moves it on
+                    changed.update(archived=False, archived_at=None, status="uploaded")
+                Source.objects.filter(id=source.id).update(**changed)
+                for field, value in changed.items():
+                    setattr(source, field, value)
+            if previous != checksum:
+                try:
+                    _ingest(source, previous, change)
+                except Exception as e:
+                    # keep the source but not the ETag, so the next sync retries the ingestion
+                    etag = ""
+                    stats["failed"] += 1
+                    stats["errors"].append(f"{change.name}: {str(e)[:200]}")
+            ConnectorItem.objects.update_or_create(
+                connector=connector, external_id=change.external_id,
+                defaults={"name": change.name[:255], "etag": etag, "modified_at": change.modified_at, "source": source})
+    for change, uri in transcripts:
+        # the ETag only once applied: a transcript whose video has not synced yet, or that
+        # failed to ingest, is fetched again next time
+        etag = ""
+        try:
+            if _apply_transcript(connector, change, uri):
+                etag = change.etag
+        except Exception as e:
+            stats["failed"] += 1
+            stats["errors"].append(f"{change.name}: {str(e)[:200]}")
+        ConnectorItem.objects.update_or_create(
+            connector=connector, external_id=change.external_id,
+            defaults={"name": change.name[:255], "etag": etag, "modified_at": change.modified_at})
+
+    elapsed = time.monotonic() - t0
+    stats.update({
+        "started_at": started.isoformat(),
+        "elapsed_seconds": round(elapsed, 3),
+        "workers": workers,
+        "files_per_second": round(stats["fetched"] / elapsed, 2) if elapsed else None,
+        "mb_per_second": round(stats["bytes"] / 1e6 / elapsed, 2) if elapsed else None,
+        # how stale a change was when this sync picked it up
+        "lag_seconds_max": round(max(lags), 1) if lags else None,
+        "lag_seconds_avg": round(sum(lags) / len(lags), 1) if lags else None,
+        "since_last_sync_seconds": round((started - connector.last_synced_at).total_seconds(), 1) if connector.last_synced_at else None,
+        "errors": stats["errors"][:20],
+    })
+    if stats["deleted"] or stats["fetched"]:
+        # archivals above are queryset updates, which the Source signals do not see
+        rebuild_counts([instrument_id])
+        bump_version("sources", instrument_id)
+        bump_version("sources", "all")
+        bump_version("entities", instrument_id)
+    connector.cursor = cursor
+    connector.last_synced_at = started
+    connector.last_sync_stats = stats
+    connector.save(update_fields=["cursor", "last_synced_at", "last_sync_stats"])
+    return stats
+
+
+def sync_lock(connector_id):
+    """Cache key held while a connector syncs, so two syncs never share a cursor."""
+    return f"connector-sync:{connector_id}"
+
+
+def validate(connector: Connector):
+    """Raise ConnectorError for a config the engine cannot sync."""
+    if not (connector.config_json or {}).get("instrument_id"):
+        raise ConnectorError("config.instrument_id is required")
+    get_provider(connector)
+
+
+def try_sync(connector: Connector, max_workers: Optional[int] = None) -> Optional[Dict]:
+    """sync_connector under the per-connector lock; None if a sync is already running."""
+    key = sync_lock(connector.id)
+    if not cache.add(key, 1, timeout=settings.CONNECTOR_SYNC_TIMEOUT):
+        return None
+    try:
+        return sync_connector(connector, max_workers)
+    finally:
+        cache.delete(key)
+
+
+def start_sync(connector: Connector) -> bool:
+    """Run a sync on a background thread; False if one is already running."""
+    key = sync_lock(connector.id)
+    if not cache.add(key, 1, timeout=settings.CONNECTOR_SYNC_TIMEOUT):
+        return False
+
+    def run():
+        try:
+            sync_connector(connector)
+        except Exception as e:
+            Connector.objects.filter(id=connector.id).update(
+                last_sync_stats={"error": str(e)[:500], "started_at": now().isoformat()})
+        finally:
+            cache.delete(key)
+            connections.close_all()
+
+    threading.Thread(target=run, name=f"connector-sync-{connector.id}", daemon=True).start()
+    return True
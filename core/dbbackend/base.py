@@ -0,0 +1,202 @@
+# core/dbbackend/base.py
+"""
+PostgreSQL backend with connection instrumentation and an optional in-process pool.
+
+ENGINE "core.dbbackend" behaves like django.db.backends.postgresql, and also
+counts, per process:
+- how many physical connections were opened and how long connecting took;
+- how many requests reused a persistent connection (CONN_MAX_AGE);
+- how many connections were checked out of the pool, and how long that took.
+connection_stats() turns these into an estimate of the connect time saved.
+
+With OPTIONS["pool"] = {"max_size": n, "timeout": s, "check_after": s},
+connect() checks a psycopg2 connection out of a per-process pool and close()
+returns it (rolled back), so a request pays for a checkout instead of a TCP +
+auth handshake. Connections that are broken, or mid-transaction when Django
+gives them up, are discarded instead. Django 5.0 with psycopg2 has no built-in
+pool, hence this small one.
+"""
+import os
+import threading
+import time
+from collections import deque
+
+from django.db import OperationalError
+from django.db.backends.postgresql import base
+
+_stats_lock = threading.Lock()
+_stats = {"connects": 0, "connect_seconds": 0.0, "reuses": 0, "checkouts": 0, "checkout_seconds": 0.0, "discarded": 0}
+
+
+def _count(**deltas):
+    with _stats_lock:
+        for k, v in deltas.items():
+            _stats[k] += v
+
+
+def connection_stats() -> dict:
+    """This process's connection counters, with the connect time they saved (ms)."""
+    with _stats_lock:
+        s = dict(_stats)
+    connect_ms = s["connect_seconds"] * 1000 / s["connects"] if s["connects"] else None
+    checkout_ms = s["checkout_seconds"] * 1000 / s["checkouts"] if s["checkouts"] else 0.0
+    saved = None
+    if connect_ms is not None:
+        # a reused connection saves a full connect; a pool checkout saves a connect minus the checkout
+        saved = s["reuses"] * connect_ms + s["checkouts"] * max(connect_ms - checkout_ms, 0)
+    return {
+        "pid": os.getpid(),
+        "connects": s["connects"],
+        "connect_ms_avg": round(connect_ms, 3) if connect_ms is not None else None,
+        "reuses": s["reuses"],
+        "pool_checkouts": s["checkouts"],
+        "pool_checkout_ms_avg": round(checkout_ms, 3),
+        "pool_discarded": s["discarded"],
+        "saved_ms": round(saved, 1) if saved is not None else None,
+    }
+
+
+class ConnectionPool:
+    """Bounded LIFO pool of psycopg2 connections; get() waits up to `timeout` for a free slot."""
+
+    def __init__(self, max_size=20, timeout=10.0, check_after=30.0):
+        self._idle = deque()  # (connection, returned_at)
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self.timeout = timeout
+        self.check_after = check_after
+        self.pid = os.getpid()
+
+    def get(self, connect, health_check=True):
+        """An idle connection, or a new one from `connect()` when none is left."""
+        t0 = time.perf_counter()
+        if not self._slots.acquire(timeout=self.timeout):
+            raise OperationalError(f"database connection pool exhausted (waited {self.timeout}s)")
+        try:
+            while True:
+                with self._lock:
+                    conn, returned_at = self._idle.pop() if self._idle else (None, None)
+                if conn is None:
+                    return self._new(connect)
+                if health_check and time.monotonic() - returned_at > self.check_after and not _alive(conn):
+                    _count(discarded=1)
+                    _quiet_close(conn)
+                    continue
+                _count(checkouts=1, checkout_seconds=time.perf_counter() - t0)
+                return conn
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _new(self, connect):
+        t0 = time.perf_counter()
+        conn = connect()
+        _count(connects=1, connect_seconds=time.perf_counter() - t0)
+        return conn
+
+    def put(self, conn, discard=False):
+        """Return a connection (the caller then release()s its slot); broken or discarded ones are closed."""
+        try:
+            if not discard and not conn.closed:
+                if conn.info.transaction_status != base.Database.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                with self._lock:
+                    self._idle.append((conn, time.monotonic()))
+                return
+        except base.Database.Error:
+            pass
+        _count(discarded=1)
+        _quiet_close(conn)
+
+    def release(self):
+        self._slots.release()
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for conn, _ in idle:
+            _quiet_close(conn)
+
+
+def _alive(conn) -> bool:
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        return True
+    except base.Database.Error:
+        return False
+
+
+def _quiet_close(conn):
+    try:
+        conn.close()
+    except base.Database.Error:
+        pass
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._in_use = False
+
+    def _pool_options(self):
+        return self.settings_dict["OPTIONS"].get("pool")
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        params.pop("pool", None)
+        return params
+
+    def _pool(self) -> ConnectionPool:
+        key = self.alias
+        pool = _pools.get(key)
+        if pool is None or pool.pid != os.getpid():
+            with _pools_lock:
+                pool = _pools.get(key)
+                # a pool inherited through fork() shares sockets with the parent: start a new one
+                if pool is None or pool.pid != os.getpid():
+                    opts = self._pool_options()
+                    pool = _pools[key] = ConnectionPool(max_size=opts.get("max_size", 20), timeout=opts.get("timeout", 10.0),
+                                                        check_after=opts.get("check_after", 30.0))
+        return pool
+
+    def get_new_connection(self, conn_params):
+        if self._pool_options():
+            conn = self._pool().get(lambda: super(DatabaseWrapper, self).get_new_connection(conn_params),
+                                    health_check=self.settings_dict["CONN_HEALTH_CHECKS"])
+            # what the parent sets on connect (an explicit isolation level stays set on the connection)
+            level = self.settings_dict["OPTIONS"].get("isolation_level")
+            self.isolation_level = base.IsolationLevel(level) if level is not None else base.IsolationLevel.READ_COMMITTED
+            return conn
+        t0 = time.perf_counter()
+        conn = super().get_new_connection(conn_params)
+        _count(connects=1, connect_seconds=time.perf_counter() - t0)
+        return conn
+
+    def ensure_connection(self):
+        if self.connection is not None and not self._in_use:
+            # first use of a connection kept open from an earlier request (CONN_MAX_AGE)
+            _count(reuses=1)
+        super().ensure_connection()
+        self._in_use = True
+
+    def close_if_unusable_or_obsolete(self):
+        # called at request start and end: the next ensure_connection() starts a new "use"
+        self._in_use = False
+        super().close_if_unusable_or_obsolete()
+
+    def _close(self):
+        if self.connection is None or not self._pool_options():
+            return super()._close()
+        pool = _pools.get(self.alias)
+        if pool is None or pool.pid != os.getpid():
+            return super()._close()
+        try:
+            # a connection given up inside an atomic block may hold locks or half-done work
+            pool.put(self.connection, discard=self.in_atomic_block)
+        finally:
+            pool.release()
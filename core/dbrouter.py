@@ -0,0 +1,162 @@
+# core/dbrouter.py
+"""
+Read-replica routing: reads go to replicas, writes (and reads that must see them) to the primary.
+
+With DATABASE_REPLICA_URLS set, the settings add one alias per replica
+("replica1", ...) and install PrimaryReplicaRouter and ReplicaPinMiddleware:
+
+- db_for_read picks a replica round-robin among those in rotation; a replica
+  leaves rotation while its replay lag exceeds DB_REPLICA_MAX_LAG seconds or it
+  cannot be reached (measured at most every DB_REPLICA_CHECK_SECONDS per process).
+  With none in rotation, reads fall back to the primary.
+- Any write pins the rest of the request to the primary (read-your-writes), and a
+  short-lived cookie pins the same client's next requests for DB_REPLICA_PIN_SECONDS,
+  so e.g. citations_for_turn right after chat_ask sees the new turn.
+- Reads inside a transaction on the primary, and session reads, stay on the primary,
+  and so does everything outside a request (management commands, Celery tasks,
+  background threads), which may act on rows written a moment earlier.
+- primary() pins a block explicitly. Caches keyed on version counters fill inside
+  it, so a lagging replica cannot store pre-write data under a post-write version.
+
+Without replicas nothing is installed and every query uses "default".
+"""
+import contextvars
+import itertools
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+PRIMARY = "default"
+PIN_COOKIE = "rayni_primary"
+# apps whose reads must see the request's own writes immediately
+PRIMARY_APPS = {"sessions"}
+# 0 on a primary or a standby that has replayed everything it received, else seconds since the last replayed commit
+_LAG_SQL = ("SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+            "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END")
+
+# only requests (ReplicaPinMiddleware) unpin: commands, workers and threads read from the primary
+_pinned = contextvars.ContextVar("db_pinned", default=True)
+_wrote = contextvars.ContextVar("db_wrote", default=False)
+
+_lock = threading.Lock()
+_health: Dict[str, Dict] = {}  # alias -> {"lag", "error", "checked"}
+_routed = Counter()
+_rr = itertools.count()
+
+
+def replicas() -> List[str]:
+    return [alias for alias in settings.DATABASES if alias != PRIMARY]
+
+
+@contextmanager
+def primary():
+    """Route every query in the block to the primary."""
+    token = _pinned.set(True)
+    try:
+        yield
+    finally:
+        _pinned.reset(token)
+
+
+def _measure(alias: str):
+    try:
+        with connections[alias].cursor() as cursor:
+            cursor.execute(_LAG_SQL)
+            return float(cursor.fetchone()[0]), None
+    except DatabaseError as e:
+        connections[alias].close()
+        return None, str(e)[:200]
+
+
+def in_rotation(alias: str) -> bool:
+    """Whether `alias` is reachable and within DB_REPLICA_MAX_LAG; re-measured when the last check is stale."""
+    now = time.monotonic()
+    with _lock:
+        state = _health.setdefault(alias, {"lag": None, "error": "not checked yet", "checked": float("-inf")})
+        stale = now - state["checked"] >= settings.DB_REPLICA_CHECK_SECONDS
+        if stale:
+            # claim the check: other threads keep using the last result meanwhile
+            state["checked"] = now
+    if stale:
+        lag, error = _measure(alias)
+        with _lock:
+            state.update(lag=lag, error=error, checked=time.monotonic())
+    return state["error"] is None and state["lag"] is not None and state["lag"] <= settings.DB_REPLICA_MAX_LAG
+
+
+def _pick_replica() -> Optional[str]:
+    aliases = replicas()
+    start = next(_rr)
+    for i in range(len(aliases)):
+        alias = aliases[(start + i) % len(aliases)]
+        if in_rotation(alias):
+            return alias
+    return None
+
+
+def _route(alias: str) -> str:
+    with _lock:
+        _routed[alias] += 1
+    return alias
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if _pinned.get() or _wrote.get() or model._meta.app_label in PRIMARY_APPS or connections[PRIMARY].in_atomic_block:
+            return _route(PRIMARY)
+        return _route(_pick_replica() or PRIMARY)
+
+    def db_for_write(self, model, **hints):
+        _wrote.set(True)
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # every alias holds the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == PRIMARY
+
+
+class ReplicaPinMiddleware:
+    """Scopes the pin to the request; a client that just wrote reads from the primary for a few seconds."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        pinned, wrote = _pinned.set(PIN_COOKIE in request.COOKIES), _wrote.set(False)
+        try:
+            response = self.get_response(request)
+            if _wrote.get():
+                response.set_cookie(PIN_COOKIE, "1", max_age=settings.DB_REPLICA_PIN_SECONDS,
+                                    httponly=True, samesite="Lax")
+            return response
+        finally:
+            _pinned.reset(pinned)
+            _wrote.reset(wrote)
+
+
+def replica_status() -> Dict:
+    """Rotation state of each replica and where this process routed its reads."""
+    now = time.monotonic()
+    with _lock:
+        health = {alias: dict(state) for alias, state in _health.items()}
+        routed = dict(_routed)
+    out = []
+    for alias in replicas():
+        state = health.get(alias, {"lag": None, "error": "not checked yet", "checked": float("-inf")})
+        lag = state["lag"]
+        out.append({
+            "alias": alias,
+            "lag_seconds": round(lag, 3) if lag is not None else None,
+            "in_rotation": state["error"] is None and lag is not None and lag <= settings.DB_REPLICA_MAX_LAG,
+            "error": state["error"],
+            "checked_seconds_ago": round(now - state["checked"], 1) if state["checked"] > float("-inf") else None,
+        })
+    return {"replicas": out, "reads": routed, "max_lag_seconds": settings.DB_REPLICA_MAX_LAG}
@@ -0,0 +1,215 @@
+# core/entity_match.py
+"""
+Per-instrument entity detection for retrieval queries.
+
+An Aho-Corasick automaton is compiled for each instrument over its model names
+(Instrument.models_arr and the model_tags of its active sources), its own name
+and vendor, and the error codes mentioned in its source titles and descriptions. One
+pass over the normalized query finds every entity, at word boundaries and
+regardless of case or punctuation ("facsaria-fusion" is "FACSAria Fusion"), so
+short tokens like "LSM 980" survive. search_sources uses the hits to prefilter
+and boost sources before keyword ranking.
+
+Compiled matchers are cached per process under the ("entities", instrument)
+version counter. The Source and Instrument signals, bulk ops and connector
+syncs bump it when anything the matcher is built from changes, so it is rebuilt
+only then.
+"""
+import re
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from .dbrouter import primary
+from .models import Instrument, Source
+from .versioning import get_version
+
+# Source fields the matcher is built from; saves touching none of them keep it
+ENTITY_FIELDS = ("model_tags", "title", "description", "archived", "status")
+ENTITY_NAMES = {*ENTITY_FIELDS, "instrument", "instrument_id"}
+
+_SEP = re.compile(r"[^0-9a-z]+")
+_MODEL_NO = re.compile(r"(?=.*\d)[a-z0-9]{2,}", re.I)
+# "error E-1042", "code 0x1F", "fault #217": the code itself is group 1
+_CODE = re.compile(r"\b(?:error|err|code|fault|alarm)s?\s*#?\s*([a-z]{0,3}-?\d{2,5}|0x[0-9a-f]{1,8})\b", re.I)
+
+
+def normalize(text: str) -> str:
+    """Lowercase words separated by single spaces, padded with a space on each side."""
+    return f" {_SEP.sub(' ', (text or '').lower()).strip()} "
+
+
+@dataclass
+class Entity:
+    term: str                                    # normalized, e.g. "lsm 980"
+    kind: str                                    # "model", "instrument" (name, vendor) or "code"
+    labels: set = field(default_factory=set)     # model_tags values it stands for (its own or the tagged model it extends)
+    source_ids: set = field(default_factory=set)
+
+
+@dataclass
+class Detection:
+    entities: List[Entity]
+    residual: str            # the normalized query with the matched entities blanked out
+
+    def of_kind(self, kind: str) -> List[Entity]:
+        return [e for e in self.entities if e.kind == kind]
+
+
+class Matcher:
+    """Aho-Corasick automaton over space-padded normalized terms (term -> the entity it spells)."""
+
+    def __init__(self, entities: Dict[str, Entity]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._out: List[List[Tuple[int, Entity]]] = [[]]
+        for term, entity in entities.items():
+            state = 0
+            for ch in f" {term} ":
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = self._goto[state][ch] = len(self._goto)
+                    self._goto.append({})
+                    self._out.append([])
+                state = nxt
+            self._out[state].append((len(term), entity))
+        self._fail = [0] * len(self._goto)
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                f = self._fail[state]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[nxt] = self._goto[f].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def find(self, query: str) -> Detection:
+        """Leftmost-longest non-overlapping entities in `query`, found in one pass."""
+        text = normalize(query)
+        hits = []
+        state = 0
+        for i, ch in enumerate(text):
+            while state and ch not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(ch, 0)
+            for length, entity in self._out[state]:
+                # the padding spaces of adjacent terms overlap, so spans exclude them
+                hits.append((i - length, i, entity))
+        hits.sort(key=lambda h: (h[0], -(h[1] - h[0])))
+        found, residual, end = [], list(text), -1
+        for start, stop, entity in hits:
+            if start < end:
+                continue
+            if not any(entity is e for e in found):
+                found.append(entity)
+            residual[start:stop] = " " * (stop - start)
+            end = stop
+        return Detection(found, "".join(residual))
+
+
+def error_codes(text: str) -> List[str]:
+    """Normalized error codes mentioned in `text` ("Error E-1042" -> "e 1042")."""
+    return [normalize(m).strip() for m in _CODE.findall(text or "")]
+
+
+def build_matcher(instrument_id) -> Matcher:
+    entities: Dict[str, Entity] = {}
+
+    def add(label, kind, source_id=None):
+        term = normalize(label).strip()
+        if not term:
+            return
+        entity = entities.setdefault(term, Entity(term, kind))
+        if kind == "model":
+            # a model tag that is also the instrument name is still a model
+            entity.kind = "model"
+        if source_id is not None:
+            entity.source_ids.add(source_id)
+            if kind == "model":
+                entity.labels.add(label)
+
+    instrument = Instrument.objects.filter(id=instrument_id).values("name", "vendor", "models_arr").first() or {}
+    vendor, name = instrument.get("vendor") or "", instrument.get("name") or ""
+    for term in (vendor, vendor.split(" ")[0], name):
+        add(term, "instrument")
+    for model in instrument.get("models_arr") or []:
+        # variants are often suffixes ("Lumos", "3"): match them with the instrument name,
+        # and on their own only when they read like a model number ("A1", "600 MHz")
+        add(f"{name} {model}", "model")
+        if _MODEL_NO.search(model):
+            add(model, "model")
+    rows = (Source.objects.filter(instrument_id=instrument_id, archived=False).exclude(status="rejected")
+            .values_list("id", "model_tags", "title", "description"))
+    for source_id, tags, title, description in rows:
+        for tag in tags or []:
+            add(tag, "model", source_id)
+        for code in error_codes(f"{title} {description or ''}"):
+            add(code, "code", source_id)
+    # a variant ("LSM 980 Airyscan 2") stands for the tags of the model it extends ("LSM 980"),
+    # which leftmost-longest matching would otherwise hide behind it
+    tagged = [e for e in entities.values() if e.labels]
+    for entity in entities.values():
+        if entity.kind == "model":
+            for tag in tagged:
+                if tag is not entity and f" {tag.term} " in f" {entity.term} ":
+                    entity.labels |= tag.labels
+    # "LSM980" is written as often as "LSM 980"
+    for term, entity in list(entities.items()):
+        if entity.kind == "model" and " " in term:
+            entities.setdefault(term.replace(" ", ""), entity)
+    return Matcher(entities)
+
+
+_matchers: Dict[str, Tuple[int, Matcher]] = {}
+_lock = threading.Lock()
+
+
+def matcher_for(instrument_id) -> Matcher:
+    """The instrument's compiled matcher; rebuilt when its ("entities", id) version moved."""
+    key = str(instrument_id)
+    version = get_version("entities", key)
+    cached = _matchers.get(key)
+    if cached and cached[0] == version:
+        return cached[1]
+    with _lock:
+        cached = _matchers.get(key)
+        if cached and cached[0] == version:
+            return cached[1]
+        with primary():  # cached under `version`: must not come from a lagging replica
+            matcher = build_matcher(instrument_id)
+        _matchers[key] = (version, matcher)
+        return matcher
+
+
+def detect(instrument_id, query: str) -> Detection:
+    """Entities of the instrument mentioned in `query`, plus any error code the matcher does not know."""
+    detection = matcher_for(instrument_id).find(query)
+    known = {e.term for e in detection.of_kind("code")}
+    for code in error_codes(query):
+        if code not in known:
+            detection.entities.append(Entity(code, "code"))
+    return detection
+
+
+def entity_terms(source) -> FrozenSet[str]:
+    """What a Source contributes to its instrument's matcher."""
+    if source.archived or source.status == "rejected":
+        return frozenset()
+    return frozenset([*(f"model:{t}" for t in source.model_tags or []),
+                      *(f"code:{c}" for c in error_codes(f"{source.title} {source.description or ''}"))])
+
+
+def stored_terms(source, update_fields=None, row: Optional[Dict] = None) -> Optional[FrozenSet[str]]:
+    """
+    entity_terms() of the row as stored; None for a new source or a save of fields the matcher ignores.
+    `row` holds the ENTITY_FIELDS values already read for this save ({} if the row is gone).
+    """
+    if source._state.adding:
+        return None
+    if update_fields is not None and not set(update_fields) & ENTITY_NAMES:
+        return None
+    if row is None:
+        row = Source.objects.filter(id=source.id).values(*ENTITY_FIELDS).first()
+    return entity_terms(Source(**{f: row[f] for f in ENTITY_FIELDS})) if row else frozenset()
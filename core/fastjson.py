@@ -0,0 +1,71 @@
+# core/fastjson.py
+"""
+Fast JSON encoding for API responses and SSE payloads.
+
+Uses orjson when it is installed, the stdlib json module otherwise. Both paths
+serialize UUIDs, datetimes (UTC as "Z", like DRF), dates and times natively, so
+views can hand over model values (e.g. from .values()) without converting them
+to str first; anything else goes through DRF's own JSONEncoder.default
+(Decimal, lazy strings, querysets, ...). Output is compact UTF-8.
+"""
+import json
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder as _DRFEncoder
+
+try:
+    import orjson
+except ImportError:  # optional speedup
+    orjson = None
+
+_drf_default = _DRFEncoder().default
+BACKEND = "orjson" if orjson else "json"
+
+
+if orjson:
+    _OPTS = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+
+    def dumps(obj, indent: bool = False) -> bytes:
+        return orjson.dumps(obj, default=_drf_default, option=_OPTS | (orjson.OPT_INDENT_2 if indent else 0))
+
+    def loads(data):
+        return orjson.loads(data)
+else:
+    def dumps(obj, indent: bool = False) -> bytes:
+        return json.dumps(obj, cls=_DRFEncoder, ensure_ascii=False, allow_nan=False,
+                          indent=2 if indent else None, separators=None if indent else (",", ":")).encode("utf-8")
+
+    def loads(data):
+        return json.loads(data)
+
+
+def dumps_str(obj) -> str:
+    """dumps() as text, for the SSE buffers (which store str)."""
+    return dumps(obj).decode("utf-8")
+
+
+class FastJSONRenderer(BaseRenderer):
+    """Drop-in for rest_framework.renderers.JSONRenderer; indents when the browsable API asks for it."""
+    media_type = "application/json"
+    format = "json"
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        indent = bool((renderer_context or {}).get("indent"))
+        return dumps(data, indent=indent)
+
+
+class FastJSONParser(BaseParser):
+    """Drop-in for rest_framework.parsers.JSONParser."""
+    media_type = "application/json"
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return loads(stream.read())
+        except ValueError as exc:
+            raise ParseError(f"JSON parse error - {exc}")
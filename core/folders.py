@@ -0,0 +1,48 @@
+# core/folders.py
+"""
+Folder tree reads over the materialized Folder.path.
+
+The nested tree of an instrument is one ordered query (parents sort before
+their children by path), assembled in Python and cached under the instrument's
+("folders", ...) and ("sources", ...) versions, so any folder save / move /
+delete or source change rebuilds it on the next read.
+"""
+import uuid
+from typing import Dict, List, Optional
+
+from django.core.cache import cache
+from django.db.models import Count, Q
+
+from .dbrouter import primary
+from .models import Folder
+from .versioning import get_version
+
+
+def folder_tree(instrument_id) -> List[Dict]:
+    """Nested folders of an instrument: {id, name, parent, path, source_count, children[]}."""
+    key = f"foldertree:{instrument_id}:{get_version('folders', instrument_id)}:{get_version('sources', instrument_id)}"
+    tree = cache.get(key)
+    if tree is not None:
+        return tree
+    with primary():  # cached under the current versions: must not come from a lagging replica
+        rows = list(Folder.objects.filter(instrument_id=instrument_id).order_by("path")
+                    .annotate(source_count=Count("source", filter=Q(source__archived=False)))
+                    .values("id", "name", "parent_id", "path", "source_count"))
+    nodes, roots = {}, []
+    for r in rows:
+        node = {"id": str(r["id"]), "name": r["name"], "parent": str(r["parent_id"]) if r["parent_id"] else None,
+                "path": r["path"], "source_count": r["source_count"], "children": []}
+        nodes[node["id"]] = node
+        parent = nodes.get(node["parent"])
+        (parent["children"] if parent else roots).append(node)
+    cache.set(key, roots, timeout=24 * 3600)
+    return roots
+
+
+def subtree_root(folder_id) -> Optional[Dict]:
+    """{instrument_id, path} of a folder; sources below it match both on folder (folder_path_idx)."""
+    try:
+        folder_id = uuid.UUID(str(folder_id))
+    except ValueError:
+        return None
+    return Folder.objects.filter(id=folder_id).values("instrument_id", "path").first()
@@ -0,0 +1,158 @@
+# core/fragment_index.py
+"""
+Precomputed per-source fragment index for the Proof Viewer.
+
+All fragments of a source are loaded once, packed into flat arrays (ids as
+16-byte blobs, bboxes / time spans as int32 / float64 arrays, rows ordered by
+page or time) and cached, together with the source metadata the viewer needs.
+Opening a citation is then one cache lookup plus a binary search, instead of
+querying and serializing every fragment of a large manual.
+
+Indexes are keyed on a version counter ("viewer", source_id) that is bumped
+when the source or a single fragment row is saved or deleted (signals), or its
+fragments are rewritten in bulk (invalidate_fragment_index, called by the
+ingestion/storage code).
+"""
+import threading
+import uuid
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from django.core.cache import cache
+
+from .dbrouter import primary
+from .models import Source, PDFFragment, PackedFragmentPage, VideoFragment, ImageFragment
+from .versioning import get_version, bump_version
+
+# fields packed per row, by fragment kind
+_LAYOUT = {
+    "pdf": ("i", ("page", "bbox_x", "bbox_y", "bbox_w", "bbox_h")),
+    "video": ("d", ("t_start", "t_end")),
+    "image": ("i", ("region_x", "region_y", "region_w", "region_h")),
+}
+_ORDER = {"pdf": ("page", "bbox_y", "bbox_x"), "video": ("t_start",), "image": ("id",)}
+_TEXT = {"video": "transcript_text", "image": "alt_text"}
+_MODELS = {"pdf": PDFFragment, "video": VideoFragment, "image": ImageFragment}
+
+
+class FragmentIndex:
+    def __init__(self, kind: str, source: Dict, ids: bytes, nums: array, texts: Optional[list]):
+        self.kind = kind
+        self.source = source
+        self.ids = ids
+        self.nums = nums
+        self.texts = texts
+        self.width = len(_LAYOUT[kind][1])
+        self.by_id = array("i", sorted(range(len(self)), key=lambda r: ids[16 * r:16 * r + 16]))
+        # video rows are ordered by t_start: a sorted interval index for time lookups
+        self.starts = nums[0::self.width] if kind == "video" else None
+
+    def __len__(self):
+        return len(self.ids) // 16
+
+    def _id_at(self, row: int) -> bytes:
+        return self.ids[16 * row:16 * row + 16]
+
+    def find(self, fragment_id) -> Optional[int]:
+        """Row of `fragment_id`, or None."""
+        key = uuid.UUID(str(fragment_id)).bytes
+        lo, hi = 0, len(self.by_id)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._id_at(self.by_id[mid]) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self.by_id) and self._id_at(self.by_id[lo]) == key:
+            return self.by_id[lo]
+        return None
+
+    def field(self, row: int, i: int):
+        return self.nums[row * self.width + i]
+
+    def fragment_id(self, row: int) -> str:
+        return str(uuid.UUID(bytes=self._id_at(row)))
+
+    def text(self, row: int) -> Optional[str]:
+        return self.texts[row] if self.texts is not None else None
+
+    def at_time(self, t: float) -> Optional[int]:
+        """Row of the video fragment playing at `t` seconds, or None in a gap / past the end."""
+        row = bisect_right(self.starts, t) - 1
+        if row < 0 or t > self.field(row, 1):
+            return None
+        return row
+
+
+def index_from_rows(kind: str, src: Dict, rows) -> FragmentIndex:
+    """Pack (id, *fields[, text]) tuples, already in index order, into a FragmentIndex."""
+    typecode, fields = _LAYOUT[kind]
+    with_text = kind in _TEXT
+    ids, nums, texts = bytearray(), array(typecode), ([] if with_text else None)
+    for r in rows:
+        ids += r[0].bytes
+        nums.extend(-1 if v is None else v for v in r[1:1 + len(fields)])
+        if with_text:
+            texts.append(r[-1])
+    return FragmentIndex(kind, src, bytes(ids), nums, texts)
+
+
+def index_from_packed_pages(src: Dict, pages) -> FragmentIndex:
+    """Build a PDF FragmentIndex from (page, ids_blob, bboxes_blob) tuples ordered by page."""
+    from .fragment_store import i32_array
+    ids, nums = bytearray(), array("i")
+    for page, blob, bboxes in pages:
+        b = i32_array(bboxes)
+        for i in range(0, len(b), 4):
+            nums.append(page)
+            nums.extend(b[i:i + 4])
+        ids += bytes(blob)
+    return FragmentIndex("pdf", src, bytes(ids), nums, None)
+
+
+def _build(kind: str, source_id) -> Optional[FragmentIndex]:
+    src = Source.objects.filter(id=source_id).values("id", "title", "type", "version", "checksum").first()
+    if not src:
+        return None
+    src["id"] = str(src["id"])
+    if kind == "pdf":
+        # FRAGMENT_STORAGE=packed: index straight from the page blobs, no per-fragment rows
+        pages = list(PackedFragmentPage.objects.filter(source_id=source_id).order_by("page").values_list("page", "ids", "bboxes"))
+        if pages:
+            return index_from_packed_pages(src, pages)
+    text_field = _TEXT.get(kind)
+    cols = ("id",) + _LAYOUT[kind][1] + ((text_field,) if text_field else ())
+    return index_from_rows(kind, src, _MODELS[kind].objects.filter(source_id=source_id).order_by(*_ORDER[kind]).values_list(*cols))
+
+
+_local = OrderedDict()
+_local_lock = threading.Lock()
+_LOCAL_MAX = 256
+
+
+def get_fragment_index(source_id, kind: str) -> Optional[FragmentIndex]:
+    """Cached FragmentIndex of `kind` ("pdf"|"video"|"image") for a source; None if the source is missing."""
+    key = f"fragidx:{kind}:{source_id}:{get_version('viewer', source_id)}"
+    with _local_lock:
+        idx = _local.get(key)
+        if idx is not None:
+            _local.move_to_end(key)
+            return idx
+    idx = cache.get(key)
+    if idx is None:
+        with primary():  # cached under the current version: must not come from a lagging replica
+            idx = _build(kind, source_id)
+        if idx is None:
+            return None
+        cache.set(key, idx, timeout=24 * 3600)
+    with _local_lock:
+        _local[key] = idx
+        while len(_local) > _LOCAL_MAX:
+            _local.popitem(last=False)
+    return idx
+
+
+def invalidate_fragment_index(source_id):
+    bump_version("viewer", source_id)
@@ -0,0 +1,196 @@
+# core/fragment_store.py
+"""
+PDF fragment storage behind a single API, in one of two layouts:
+
+  rows   - one PDFFragment row per fragment (UUID pk, five int columns, text hash).
+  packed - one PackedFragmentPage row per page holding int32 bbox arrays, the
+           fragment UUIDs and offsets into one text blob. A 1,000-page manual
+           becomes ~1,000 rows instead of 100k+.
+
+FRAGMENT_STORAGE picks the layout for new ingestions; reads work against
+whichever layout a source was stored in. Fragment IDs are stable in both.
+"""
+import hashlib
+import re
+import sys
+import uuid
+from array import array
+from itertools import groupby
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import PDFFragment, PackedFragmentPage
+from .fragment_index import invalidate_fragment_index
+
+
+class Fragment(NamedTuple):
+    id: str
+    page: int
+    bbox: Tuple[int, int, int, int]  # x, y, w, h
+    text_hash: str
+    text: Optional[str]  # None for the rows layout, which only keeps the hash
+
+
+def text_hash(text: str) -> str:
+    """SHA-256 of whitespace-normalized text; used for change detection between versions."""
+    return hashlib.sha256(re.sub(r"\s+", " ", text or "").strip().encode("utf-8")).hexdigest()
+
+
+def delete_fragment_rows(queryset) -> int:
+    """
+    DELETE the fragment rows of `queryset` in one statement, without the per-row
+    fragment_changed signals (which make Django load every row first). Nothing
+    references fragment rows, so there is nothing to cascade; the caller
+    invalidates the fragment index once instead. Returns the rows deleted.
+    """
+    return queryset._raw_delete(queryset.db)
+
+
+def storage_mode() -> str:
+    return getattr(settings, "FRAGMENT_STORAGE", "rows")
+
+
+def i32_bytes(values: Iterable[int]) -> bytes:
+    arr = array("i", values)
+    if sys.byteorder == "big":
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def i32_array(blob) -> array:
+    arr = array("i")
+    arr.frombytes(bytes(blob))
+    if sys.byteorder == "big":
+        arr.byteswap()
+    return arr
+
+
+def pack_page(source_id, page: int, fragments: List[Dict]) -> PackedFragmentPage:
+    """Pack one page's fragments (dicts with id, bbox, text), ordered top-to-bottom."""
+    fragments = sorted(fragments, key=lambda f: (f["bbox"][1], f["bbox"][0]))
+    offsets, texts, pos = [0], [], 0
+    for f in fragments:
+        texts.append(f.get("text") or "")
+        pos += len(texts[-1])
+        offsets.append(pos)
+    text = "".join(texts)
+    bboxes = i32_bytes(v for f in fragments for v in f["bbox"])
+    # layout is part of the hash: moved or resized blocks rewrite the page, as in rows mode
+    digest = hashlib.sha256("\x1f".join(text_hash(t) for t in texts).encode())
+    digest.update(bboxes)
+    return PackedFragmentPage(
+        source_id=source_id, page=page, count=len(fragments),
+        ids=b"".join(uuid.UUID(str(f["id"])).bytes for f in fragments),
+        bboxes=bboxes, text_offsets=i32_bytes(offsets), text=text,
+        page_hash=digest.hexdigest(),
+    )
+
+
+def unpack_page(row: PackedFragmentPage) -> List[Fragment]:
+    ids, bboxes, offsets = bytes(row.ids), i32_array(row.bboxes), i32_array(row.text_offsets)
+    out = []
+    for i in range(row.count):
+        text = row.text[offsets[i]:offsets[i + 1]]
+        out.append(Fragment(str(uuid.UUID(bytes=ids[16 * i:16 * i + 16])), row.page,
+                            tuple(bboxes[4 * i:4 * i + 4]), text_hash(text), text))
+    return out
+
+
+def save_pdf_fragments(source_id, fragments: Iterable[Dict], mode: Optional[str] = None) -> List[str]:
+    """
+    Replace all PDF fragments of a source.
+
+    `fragments` are dicts with page, bbox (x, y, w, h) and text, plus an optional
+    id to carry an existing fragment ID forward. Returns the fragment IDs.
+    """
+    mode = mode or storage_mode()
+    fragments = [dict(f, id=str(f.get("id") or uuid.uuid4())) for f in fragments]
+    with transaction.atomic():
+        delete_fragment_rows(PDFFragment.objects.filter(source_id=source_id))
+        PackedFragmentPage.objects.filter(source_id=source_id).delete()
+        if mode == "packed":
+            fragments.sort(key=lambda f: f["page"])
+            PackedFragmentPage.objects.bulk_create(
+                [pack_page(source_id, page, list(group)) for page, group in groupby(fragments, key=lambda f: f["page"])],
+                batch_size=200)
+        else:
+            PDFFragment.objects.bulk_create([
+                PDFFragment(id=f["id"], source_id=source_id, page=f["page"],
+                            bbox_x=f["bbox"][0], bbox_y=f["bbox"][1], bbox_w=f["bbox"][2], bbox_h=f["bbox"][3],
+                            text_hash=f.get("text_hash") or text_hash(f.get("text") or ""))
+                for f in fragments], batch_size=2000)
+    invalidate_fragment_index(source_id)
+    return [f["id"] for f in fragments]
+
+
+def stored_layout(source_id) -> Optional[str]:
+    """"packed", "rows", or None if the source has no PDF fragments."""
+    if PackedFragmentPage.objects.filter(source_id=source_id).exists():
+        return "packed"
+    if PDFFragment.objects.filter(source_id=source_id).exists():
+        return "rows"
+    return None
+
+
+def sync_pdf_fragments(source_id, fragments: Iterable[Dict], mode: Optional[str] = None) -> Dict[str, int]:
+    """
+    Make the stored PDF fragments of a source equal `fragments`, writing only the difference.
+
+    Like save_pdf_fragments, but rows that are unchanged (same id, page, bbox and
+    text hash) or packed pages whose content is unchanged are left alone.
+    Falls back to a full rewrite when the source is stored in another layout.
+    Returns counts of written (created / updated) and deleted rows.
+    """
+    mode = mode or storage_mode()
+    if stored_layout(source_id) not in (None, mode):
+        ids = save_pdf_fragments(source_id, fragments, mode=mode)
+        return {"written": len(ids), "deleted": 0}
+    fragments = [dict(f, id=str(f.get("id") or uuid.uuid4())) for f in fragments]
+    written = deleted = 0
+    with transaction.atomic():
+        if mode == "packed":
+            fragments.sort(key=lambda f: f["page"])
+            new_pages = {page: pack_page(source_id, page, list(group)) for page, group in groupby(fragments, key=lambda f: f["page"])}
+            old_pages = {p: (h, bytes(i)) for p, h, i in PackedFragmentPage.objects.filter(source_id=source_id).values_list("page", "page_hash", "ids")}
+            stale = [p for p in old_pages if p not in new_pages or old_pages[p] != (new_pages[p].page_hash, new_pages[p].ids)]
+            fresh = [row for p, row in new_pages.items() if p not in old_pages or p in stale]
+            deleted, _ = PackedFragmentPage.objects.filter(source_id=source_id, page__in=stale).delete()
+            PackedFragmentPage.objects.bulk_create(fresh, batch_size=200)
+            written = len(fresh)
+        else:
+            old = {str(r[0]): r[1:] for r in PDFFragment.objects.filter(source_id=source_id)
+                   .values_list("id", "page", "bbox_x", "bbox_y", "bbox_w", "bbox_h", "text_hash")}
+            create, update = [], []
+            for f in fragments:
+                row = PDFFragment(id=f["id"], source_id=source_id, page=f["page"],
+                                  bbox_x=f["bbox"][0], bbox_y=f["bbox"][1], bbox_w=f["bbox"][2], bbox_h=f["bbox"][3],
+                                  text_hash=f.get("text_hash") or text_hash(f.get("text") or ""))
+                prev = old.pop(f["id"], None)
+                if prev is None:
+                    create.append(row)
+                elif prev != (row.page, row.bbox_x, row.bbox_y, row.bbox_w, row.bbox_h, row.text_hash):
+                    update.append(row)
+            if old:
+                deleted = delete_fragment_rows(PDFFragment.objects.filter(id__in=list(old)))
+            PDFFragment.objects.bulk_create(create, batch_size=2000)
+            PDFFragment.objects.bulk_update(update, ["page", "bbox_x", "bbox_y", "bbox_w", "bbox_h", "text_hash"], batch_size=2000)
+            written = len(create) + len(update)
+    if written or deleted:
+        invalidate_fragment_index(source_id)
+    return {"written": written, "deleted": deleted}
+
+
+def pdf_fragments(source_id, page: Optional[int] = None) -> List[Fragment]:
+    """Fragments of a source (optionally one page), ordered by page and position."""
+    packed = PackedFragmentPage.objects.filter(source_id=source_id).order_by("page")
+    if page is not None:
+        packed = packed.filter(page=page)
+    if packed.exists():
+        return [f for row in packed for f in unpack_page(row)]
+    rows = PDFFragment.objects.filter(source_id=source_id).order_by("page", "bbox_y", "bbox_x")
+    if page is not None:
+        rows = rows.filter(page=page)
+    return [Fragment(str(r.id), r.page, (r.bbox_x, r.bbox_y, r.bbox_w, r.bbox_h), r.text_hash, None) for r in rows]
+
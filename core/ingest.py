@@ -0,0 +1,331 @@
+# core/ingest.py
+"""
+Source ingestion: turn uploaded files into fragments the viewer and retrieval can use.
+"""
+import hashlib
+import os
+import re
+import uuid
+from collections import defaultdict, deque
+from io import BytesIO, RawIOBase
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchVector
+from django.db import transaction
+
+from .models import Source, SourceVersion, VideoFragment
+from .fragment_index import invalidate_fragment_index
+from .fragment_store import save_pdf_fragments, sync_pdf_fragments, pdf_fragments, text_hash, delete_fragment_rows
+
+
+class _MappedPDF(RawIOBase):
+    """File interface over a read-only mmap, for pdfminer (which only accepts IOBase streams)."""
+
+    def __init__(self, mm):
+        self.mm = mm
+        mm.seek(0)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, pos, whence=0):
+        self.mm.seek(pos, whence)
+        return self.mm.tell()
+
+    def tell(self):
+        return self.mm.tell()
+
+    def read(self, n=-1):
+        return self.mm.read(n if n is not None and n >= 0 else None)
+
+    def readinto(self, b):
+        data = self.mm.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+
+def _pdf_stream(pdf):
+    """A seekable stream over PDF bytes; a read-only mmap (storage.open_mmap) is read in place, uncopied."""
+    if isinstance(pdf, (bytes, bytearray, memoryview)):
+        return BytesIO(pdf)
+    return _MappedPDF(pdf)
+
+
+def extract_pdf_fragments(pdf_bytes: bytes, max_pages: Optional[int] = None,
+                          pages: Optional[Iterable[int]] = None) -> Iterator[Dict]:
+    """
+    Yield one fragment per text block of a PDF, using pdfminer.six layout analysis.
+
+    Each fragment is {"page": 1-based page, "bbox": (x, y, w, h), "text": str} with
+    the bbox in PDF points measured from the top-left corner, as the viewer draws it.
+    `pdf_bytes` may be bytes or a read-only mmap. `pages` restricts layout analysis to those 1-based page numbers.
+    """
+    from pdfminer.high_level import extract_pages
+    from pdfminer.layout import LAParams, LTTextContainer
+
+    if pages is not None:
+        numbers = sorted(set(pages))
+        if not numbers:
+            return
+        layouts = zip(numbers, extract_pages(_pdf_stream(pdf_bytes), laparams=LAParams(), page_numbers={n - 1 for n in numbers}))
+    else:
+        layouts = enumerate(extract_pages(_pdf_stream(pdf_bytes), laparams=LAParams(), maxpages=max_pages or 0), 1)
+    for page_no, layout in layouts:
+        height = layout.height
+        for element in layout:
+            if not isinstance(element, LTTextContainer):
+                continue
+            text = element.get_text().strip()
+            if not text:
+                continue
+            x0, y0, x1, y1 = element.bbox
+            yield {
+                "page": page_no,
+                "bbox": (int(x0), int(height - y1), int(round(x1 - x0)), int(round(y1 - y0))),
+                "text": text,
+            }
+
+
+def _failed(source: Source):
+    """Leave a source whose ingestion raised as "failed" rather than "processing"."""
+    source.status = "failed"
+    source.save(update_fields=["status"])
+
+
+def ingest_pdf(source: Source, pdf_bytes: bytes, storage: Optional[str] = None) -> int:
+    """
+    Extract and store all fragments of a PDF source; returns the fragment count.
+
+    Records a SourceVersion with the page hashes, so the next revision can be
+    ingested incrementally with ingest_pdf_version.
+    """
+    source.status = "processing"
+    source.save(update_fields=["status"])
+    try:
+        page_hashes = pdf_page_hashes(pdf_bytes)
+        ids = save_pdf_fragments(source.id, extract_pdf_fragments(pdf_bytes), mode=storage)
+        SourceVersion.objects.create(source=source, version=source.version or "1", storage_uri=source.storage_uri or "",
+                                     checksum=source.checksum or hashlib.sha256(pdf_bytes).hexdigest(),
+                                     page_hashes=page_hashes)
+    except Exception:
+        _failed(source)
+        raise
+    source.status = "parsed"
+    source.save(update_fields=["status"])
+    return len(ids)
+
+
+
+def pdf_page_hashes(pdf_bytes: bytes) -> List[str]:
+    """
+    SHA-256 per page of the raw content streams and media box.
+
+    Much cheaper than layout analysis, so unchanged pages of a new version can be
+    recognised without extracting them.
+    """
+    from pdfminer.pdfdocument import PDFDocument
+    from pdfminer.pdfpage import PDFPage
+    from pdfminer.pdfparser import PDFParser
+    from pdfminer.pdftypes import resolve1
+
+    hashes = []
+    for page in PDFPage.create_pages(PDFDocument(PDFParser(_pdf_stream(pdf_bytes)))):
+        h = hashlib.sha256(repr(page.mediabox).encode())
+        for stream in page.contents:
+            stream = resolve1(stream)
+            if hasattr(stream, "get_data"):
+                h.update(stream.get_data())
+        hashes.append(h.hexdigest())
+    return hashes
+
+
+def ingest_pdf_version(source: Source, pdf_bytes: bytes, version: str, storage_uri: Optional[str] = None,
+                       storage: Optional[str] = None) -> Dict:
+    """
+    Ingest a new revision of a PDF source, reusing everything that did not change.
+
+    Pages whose raw content hash matches a page of the previous SourceVersion
+    (also when they moved) keep their fragments and IDs without layout analysis.
+    Only the remaining pages are extracted; their fragments take over the ID of
+    an old fragment with the same text hash (same page preferred), so citations
+    to unchanged text stay valid. Only the difference is written. Records a
+    SourceVersion with the page hashes and returns counts plus the IDs of new
+    fragments, which are the only ones that need re-indexing / re-embedding.
+    """
+    page_hashes = pdf_page_hashes(pdf_bytes)
+    prev = (SourceVersion.objects.filter(source=source).exclude(page_hashes=[])
+            .order_by("-created_at").values_list("page_hashes", flat=True).first()) or []
+
+    source.status = "processing"
+    source.save(update_fields=["status"])
+
+    try:
+        old_by_page = defaultdict(list)
+        for f in pdf_fragments(source.id):
+            old_by_page[f.page].append(f)
+
+        # new page -> old page with identical content
+        unchanged_at = defaultdict(deque)
+        for old_page, h in enumerate(prev, 1):
+            unchanged_at[h].append(old_page)
+        reused, changed = {}, []
+        for page, h in enumerate(page_hashes, 1):
+            if unchanged_at.get(h):
+                reused[page] = unchanged_at[h].popleft()
+            else:
+                changed.append(page)
+
+        fragments = [
+            {"id": f.id, "page": page, "bbox": f.bbox, "text": f.text, "text_hash": f.text_hash}
+            for page, old_page in reused.items() for f in old_by_page.get(old_page, ())
+        ]
+        # fragments of pages that changed or went away can still be matched by text
+        reused_old = set(reused.values())
+        by_text = defaultdict(list)
+        for old_page, frags in old_by_page.items():
+            if old_page not in reused_old:
+                for f in frags:
+                    by_text[f.text_hash].append(f)
+        new_ids, kept = [], 0
+        for f in extract_pdf_fragments(pdf_bytes, pages=changed):
+            h = text_hash(f["text"])
+            candidates = by_text.get(h)
+            if candidates:
+                match = next((c for c in candidates if c.page == f["page"]), candidates[0])
+                candidates.remove(match)
+                f["id"] = match.id
+                kept += 1
+            f["text_hash"] = h
+            fragments.append(f)
+            if "id" not in f:
+                f["id"] = str(uuid.uuid4())
+                new_ids.append(f["id"])
+
+        writes = sync_pdf_fragments(source.id, fragments, mode=storage)
+        checksum = hashlib.sha256(pdf_bytes).hexdigest()
+        SourceVersion.objects.create(source=source, version=version, storage_uri=storage_uri or source.storage_uri or "",
+                                     checksum=checksum, page_hashes=page_hashes)
+    except Exception:
+        _failed(source)
+        raise
+    source.version, source.checksum, source.status = version, checksum, "parsed"
+    if storage_uri:
+        source.storage_uri = storage_uri
+    source.save(update_fields=["version", "checksum", "status", "storage_uri"])
+    return {
+        "pages": len(page_hashes),
+        "pages_reused": len(reused),
+        "pages_extracted": len(changed),
+        "fragments": len(fragments),
+        "fragments_kept": kept + sum(len(old_by_page.get(p, ())) for p in reused.values()),
+        "fragments_new": len(new_ids),
+        "rows_written": writes["written"],
+        "rows_deleted": writes["deleted"],
+        "new_fragment_ids": new_ids,
+    }
+
+
+# "00:01:02.500", "01:02.500" (WebVTT) or "00:01:02,500" (SRT)
+_TIMESTAMP = r"(?:\d+:)?\d{1,2}:\d{2}[.,]\d{1,3}"
+_CUE_TIMING = re.compile(rf"^\s*({_TIMESTAMP})\s*-->\s*({_TIMESTAMP})")
+_TAGS = re.compile(r"<[^>]+>|\{\\[^}]*\}")
+TRANSCRIPT_EXTS = (".vtt", ".srt")
+
+
+def _seconds(ts: str) -> float:
+    parts = ts.replace(",", ".").split(":")
+    return sum(float(p) * 60 ** i for i, p in enumerate(reversed(parts)))
+
+
+def parse_transcript(text: str) -> List[Tuple[float, float, str]]:
+    """
+    Parse a WebVTT or SRT transcript into (start, end, text) cues, in seconds.
+
+    Cue numbers, NOTE/STYLE blocks, cue settings and inline markup are dropped.
+    """
+    cues = []
+    for block in re.split(r"\n\s*\n", text.replace("\r\n", "\n").replace("\r", "\n").lstrip("\ufeff")):
+        lines = block.strip().split("\n")
+        for i, line in enumerate(lines):
+            m = _CUE_TIMING.match(line)
+            if m:
+                body = " ".join(_TAGS.sub("", l).strip() for l in lines[i + 1:])
+                body = re.sub(r"\s+", " ", body).strip()
+                if body:
+                    cues.append((_seconds(m.group(1)), _seconds(m.group(2)), body))
+                break
+    cues.sort(key=lambda c: c[0])
+    return cues
+
+
+def transcript_windows(cues: List[Tuple[float, float, str]], window: Optional[float] = None) -> Iterator[Dict]:
+    """
+    Group cues into consecutive windows of about `window` seconds (TRANSCRIPT_WINDOW_SECONDS).
+
+    A cue is never split; a window closes at the first cue boundary past its length.
+    """
+    window = window or settings.TRANSCRIPT_WINDOW_SECONDS
+    start, end, parts = None, None, []
+    for c_start, c_end, body in cues:
+        if parts and c_start - start >= window:
+            yield {"t_start": start, "t_end": end, "text": " ".join(parts)}
+            parts = []
+        if not parts:
+            start, end = c_start, c_end
+        parts.append(body)
+        end = max(end, c_end)
+    if parts:
+        yield {"t_start": start, "t_end": end, "text": " ".join(parts)}
+
+
+def transcript_sidecar_of(media_name: str, candidates: Iterable[str]) -> Optional[str]:
+    """The first of the file names `candidates` that is a .vtt/.srt sidecar of `media_name` (lecture.vtt, lecture.en.srt, ...)."""
+    stem = os.path.splitext(os.path.basename(media_name))[0]
+    candidates = sorted(candidates)
+    for ext in TRANSCRIPT_EXTS:
+        for candidate in candidates:
+            if candidate.lower().endswith(ext) and (candidate[:-len(ext)] == stem or candidate.startswith(stem + ".")):
+                return candidate
+    return None
+
+
+def find_transcript_sidecar(media_path: str) -> Optional[str]:
+    """The .vtt/.srt uploaded next to a video (lecture.mp4 -> lecture.vtt, lecture.en.srt, ...)."""
+    folder, name = os.path.split(media_path)
+    try:
+        candidates = os.listdir(folder or ".")
+    except OSError:
+        return None
+    found = transcript_sidecar_of(name, candidates)
+    return os.path.join(folder, found) if found else None
+
+
+def save_video_fragments(source_id, windows: Iterator[Dict]) -> int:
+    """Replace all VideoFragments of a source with `windows` and index their text for search."""
+    rows = [VideoFragment(source_id=source_id, t_start=w["t_start"], t_end=w["t_end"], transcript_text=w["text"])
+            for w in windows]
+    with transaction.atomic():
+        delete_fragment_rows(VideoFragment.objects.filter(source_id=source_id))
+        VideoFragment.objects.bulk_create(rows, batch_size=2000)
+        # one UPDATE fills the full-text column for the whole transcript
+        VideoFragment.objects.filter(source_id=source_id).update(search_vector=SearchVector("transcript_text", config="english"))
+    invalidate_fragment_index(source_id)
+    return len(rows)
+
+
+def ingest_video_transcript(source: Source, transcript_text: str, window: Optional[float] = None) -> int:
+    """Window a VTT/SRT transcript into VideoFragments for a video source; returns the fragment count."""
+    source.status = "processing"
+    source.save(update_fields=["status"])
+    try:
+        count = save_video_fragments(source.id, transcript_windows(parse_transcript(transcript_text), window))
+    except Exception:
+        _failed(source)
+        raise
+    source.status = "parsed"
+    source.save(update_fields=["status"])
+    return count
@@ -0,0 +1,200 @@
+# core/llm_limiter.py
+"""
+Admission control in front of the upstream LLM.
+
+Every upstream call takes a slot from `llm_limiter()`, which enforces:
+  - a concurrency cap (LLM_MAX_CONCURRENCY),
+  - a requests-per-minute token bucket (LLM_RPM),
+  - a tokens-per-minute token bucket (LLM_TPM), charged with an estimate up
+    front and corrected with the real usage when the call finishes.
+
+Waiting callers sit in a priority queue: interactive streams go ahead of
+standard requests, which go ahead of batch jobs; waiting time ages a caller's
+priority so lower classes are never starved. When the queue is full, or a
+caller cannot be admitted within LLM_MAX_WAIT_SECONDS, LLMBusy is raised with a
+retry-after hint so views can answer 429 instead of piling up upstream
+timeouts. An upstream 429 pauses the limiter for the provider's Retry-After.
+
+Limits are per process; divide the provider quota by the number of workers.
+"""
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from django.conf import settings
+
+INTERACTIVE = 0  # chat_stream
+STANDARD = 1     # chat_ask, chat_attach
+BATCH = 2        # offline jobs (evaluation, re-ingestion)
+
+
+class LLMBusy(Exception):
+    """The LLM upstream is saturated; retry after `retry_after` seconds."""
+
+    def __init__(self, retry_after: float, detail: str = "LLM capacity exhausted"):
+        super().__init__(detail)
+        self.retry_after = max(1, int(retry_after + 0.999))
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 chars per token) for TPM accounting."""
+    return max(1, len(text or "") // 4)
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.stamp = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        if self.rate <= 0:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.tokens >= amount else (amount - self.tokens) / self.rate
+
+    def take(self, amount: float, now: float):
+        if self.rate > 0:
+            self._refill(now)
+            self.tokens -= amount
+
+
+class _Ticket:
+    __slots__ = ("priority", "seq", "enqueued", "tokens")
+
+    def __init__(self, priority, seq, tokens):
+        self.priority, self.seq, self.tokens = priority, seq, tokens
+        self.enqueued = time.monotonic()
+
+
+class Lease:
+    """A held upstream slot; set `used_tokens` before release to correct the TPM charge."""
+
+    def __init__(self, limiter, estimated):
+        self._limiter = limiter
+        self.estimated = estimated
+        self.used_tokens: Optional[int] = None
+
+
+class LLMLimiter:
+    def __init__(self, rpm, tpm, max_concurrency, max_queue, max_wait, aging_seconds=10.0):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.aging_seconds = aging_seconds
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._queue = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    # -- internals (call with the lock held) --
+    def _rank(self, t: _Ticket, now: float):
+        return (t.priority - (now - t.enqueued) / self.aging_seconds, t.seq)
+
+    def _head(self, now):
+        return min(self._queue, key=lambda t: self._rank(t, now)) if self._queue else None
+
+    def _delay(self, amount, now) -> float:
+        """Seconds until a request charging `amount` tokens could start (ignoring the queue)."""
+        return max(self.paused_until - now, self.requests.wait_time(1, now), self.tokens.wait_time(amount, now))
+
+    def _retry_after(self, now) -> float:
+        return max(1.0, self._delay(0, now), len(self._queue) * 60.0 / max(self.requests.capacity, 1))
+
+    # -- public API --
+    def admit(self, priority: int = STANDARD):
+        """Fail fast with LLMBusy when a new request of `priority` would only queue up to time out."""
+        with self._cond:
+            now = time.monotonic()
+            ahead = sum(1 for t in self._queue if t.priority <= priority)
+            queue_wait = ahead * 60.0 / max(self.requests.capacity, 1)
+            if len(self._queue) >= self.max_queue or max(self._delay(0, now), queue_wait) > self.max_wait:
+                raise LLMBusy(self._retry_after(now))
+
+    @contextmanager
+    def slot(self, priority: int = STANDARD, est_tokens: int = 1000):
+        lease = self.acquire(priority, est_tokens)
+        try:
+            yield lease
+        finally:
+            self.release(lease)
+
+    def acquire(self, priority: int = STANDARD, est_tokens: int = 1000) -> Lease:
+        with self._cond:
+            now = time.monotonic()
+            if len(self._queue) >= self.max_queue:
+                raise LLMBusy(self._retry_after(now), "LLM queue full")
+            ticket = _Ticket(priority, next(self._seq), est_tokens)
+            self._queue.append(ticket)
+            deadline = now + self.max_wait
+            try:
+                while True:
+                    now = time.monotonic()
+                    if self._head(now) is ticket and self.in_flight < self.max_concurrency:
+                        delay = self._delay(est_tokens, now)
+                        if delay <= 0:
+                            break
+                    else:
+                        delay = None  # woken by release() or a new head
+                    if now >= deadline:
+                        raise LLMBusy(self._retry_after(now))
+                    self._cond.wait(min(delay, deadline - now) if delay is not None else deadline - now)
+            except BaseException:
+                self._queue.remove(ticket)
+                self._cond.notify_all()
+                raise
+            self._queue.remove(ticket)
+            self.in_flight += 1
+            self.requests.take(1, now)
+            self.tokens.take(est_tokens, now)
+            self._cond.notify_all()
+            return Lease(self, est_tokens)
+
+    def release(self, lease: Lease):
+        with self._cond:
+            self.in_flight -= 1
+            if lease.used_tokens is not None:
+                self.tokens.take(lease.used_tokens - lease.estimated, time.monotonic())
+            self._cond.notify_all()
+
+    def penalize(self, retry_after: float):
+        """Upstream said 429: hold every caller back for `retry_after` seconds."""
+        with self._cond:
+            self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def llm_limiter() -> LLMLimiter:
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = LLMLimiter(
+                    rpm=getattr(settings, "LLM_RPM", 500),
+                    tpm=getattr(settings, "LLM_TPM", 200000),
+                    max_concurrency=getattr(settings, "LLM_MAX_CONCURRENCY", 16),
+                    max_queue=getattr(settings, "LLM_MAX_QUEUE", 64),
+                    max_wait=getattr(settings, "LLM_MAX_WAIT_SECONDS", 20),
+                )
+    return _limiter
+
+
+def parse_retry_after(value, default: float = 5.0) -> float:
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return default
@@ -0,0 +1,106 @@
+"""
+Django management command to compare the rows and packed PDF fragment layouts on a real document.
+
+Extracts the fragments of a PDF source once (from --file, or the source's stored
+object), then stores them for that source in each layout in turn and reports
+what Postgres actually uses:
+- the bytes of the source's tuples in the layout's table (sum of pg_column_size,
+  TOAST-compressed values as stored), and of the packed text blobs among them;
+- the growth of pg_total_relation_size (heap, TOAST and indexes) of that table.
+  This counts only new pages, so on a table with reusable free space it reads low.
+It also reports the time for a cold viewer FragmentIndex load from the database.
+
+Everything runs in one transaction that is rolled back, so the source keeps its
+fragments. The relation files keep their new size until the next VACUUM.
+
+Usage:
+    python manage.py bench_fragments <source_id> [--file path/to/manual.pdf]
+"""
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from core.fragment_index import get_fragment_index, invalidate_fragment_index
+from core.fragment_store import save_pdf_fragments
+from core.ingest import extract_pdf_fragments
+from core.models import PDFFragment, PackedFragmentPage, Source
+from core.storage import open_mmap, StorageError
+
+LAYOUTS = {"rows": PDFFragment, "packed": PackedFragmentPage}
+
+
+def _relation_size(table):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_total_relation_size(%s)", [table])
+        return cursor.fetchone()[0]
+
+
+def _tuples(table, source_id, text_column=None):
+    """(rows, bytes of their tuples, bytes of `text_column` among them) stored for a source."""
+    qn = connection.ops.quote_name
+    text = f"COALESCE(sum(pg_column_size(t.{qn(text_column)})), 0)" if text_column else "0"
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT count(*), COALESCE(sum(pg_column_size(t.*)), 0), {text} FROM {qn(table)} t "
+                       f"WHERE t.source_id = %s", [source_id])
+        return cursor.fetchone()
+
+
+class Command(BaseCommand):
+    help = "Measure Postgres storage and index load time of rows vs packed PDF fragments for a real document"
+
+    def add_arguments(self, parser):
+        parser.add_argument("source_id", help="PDF source to ingest into (rolled back: its fragments are left unchanged)")
+        parser.add_argument("--file", help="Local PDF to ingest instead of the source's stored object")
+
+    def handle(self, *args, **options):
+        source = Source.objects.filter(id=options["source_id"], type="pdf").first()
+        if not source:
+            raise CommandError(f"PDF source {options['source_id']} not found")
+        try:
+            if options["file"]:
+                with open(options["file"], "rb") as fh:
+                    fragments = list(extract_pdf_fragments(fh.read()))
+            else:
+                with open_mmap(source.storage_uri) as data:
+                    fragments = list(extract_pdf_fragments(data))
+        except (StorageError, OSError) as e:
+            raise CommandError(str(e))
+        if not fragments:
+            raise CommandError("No text fragments extracted from the document")
+        # same fragment IDs in both layouts
+        for f in fragments:
+            f["id"] = str(uuid.uuid4())
+        pages = len({f["page"] for f in fragments})
+        n = len(fragments)
+
+        results = []
+        with transaction.atomic():
+            for layout, model in LAYOUTS.items():
+                table = model._meta.db_table
+                before = _relation_size(table)
+                save_pdf_fragments(source.id, fragments, mode=layout)
+                grown = _relation_size(table) - before
+                rows, tuple_bytes, text_bytes = _tuples(table, source.id, "text" if model is PackedFragmentPage else None)
+                t0 = time.perf_counter()
+                idx = get_fragment_index(source.id, "pdf")
+                load = time.perf_counter() - t0
+                assert len(idx) == n
+                results.append((layout, rows, tuple_bytes, text_bytes, grown, load))
+            transaction.set_rollback(True)
+        # the indexes cached above describe the rolled-back fragments
+        invalidate_fragment_index(source.id)
+
+        self.stdout.write(f"{source.title}: {n} fragments on {pages} pages\n")
+        self.stdout.write(f"{'layout':<10}{'db rows':>10}{'tuple bytes':>14}{'bytes/frag':>12}{'of it text':>12}"
+                          f"{'relation +bytes':>17}{'index load ms':>15}")
+        for layout, rows, tuple_bytes, text_bytes, grown, load in results:
+            self.stdout.write(f"{layout:<10}{rows:>10}{tuple_bytes:>14}{tuple_bytes / n:>12.1f}{text_bytes:>12}"
+                              f"{grown:>17}{load * 1000:>15.1f}")
+        (_, _, row_bytes, _, row_grown, row_load), (_, _, packed_bytes, _, packed_grown, packed_load) = results
+        growth = f", {packed_grown / row_grown:.1%} of relation growth" if row_grown else ""
+        self.stdout.write("\nThe rows layout keeps only a hash of each fragment's text; the packed layout stores the text too.")
+        self.stdout.write(self.style.SUCCESS(
+            f"✓ Packed layout: {packed_bytes / row_bytes:.1%} of row tuple bytes{growth}, "
+            f"index load {packed_load / row_load:.1%} of row time"))
@@ -0,0 +1,91 @@
+"""
+Django management command to measure JSON serialization CPU, before and after core.fastjson.
+
+List: a SourceViewSet-sized page of synthetic sources, serialized the old way
+(SourceSerializer(many=True).data + DRF JSONRenderer) and the new way
+(plain_rows-shaped dicts with native UUIDs/datetimes + FastJSONRenderer). Both
+outputs are checked to decode to the same JSON.
+
+Stream: the per-chunk encoding of a long streamed answer (single-flight token
+chunks, citation and done events), json.dumps vs fastjson.dumps_str.
+
+No database is needed. Usage:
+    python manage.py bench_json [--sources 20000] [--chunks 20000] [--repeat 3]
+"""
+import json
+import random
+import time
+import uuid
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils.timezone import now
+from rest_framework.renderers import JSONRenderer
+
+from core import fastjson
+from core.models import Source
+from core.serializers import SourceSerializer
+
+
+def _cpu(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        t0 = time.process_time()
+        fn()
+        t = time.process_time() - t0
+        best = t if best is None else min(best, t)
+    return best * 1000
+
+
+class Command(BaseCommand):
+    help = "Compare JSON serialization CPU of the DRF/stdlib path and core.fastjson"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sources", type=int, default=20000)
+        parser.add_argument("--chunks", type=int, default=20000)
+        parser.add_argument("--repeat", type=int, default=3)
+
+    def handle(self, *args, **opts):
+        rnd = random.Random(3)
+        instrument_id, folder_ids, t = uuid.uuid4(), [uuid.uuid4() for _ in range(8)] + [None], now()
+        sources = [Source(
+            id=uuid.uuid4(), instrument_id=instrument_id, folder_id=rnd.choice(folder_ids), type="pdf",
+            title=f"Operator manual rev {i}", category="manual", description=None, version=f"{i % 9}.0",
+            model_tags=["LSR Fortessa", "X-20"], storage_uri=f"minio://rayni/{i}.pdf", status="parsed",
+            checksum=f"{i:064x}", archived=False, created_at=t - timedelta(seconds=i)) for i in range(opts["sources"])]
+        fields = [f for f in Source._meta.concrete_fields]
+        drf, fast = JSONRenderer(), fastjson.FastJSONRenderer()
+        repeat = opts["repeat"]
+
+        before = {}
+        before["serialize"] = _cpu(lambda: before.__setitem__("data", SourceSerializer(sources, many=True).data), repeat)
+        before["render"] = _cpu(lambda: before.__setitem__("body", drf.render(before["data"])), repeat)
+        after = {}
+        # what plain_rows gets from .values(): raw column values, FK as the related id
+        after["serialize"] = _cpu(lambda: after.__setitem__("data", [
+            {f.name: f.value_from_object(s) for f in fields} for s in sources]), repeat)
+        after["render"] = _cpu(lambda: after.__setitem__("body", fast.render(after["data"])), repeat)
+        assert json.loads(before["body"]) == json.loads(after["body"]), "outputs differ"
+
+        self.stdout.write(f"{opts['sources']} sources, fastjson backend: {fastjson.BACKEND}, best of {repeat}\n")
+        self.stdout.write(f"{'list path':<34}{'serialize ms':>14}{'render ms':>12}{'total ms':>12}")
+        for label, r in (("DRF serializer + JSONRenderer", before), ("plain rows + FastJSONRenderer", after)):
+            self.stdout.write(f"{label:<34}{r['serialize']:>14.1f}{r['render']:>12.1f}{r['serialize'] + r['render']:>12.1f}")
+
+        chunks = ["Load the flow cell, then run CS&T beads. " * rnd.randint(1, 3) for _ in range(opts["chunks"])]
+        cites = [{"source_id": str(s.id), "source_title": s.title, "source_type": "pdf", "fragment_id": None,
+                  "citation_text": "[Source 1]"} for s in sources[:5]]
+        done = {"turn_id": str(uuid.uuid4()), "citations": cites}
+
+        def stream(dumps):
+            for c in chunks:
+                dumps(c)            # single-flight token chunk
+            for c in cites:
+                dumps(c)            # citation events
+            dumps(done)
+
+        s_before, s_after = _cpu(lambda: stream(json.dumps), repeat), _cpu(lambda: stream(fastjson.dumps_str), repeat)
+        self.stdout.write(f"\n{opts['chunks']}-chunk stream: json.dumps {s_before:.1f} ms, fastjson {s_after:.1f} ms")
+        total_before, total_after = before["serialize"] + before["render"], after["serialize"] + after["render"]
+        self.stdout.write(self.style.SUCCESS(
+            f"List: {total_after / total_before:.1%} of the CPU before; stream: {s_after / s_before:.1%}"))
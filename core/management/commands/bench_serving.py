@@ -0,0 +1,115 @@
+"""
+Django management command to compare request throughput of the serving modes.
+
+Starts the app under each server in turn (the dev `runserver` the old entrypoint
+used, and gunicorn with gunicorn.conf.py), drives it with concurrent keep-alive
+clients and reports requests/second and latency percentiles. The default path
+(/api/support/faq) needs no database, so only the server and the Django stack are
+measured.
+
+Usage:
+    python manage.py bench_serving [--modes runserver,gunicorn] [--requests 5000] [--concurrency 32] [--path /api/support/faq]
+"""
+import http.client
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+_COMMANDS = {
+    "runserver": lambda port: [sys.executable, "manage.py", "runserver", f"127.0.0.1:{port}"],
+    "gunicorn": lambda port: [sys.executable, "-m", "gunicorn", "--bind", f"127.0.0.1:{port}"],
+}
+
+
+def _wait_for_port(port, proc, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise CommandError(f"server exited with {proc.returncode}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise CommandError("server did not start listening")
+
+
+def _client(port, path, n):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    latencies, errors = [], 0
+    for _ in range(n):
+        t0 = time.perf_counter()
+        try:
+            conn.request("GET", path)
+            resp = conn.getresponse()
+            resp.read()
+            if resp.status != 200:
+                errors += 1
+            if resp.getheader("Connection", "").lower() == "close":
+                conn.close()
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            conn.close()
+        latencies.append(time.perf_counter() - t0)
+    conn.close()
+    return latencies, errors
+
+
+def _pct(sorted_values, p):
+    return sorted_values[min(int(len(sorted_values) * p), len(sorted_values) - 1)]
+
+
+class Command(BaseCommand):
+    help = "Measure throughput of runserver vs the gunicorn serving mode"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--modes", default="runserver,gunicorn")
+        parser.add_argument("--requests", type=int, default=5000)
+        parser.add_argument("--concurrency", type=int, default=32)
+        parser.add_argument("--path", default="/api/support/faq")
+        parser.add_argument("--port", type=int, default=8765)
+
+    def _run(self, mode, opts):
+        port, n, c = opts["port"], opts["requests"], opts["concurrency"]
+        env = {**os.environ, "SERVER_MODE": mode, "SERVER_ROLE": "api", "SERVER_ACCESS_LOG": "", "DEBUG": "0"}
+        proc = subprocess.Popen(_COMMANDS[mode](port), cwd=settings.BASE_DIR, env=env,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+        try:
+            _wait_for_port(port, proc)
+            _client(port, opts["path"], 20)  # warm up
+            t0 = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=c) as pool:
+                results = list(pool.map(lambda k: _client(port, opts["path"], n // c + (k < n % c)), range(c)))
+            elapsed = time.perf_counter() - t0
+        finally:
+            if proc.poll() is None:
+                os.killpg(proc.pid, signal.SIGTERM)
+                try:
+                    proc.wait(timeout=30)
+                except subprocess.TimeoutExpired:
+                    os.killpg(proc.pid, signal.SIGKILL)
+        latencies = sorted(l for r in results for l in r[0])
+        return {"rps": len(latencies) / elapsed, "p50": _pct(latencies, 0.5) * 1000,
+                "p99": _pct(latencies, 0.99) * 1000, "errors": sum(r[1] for r in results)}
+
+    def handle(self, *args, **opts):
+        modes = [m.strip() for m in opts["modes"].split(",") if m.strip()]
+        unknown = set(modes) - set(_COMMANDS)
+        if unknown:
+            raise CommandError(f"unknown mode(s): {', '.join(sorted(unknown))}")
+        self.stdout.write(f"{opts['requests']} x GET {opts['path']}, {opts['concurrency']} keep-alive clients, {os.cpu_count()} CPUs\n")
+        self.stdout.write(f"{'mode':<12}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}")
+        rows = {}
+        for mode in modes:
+            r = rows[mode] = self._run(mode, opts)
+            self.stdout.write(f"{mode:<12}{r['rps']:>10.0f}{r['p50']:>10.1f}{r['p99']:>10.1f}{r['errors']:>8}")
+        if "runserver" in rows and "gunicorn" in rows:
+            self.stdout.write(self.style.SUCCESS(
+                f"gunicorn: {rows['gunicorn']['rps'] / rows['runserver']['rps']:.1f}x the throughput of runserver"))
@@ -0,0 +1,102 @@
+"""
+Django management command to measure CPU cost per streamed chat answer.
+
+Pushes synthetic LLM deltas through the pipeline chat_stream uses (coalescing ->
+stream buffer -> SSE framing) and, as the baseline, through the previous one (an
+event and a json.dumps() per delta, framed and written one event at a time), and
+reports process CPU time per answer under concurrent load. No LLM or database
+is needed; the stream buffer is whatever REDIS_URL selects.
+
+Usage:
+    python manage.py bench_stream [--answers 200] [--concurrency 16] [--deltas 1500]
+"""
+import json
+import random
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from core.streams import coalesce_tokens, get_stream_buffer, start_stream, stream_response, token_data
+
+
+def _fake_deltas(n):
+    rnd = random.Random(42)
+    words = ["Load ", "the ", "flow ", "cell", ", then ", "run ", "CS&T ", "beads", ". ", "Check ", "laser ", "delay", "\n"]
+    return [rnd.choice(words) for _ in range(n)]
+
+
+class Command(BaseCommand):
+    help = "Measure CPU per streamed answer with and without SSE token coalescing"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--answers", type=int, default=200)
+        parser.add_argument("--concurrency", type=int, default=16)
+        parser.add_argument("--deltas", type=int, default=1500, help="Upstream deltas per answer")
+        parser.add_argument("--coalesce-bytes", type=int, default=64)
+        parser.add_argument("--coalesce-ms", type=float, default=20)
+
+    def _one_answer_per_delta(self, deltas):
+        def producer():
+            yield "start", json.dumps({"turn_id": "bench"})
+            text = ""
+            for tok in deltas:
+                text += tok
+                yield "token", json.dumps({"t": tok})
+            yield "done", json.dumps({"chars": len(text)})
+
+        stream_id = f"bench-{uuid.uuid4()}"
+        start_stream(stream_id, producer())
+        writes = events = 0
+        # the response wrote each buffered event as its own chunk
+        for batch in get_stream_buffer().follow(stream_id, 0, 15):
+            for seq, event, data in batch:
+                piece = f"id: {stream_id}:{seq}\nevent: {event}\ndata: {data}\n\n".encode()
+                writes += 1
+                events += piece.count(b"\nevent: ")
+        return writes, events
+
+    def _one_answer(self, deltas, max_bytes, max_ms):
+        if max_bytes is None:
+            return self._one_answer_per_delta(deltas)
+
+        def producer():
+            yield "start", '{"turn_id": "bench"}'
+            parts = []
+            for chunk in coalesce_tokens(deltas, max_bytes=max_bytes, max_ms=max_ms):
+                parts.append(chunk)
+                yield "token", token_data(chunk)
+            yield "done", '{"chars": %d}' % len("".join(parts))
+
+        stream_id = f"bench-{uuid.uuid4()}"
+        start_stream(stream_id, producer())
+        writes = events = 0
+        for piece in stream_response(stream_id).streaming_content:
+            writes += 1
+            events += piece.count(b"\nevent: ")
+        return writes, events
+
+    def _run(self, answers, concurrency, deltas, max_bytes, max_ms):
+        cpu0, wall0 = time.process_time(), time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(lambda _: self._one_answer(deltas, max_bytes, max_ms), range(answers)))
+        cpu, wall = time.process_time() - cpu0, time.perf_counter() - wall0
+        writes = sum(r[0] for r in results) / answers
+        events = sum(r[1] for r in results) / answers
+        return cpu * 1000 / answers, events, writes, wall
+
+    def handle(self, *args, **options):
+        deltas = _fake_deltas(options["deltas"])
+        modes = [
+            ("per-delta", None, None),
+            ("coalesced", options["coalesce_bytes"], options["coalesce_ms"]),
+        ]
+        self.stdout.write(f"{options['answers']} answers x {len(deltas)} deltas, concurrency {options['concurrency']}\n")
+        self.stdout.write(f"{'mode':<12}{'cpu ms/answer':>15}{'events/answer':>15}{'writes/answer':>15}{'wall s':>10}")
+        baseline = None
+        for label, max_bytes, max_ms in modes:
+            cpu, events, writes, wall = self._run(options["answers"], options["concurrency"], deltas, max_bytes, max_ms)
+            baseline = baseline or cpu
+            self.stdout.write(f"{label:<12}{cpu:>15.2f}{events:>15.1f}{writes:>15.1f}{wall:>10.2f}")
+        self.stdout.write(self.style.SUCCESS(f"\nCPU per answer: {cpu / baseline:.2%} of per-delta baseline"))
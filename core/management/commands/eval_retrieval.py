@@ -0,0 +1,179 @@
+"""
+Django management command to evaluate retrieval quality and latency.
+
+The labelled set maps questions to the sources that should be retrieved. By default
+it is synthesized from the seed_sources catalogue: each seeded document gets a
+question phrased from its description and one from its title, and each model tag
+gets a "which <category> covers <model>" question whose expected sources are the
+documents tagged with it. --questions loads a hand-labelled set instead (a JSON
+list of {"instrument_id", "question", "expected": [source ids]}), and
+--write-questions saves the synthetic one as a starting point for that.
+
+Every mode in rag_utils.RETRIEVAL_MODES runs over the set and is reported with
+recall@k, MRR and nDCG@k, p50/p99 latency per search (best of --repeat), SQL
+queries per search and peak Python memory per search (tracemalloc, in a separate
+untimed pass). --by-instrument repeats the table for each instrument, with the
+best mode for it.
+
+Needs the database seeded with seed_instruments and seed_sources. Usage:
+    python manage.py eval_retrieval [--k 5] [--modes keyword,keyword+transcripts] [--instrument <uuid>]
+                                    [--by-instrument] [--repeat 3] [--questions eval.json] [--write-questions eval.json]
+"""
+import json
+import math
+import re
+import time
+import tracemalloc
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from core.management.commands.seed_sources import Command as SeedSources
+from core.models import Instrument, Source
+from core.rag_utils import RETRIEVAL_MODES
+
+
+def _stem(title: str) -> str:
+    """Document title without its extension or trailing version ("... Manual v8.2.pdf" -> "... Manual")."""
+    stem = re.sub(r"\.\w{2,4}$", "", title)
+    return re.sub(r"\s+(v|rev\s*)?\d[\w.\-]*$", "", stem, flags=re.I)
+
+
+def _synthetic_questions(instruments):
+    questions = []
+    for instrument in instruments:
+        docs = SeedSources.SAMPLE_DOCS.get(instrument.vendor, SeedSources.SAMPLE_DOCS["default"])
+        ids = dict(Source.objects.filter(instrument=instrument, archived=False)
+                   .exclude(status="rejected").values_list("title", "id"))
+        by_tag = defaultdict(list)
+        for title, _, category, _, _, model_tags, description in docs:
+            if title not in ids:
+                continue
+            expected = [str(ids[title])]
+            clause = description.rstrip(".")
+            questions.append({"instrument_id": str(instrument.id), "kind": "description",
+                              "question": f"Where can I find {clause[0].lower()}{clause[1:]}?", "expected": expected})
+            questions.append({"instrument_id": str(instrument.id), "kind": "title",
+                              "question": f"Do we have the {_stem(title)} for the {instrument.name}?", "expected": expected})
+            for tag in model_tags:
+                by_tag[(tag, category)].append(str(ids[title]))
+        for (tag, category), expected in by_tag.items():
+            questions.append({"instrument_id": str(instrument.id), "kind": "model",
+                              "question": f"Which {category} covers the {tag}?", "expected": expected})
+    return questions
+
+
+def _relevance(ranked, expected, k):
+    hits = [1 if r in expected else 0 for r in ranked[:k]]
+    recall = sum(hits) / len(expected)
+    rr = next((1 / (i + 1) for i, h in enumerate(hits) if h), 0.0)
+    dcg = sum(h / math.log2(i + 2) for i, h in enumerate(hits))
+    idcg = sum(1 / math.log2(i + 2) for i in range(min(len(expected), k)))
+    return recall, rr, dcg / idcg
+
+
+def _pct(sorted_values, p):
+    return sorted_values[min(int(len(sorted_values) * p), len(sorted_values) - 1)]
+
+
+def _summary(rows):
+    latencies = sorted(r["latency"] for r in rows)
+    n = len(rows)
+    return {
+        "recall": sum(r["recall"] for r in rows) / n,
+        "mrr": sum(r["rr"] for r in rows) / n,
+        "ndcg": sum(r["ndcg"] for r in rows) / n,
+        "p50": _pct(latencies, 0.5) * 1000,
+        "p99": _pct(latencies, 0.99) * 1000,
+        "queries": sum(r["queries"] for r in rows) / n,
+        "peak_kb": max(r["peak"] for r in rows) / 1024,
+    }
+
+
+class Command(BaseCommand):
+    help = "Compare retrieval modes on a labelled question set: recall@k, MRR, nDCG, latency and memory"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--k", type=int, default=5)
+        parser.add_argument("--modes", default=",".join(RETRIEVAL_MODES))
+        parser.add_argument("--instrument", action="append", default=[], help="Limit to an instrument (repeatable)")
+        parser.add_argument("--by-instrument", action="store_true")
+        parser.add_argument("--repeat", type=int, default=3)
+        parser.add_argument("--questions", help="Labelled set to load instead of the synthetic one")
+        parser.add_argument("--write-questions", help="Write the labelled set used to this file")
+
+    def _run(self, search, questions, k, repeat):
+        rows = []
+        for q in questions:
+            timings, ranked = [], []
+            for _ in range(repeat):
+                t0 = time.perf_counter()
+                ranked = [r["id"] for r in search(q["instrument_id"], q["question"], k)]
+                timings.append(time.perf_counter() - t0)
+            # separate pass: tracemalloc and query capture would skew the timings
+            tracemalloc.start()
+            with CaptureQueriesContext(connection) as captured:
+                search(q["instrument_id"], q["question"], k)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            recall, rr, ndcg = _relevance(ranked, set(q["expected"]), k)
+            rows.append({"question": q, "recall": recall, "rr": rr, "ndcg": ndcg, "latency": min(timings),
+                         "queries": len(captured.captured_queries), "peak": peak})
+        return rows
+
+    def _table(self, results, k, select=lambda row: True):
+        self.stdout.write(f"{'mode':<22}{f'recall@{k}':>10}{'MRR':>8}{f'nDCG@{k}':>9}{'p50 ms':>9}{'p99 ms':>9}"
+                          f"{'queries':>9}{'peak KB':>9}")
+        summaries = {}
+        for mode, rows in results.items():
+            rows = [r for r in rows if select(r)]
+            if not rows:
+                continue
+            s = summaries[mode] = _summary(rows)
+            self.stdout.write(f"{mode:<22}{s['recall']:>10.3f}{s['mrr']:>8.3f}{s['ndcg']:>9.3f}{s['p50']:>9.2f}"
+                              f"{s['p99']:>9.2f}{s['queries']:>9.1f}{s['peak_kb']:>9.0f}")
+        # best quality first, faster on a tie
+        return min(summaries, key=lambda m: (-round(summaries[m]["ndcg"], 3), summaries[m]["p50"])) if summaries else None
+
+    def handle(self, *args, **opts):
+        modes = [m.strip() for m in opts["modes"].split(",") if m.strip()]
+        unknown = set(modes) - set(RETRIEVAL_MODES)
+        if unknown:
+            raise CommandError(f"unknown mode(s): {', '.join(sorted(unknown))}; available: {', '.join(RETRIEVAL_MODES)}")
+        instruments = Instrument.objects.order_by("name")
+        if opts["instrument"]:
+            instruments = instruments.filter(id__in=opts["instrument"])
+
+        if opts["questions"]:
+            with open(opts["questions"]) as f:
+                questions = json.load(f)
+            if opts["instrument"]:
+                questions = [q for q in questions if q["instrument_id"] in opts["instrument"]]
+        else:
+            questions = _synthetic_questions(instruments)
+        if not questions:
+            raise CommandError("no labelled questions (run seed_instruments and seed_sources first, or pass --questions)")
+        if opts["write_questions"]:
+            with open(opts["write_questions"], "w") as f:
+                json.dump(questions, f, indent=2)
+
+        k, repeat = opts["k"], max(opts["repeat"], 1)
+        names = dict(Instrument.objects.filter(id__in={q["instrument_id"] for q in questions}).values_list("id", "name"))
+        names = {str(i): n for i, n in names.items()}
+        self.stdout.write(f"{len(questions)} questions over {len(names)} instruments, k={k}, best of {repeat} timed runs\n")
+
+        results = {}
+        for mode in modes:
+            search = RETRIEVAL_MODES[mode]
+            search(questions[0]["instrument_id"], questions[0]["question"], k)  # warm up
+            results[mode] = self._run(search, questions, k, repeat)
+
+        best = self._table(results, k)
+        if opts["by_instrument"]:
+            for instrument_id, name in sorted(names.items(), key=lambda x: x[1]):
+                self.stdout.write(f"\n{name}")
+                choice = self._table(results, k, lambda r: r["question"]["instrument_id"] == instrument_id)
+                self.stdout.write(f"  best: {choice}")
+        self.stdout.write(self.style.SUCCESS(f"\n✓ Best overall at k={k}: {best}"))
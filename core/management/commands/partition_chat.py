@@ -0,0 +1,96 @@
+"""
+Django management command to maintain the monthly partitions of the chat history tables.
+
+ChatSession, ChatTurn and Citation are range-partitioned by created_at (see
+core/partitions.py). Each run:
+1. creates the partitions of this month and the next CHAT_PARTITION_MONTHS_AHEAD
+   (rows already in the default partition move into them);
+2. with a retention window (CHAT_RETENTION_MONTHS or --retention-months), exports
+   every older partition to object storage (archive/chat/<table>/<partition>.parquet
+   or .arrow), then detaches and drops it. A partition that rows of a retained
+   month still reference (e.g. the sessions of conversations that went on) is
+   kept until they expire too.
+
+--convert turns the plain tables into partitioned ones first (once, after the
+tables exist; it rewrites them, so run it in a quiet period). Tables that are not
+partitioned yet are skipped, so the entrypoint can run this on every start. Run
+it daily from cron for retention.
+
+Usage:
+    python manage.py partition_chat [--convert] [--ahead 3] [--retention-months 12] [--format parquet|arrow]
+                                    [--no-export] [--keep-detached] [--no-retention] [--dry-run]
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.timezone import now
+
+from core import partitions
+
+
+class Command(BaseCommand):
+    help = "Create upcoming chat history partitions, and export and drop those past the retention window"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--convert", action="store_true", help="Partition the chat tables that are not yet")
+        parser.add_argument("--ahead", type=int, default=settings.CHAT_PARTITION_MONTHS_AHEAD)
+        parser.add_argument("--retention-months", type=int, default=settings.CHAT_RETENTION_MONTHS)
+        parser.add_argument("--no-retention", action="store_true", help="Only create partitions")
+        parser.add_argument("--format", choices=("parquet", "arrow"), default=settings.CHAT_ARCHIVE_FORMAT)
+        parser.add_argument("--no-export", action="store_true", help="Drop cold partitions without exporting them")
+        parser.add_argument("--keep-detached", action="store_true", help="Detach cold partitions but keep the tables")
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **opts):
+        today, ahead, dry = now().date(), opts["ahead"], opts["dry_run"]
+
+        if opts["convert"]:
+            for model in partitions.PARTITIONED:
+                table = model._meta.db_table
+                if partitions.is_partitioned(table):
+                    self.stdout.write(f"  - Already partitioned: {table}")
+                elif dry:
+                    self.stdout.write(f"  would partition {table}")
+                else:
+                    rows = partitions.convert(model, today, ahead)
+                    self.stdout.write(self.style.SUCCESS(f"  ✓ Partitioned {table} ({rows} rows)"))
+
+        if dry:
+            for model in partitions.PARTITIONED:
+                table = model._meta.db_table
+                if partitions.is_partitioned(table):
+                    existing = partitions.partitions(table)
+                    for i in range(ahead + 1):
+                        month = partitions.month_start(today, i)
+                        if month not in existing:
+                            self.stdout.write(f"  would create {partitions.partition_name(table, month)}")
+        else:
+            for name, moved in partitions.ensure_partitions(today, ahead):
+                self.stdout.write(self.style.SUCCESS(f"  ✓ Created {name}" + (f" ({moved} rows from default)" if moved else "")))
+
+        retention = 0 if opts["no_retention"] else opts["retention_months"]
+        dropped = 0
+        if retention > 0:
+            for model, month, name in partitions.cold_partitions(today, retention):
+                if dry:
+                    self.stdout.write(f"  would {'drop' if opts['no_export'] else 'export and drop'} {name}")
+                    continue
+                if partitions.referenced(model, name):
+                    self.stdout.write(f"  - Kept {name}: rows in retained partitions still reference it")
+                    continue
+                if not opts["no_export"]:
+                    try:
+                        uri, rows = partitions.export_partition(model, name, opts["format"])
+                    except RuntimeError as e:
+                        raise CommandError(str(e))
+                    self.stdout.write(f"  exported {name}: {rows} rows -> {uri}")
+                partitions.drop_partition(model, name, keep=opts["keep_detached"])
+                dropped += 1
+                self.stdout.write(self.style.SUCCESS(f"  ✓ {'Detached' if opts['keep_detached'] else 'Dropped'} {name}"))
+
+        for model in partitions.PARTITIONED:
+            stray = partitions.default_rows(model._meta.db_table)
+            if stray:
+                self.stdout.write(self.style.WARNING(
+                    f"  {stray} rows in {model._meta.db_table}_default: created_at outside every partition"))
+        if not dry:
+            self.stdout.write(self.style.SUCCESS(f"\n✓ Chat partitions up to date ({dropped} expired)"))
@@ -0,0 +1,65 @@
+"""
+Django management command to rebuild the chat analytics rollups from history.
+
+The rollups are maintained incrementally by chat_ask / chat_stream / chat_attach
+and chat_turn_feedback; this is only needed once after deploying them (or to
+repair drift). It aggregates in the database with GROUP BY, one query per table.
+Only days still covered by chat history are rebuilt: rollups of months dropped
+by partition_chat retention are kept.
+
+Usage:
+    python manage.py rebuild_chat_rollups
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Min, Q
+from django.db.models.functions import TruncDate
+
+from core.models import (
+    ChatTurn, Citation, InstrumentDailyStats, FeedbackTagDailyStats, SourceCitationDailyStats,
+)
+
+
+class Command(BaseCommand):
+    help = "Rebuild per-instrument daily chat analytics rollups from ChatTurn/Citation history"
+
+    def handle(self, *args, **options):
+        turns = (ChatTurn.objects.annotate(day=TruncDate("created_at"))
+                 .values("session__instrument_id", "day")
+                 .annotate(user_turns=Count("id", filter=Q(role="user")),
+                           assistant_turns=Count("id", filter=Q(role="assistant")),
+                           likes=Count("id", filter=Q(rating="like")),
+                           dislikes=Count("id", filter=Q(rating="dislike"))))
+        tags = (ChatTurn.objects.exclude(feedback_tag__isnull=True).exclude(feedback_tag="")
+                .annotate(day=TruncDate("created_at"))
+                .values("session__instrument_id", "day", "feedback_tag").annotate(n=Count("id")))
+        cites = (Citation.objects.annotate(day=TruncDate("turn__created_at"))
+                 .values("turn__session__instrument_id", "day", "source_id").annotate(n=Count("id")))
+        first = ChatTurn.objects.aggregate(first=Min("created_at"))["first"]
+        kept = {"day__gte": first.date()} if first else {}
+
+        with transaction.atomic():
+            InstrumentDailyStats.objects.filter(**kept).delete()
+            FeedbackTagDailyStats.objects.filter(**kept).delete()
+            SourceCitationDailyStats.objects.filter(**kept).delete()
+
+            daily = {}
+            for r in turns:
+                key = (r["session__instrument_id"], r["day"])
+                daily[key] = InstrumentDailyStats(
+                    instrument_id=key[0], day=key[1], user_turns=r["user_turns"],
+                    assistant_turns=r["assistant_turns"], likes=r["likes"], dislikes=r["dislikes"])
+            cite_rows = []
+            for r in cites:
+                key = (r["turn__session__instrument_id"], r["day"])
+                daily.setdefault(key, InstrumentDailyStats(instrument_id=key[0], day=key[1])).citations += r["n"]
+                cite_rows.append(SourceCitationDailyStats(instrument_id=key[0], day=key[1], source_id=r["source_id"], count=r["n"]))
+
+            InstrumentDailyStats.objects.bulk_create(daily.values(), batch_size=1000)
+            FeedbackTagDailyStats.objects.bulk_create(
+                [FeedbackTagDailyStats(instrument_id=r["session__instrument_id"], day=r["day"], tag=r["feedback_tag"], count=r["n"]) for r in tags],
+                batch_size=1000)
+            SourceCitationDailyStats.objects.bulk_create(cite_rows, batch_size=1000)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"✓ Rebuilt {len(daily)} instrument-days, {len(cite_rows)} source-citation rows"))
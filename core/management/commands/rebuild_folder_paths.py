@@ -0,0 +1,43 @@
+"""
+Django management command to (re)compute Folder.path for every folder.
+
+Folder.save() maintains paths, including descendants on a move; this is only
+needed once for folders created before the column existed, or to repair drift.
+Walks each instrument's tree top-down and bulk-updates the changed rows.
+
+Usage:
+    python manage.py rebuild_folder_paths
+"""
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.models import Folder
+from core.versioning import bump_version
+
+
+class Command(BaseCommand):
+    help = "Recompute materialized folder paths"
+
+    def handle(self, *args, **options):
+        folders = {f.id: f for f in Folder.objects.only("id", "parent_id", "path", "instrument_id")}
+        children = defaultdict(list)
+        for f in folders.values():
+            children[f.parent_id if f.parent_id in folders else None].append(f)
+        changed, stack = [], [(f, "/") for f in children[None]]
+        while stack:
+            folder, prefix = stack.pop()
+            path = f"{prefix}{folder.id.hex}/"
+            if folder.path != path:
+                folder.path = path
+                changed.append(folder)
+            stack.extend((c, path) for c in children[folder.id])
+        with transaction.atomic():
+            Folder.objects.bulk_update(changed, ["path"], batch_size=1000)
+        # bulk_update sends no signals: roll over the folder caches folder_changed would have
+        for instrument_id in {f.instrument_id for f in changed}:
+            bump_version("folders", instrument_id)
+        if changed:
+            bump_version("folders", "all")
+        self.stdout.write(self.style.SUCCESS(f"✓ Updated {len(changed)} of {len(folders)} folder paths"))
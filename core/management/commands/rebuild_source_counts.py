@@ -0,0 +1,25 @@
+"""
+Django management command to rebuild the Knowledge Store source counters.
+
+The counters are maintained incrementally by the Source signals (and rebuilt
+per instrument after bulk ops and connector syncs); this is only needed once
+after deploying them, or to repair drift. One GROUP BY over Source, then a
+bulk rewrite of the counter rows.
+
+Usage:
+    python manage.py rebuild_source_counts [--instrument <uuid> ...]
+"""
+from django.core.management.base import BaseCommand
+
+from core.source_stats import rebuild_counts
+
+
+class Command(BaseCommand):
+    help = "Rebuild per-instrument source counters (folder/type/status/category) from Source"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--instrument", action="append", help="only this instrument (repeatable)")
+
+    def handle(self, *args, **options):
+        n = rebuild_counts(options["instrument"])
+        self.stdout.write(self.style.SUCCESS(f"✓ Rebuilt {n} counter rows"))
@@ -0,0 +1,40 @@
+"""
+Django management command to run connector syncs (e.g. from cron).
+
+Usage:
+    python manage.py sync_connectors [--connector <id>] [--workers 8]
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import Connector
+from core.connectors import try_sync, ConnectorError
+
+
+class Command(BaseCommand):
+    help = "Incrementally sync connectors into sources"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--connector", help="Only this connector id")
+        parser.add_argument("--workers", type=int, help="Parallel fetches (default: CONNECTOR_MAX_WORKERS)")
+
+    def handle(self, *args, **options):
+        connectors = Connector.objects.all().order_by("created_at")
+        if options["connector"]:
+            connectors = connectors.filter(id=options["connector"])
+            if not connectors.exists():
+                raise CommandError(f"Connector {options['connector']} not found")
+        for c in connectors:
+            try:
+                stats = try_sync(c, max_workers=options["workers"])
+            except ConnectorError as e:
+                self.stderr.write(f"{c.provider} {c.id}: {e}")
+                continue
+            if stats is None:
+                self.stdout.write(f"{c.provider} {c.id}: already syncing, skipped")
+                continue
+            self.stdout.write(
+                f"{c.provider} {c.id}: {stats['listed']} listed, {stats['fetched']} fetched "
+                f"({stats['mb_per_second']} MB/s, {stats['files_per_second']} files/s), "
+                f"{stats['skipped_unchanged']} unchanged, {stats['deleted']} deleted, {stats['failed']} failed; "
+                f"lag max {stats['lag_seconds_max']}s")
+        self.stdout.write(self.style.SUCCESS("✓ Sync complete"))
@@ -1,12 +1,16 @@
 import uuid
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Value
+from django.db.models.functions import Concat, Substr
 from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 
 ROLE_CHOICES=(("instrument_manager","instrument_manager"),("trained_user","trained_user"))
 VIS_CHOICES=(("public","public"),("restricted","restricted"))
 SRC_TYPE=(("pdf","pdf"),("video","video"),("image","image"),("note","note"),("url","url"))
-SRC_STATUS=(("uploaded","uploaded"),("processing","processing"),("parsed","parsed"),("embedded","embedded"),("approved","approved"),("rejected","rejected"),("archived","archived"))
+SRC_STATUS=(("uploaded","uploaded"),("processing","processing"),("parsed","parsed"),("failed","failed"),("embedded","embedded"),("approved","approved"),("rejected","rejected"),("archived","archived"))
 CATEGORY_CHOICES=(("manual","Manual"),("protocol","Protocol"),("sop","SOP"),("troubleshooting","Troubleshooting"),("training","Training"),("maintenance","Maintenance"))
 
 class Instrument(models.Model):
@@ -23,6 +27,25 @@ class Folder(models.Model):
     instrument=models.ForeignKey(Instrument, on_delete=models.CASCADE, related_name="folders")
     name=models.CharField(max_length=200)
     parent=models.ForeignKey("self", null=True, blank=True, on_delete=models.CASCADE, related_name="children")
+    # materialized path "/<root id hex>/.../<own id hex>/"; a subtree is one indexed prefix match
+    path=models.TextField(default="", editable=False)
+    class Meta:
+        indexes=[models.Index(fields=["instrument","path"], name="folder_path_idx", opclasses=["uuid_ops","text_pattern_ops"])]
+
+    def save(self, *args, **kwargs):
+        """Keep `path` (and the paths of all descendants, on a move) in sync with `parent`."""
+        old = self.path
+        parent_path = Folder.objects.filter(id=self.parent_id).values_list("path", flat=True).first() if self.parent_id else ""
+        if old and parent_path.startswith(old):
+            raise ValueError("a folder cannot be moved into its own subtree")
+        self.path = f"{parent_path or '/'}{self.id.hex}/"
+        if kwargs.get("update_fields") is not None:
+            kwargs["update_fields"] = set(kwargs["update_fields"]) | {"path"}
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if old and old != self.path:
+                Folder.objects.filter(path__startswith=old).exclude(id=self.id).update(
+                    path=Concat(Value(self.path), Substr("path", len(old) + 1)))
 
 class Source(models.Model):
     id=models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -36,7 +59,7 @@ class Source(models.Model):
     model_tags=ArrayField(models.CharField(max_length=64), default=list, blank=True)
     storage_uri=models.TextField()
     status=models.CharField(max_length=12, choices=SRC_STATUS, default="uploaded")
-    checksum=models.CharField(max_length=200, blank=True, null=True)
+    checksum=models.CharField(max_length=200, blank=True, null=True, db_index=True)
     archived=models.BooleanField(default=False)
     archived_at=models.DateTimeField(null=True, blank=True)
     created_at=models.DateTimeField(auto_now_add=True)
@@ -47,6 +70,20 @@ class SourceVersion(models.Model):
     version=models.CharField(max_length=50)
     storage_uri=models.TextField()
     checksum=models.CharField(max_length=200, blank=True, null=True)
+    page_hashes=ArrayField(models.CharField(max_length=64), default=list, blank=True) # per-page content hashes, for incremental re-ingestion
+    created_at=models.DateTimeField(auto_now_add=True)
+
+class Upload(models.Model):
+    """A multipart upload in progress; parts go straight to object storage via presigned URLs."""
+    id=models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    filename=models.CharField(max_length=255)
+    content_type=models.CharField(max_length=100, blank=True, null=True)
+    size=models.BigIntegerField(null=True, blank=True)
+    part_size=models.BigIntegerField()
+    storage_key=models.TextField()
+    multipart_id=models.TextField() # the storage backend's upload id
+    status=models.CharField(max_length=12, default="pending") # pending|complete|aborted
+    source=models.ForeignKey(Source, on_delete=models.SET_NULL, null=True, blank=True, related_name="uploads")
     created_at=models.DateTimeField(auto_now_add=True)
 
 class PDFFragment(models.Model):
@@ -59,12 +96,32 @@ class PDFFragment(models.Model):
     bbox_h=models.IntegerField()
     text_hash=models.CharField(max_length=128)
 
+class PackedFragmentPage(models.Model):
+    """
+    All PDF fragments of one page in one row (FRAGMENT_STORAGE=packed).
+    Arrays are little-endian int32, readable with numpy.frombuffer(..., "<i4").
+    """
+    id=models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    source=models.ForeignKey(Source, on_delete=models.CASCADE, related_name="packed_pages")
+    page=models.IntegerField()
+    count=models.IntegerField()
+    ids=models.BinaryField()  # count x 16-byte fragment UUIDs (stable IDs)
+    bboxes=models.BinaryField()  # count x (x, y, w, h)
+    text_offsets=models.BinaryField()  # count + 1 offsets into text
+    text=models.TextField(blank=True, default="")  # fragment texts, concatenated
+    page_hash=models.CharField(max_length=64, blank=True, default="")
+    class Meta:
+        constraints=[models.UniqueConstraint(fields=["source","page"], name="uq_packed_source_page")]
+
 class VideoFragment(models.Model):
     id=models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     source=models.ForeignKey(Source, on_delete=models.CASCADE, related_name="video_fragments")
     t_start=models.FloatField()
     t_end=models.FloatField()
     transcript_text=models.TextField(blank=True, null=True)
+    search_vector=SearchVectorField(null=True, editable=False) # filled at ingestion from transcript_text
+    class Meta:
+        indexes=[GinIndex(fields=["search_vector"], name="videofrag_search_gin"), models.Index(fields=["source","t_start"], name="videofrag_source_t")]
 
 class ImageFragment(models.Model):
     id=models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -100,12 +157,16 @@ class ChatSession(models.Model):
     instrument=models.ForeignKey(Instrument, on_delete=models.CASCADE)
     owner_email=models.EmailField(blank=True, null=True)
     title=models.CharField(max_length=255, blank=True, null=True)
+    # once partitioned (core/partitions.py) the unique index cannot span partitions: a trigger-maintained
+    # side table, core_chatsession_share_token_unique, enforces this instead
     share_token=models.CharField(max_length=40, blank=True, null=True, unique=True)
     created_at=models.DateTimeField(auto_now_add=True)
 
 class ChatTurn(models.Model):
     id=models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    session=models.ForeignKey(ChatSession, on_delete=models.CASCADE, related_name="turns")
+    # chat tables are range-partitioned by created_at (core/partitions.py): Postgres cannot enforce
+    # foreign keys into them, Django still cascades deletes
+    session=models.ForeignKey(ChatSession, on_delete=models.CASCADE, related_name="turns", db_constraint=False)
     role=models.CharField(max_length=16) # user|assistant
     text=models.TextField(blank=True, null=True)
     rating=models.CharField(max_length=8, blank=True, null=True) # like|dislike
@@ -114,15 +175,16 @@ class ChatTurn(models.Model):
 
 class Attachment(models.Model):
     id=models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    turn=models.ForeignKey(ChatTurn, on_delete=models.CASCADE, related_name="attachments")
+    turn=models.ForeignKey(ChatTurn, on_delete=models.CASCADE, related_name="attachments", db_constraint=False)
     storage_uri=models.TextField()
     ingest=models.BooleanField(default=False) # True = send to Knowledge Store
 
 class Citation(models.Model):
     id=models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    turn=models.ForeignKey(ChatTurn, on_delete=models.CASCADE, related_name="citations")
+    turn=models.ForeignKey(ChatTurn, on_delete=models.CASCADE, related_name="citations", db_constraint=False)
     source=models.ForeignKey(Source, on_delete=models.CASCADE)
-    fragment_id=models.UUIDField()
+    fragment_id=models.UUIDField(blank=True, null=True) # null: no specific fragment, the viewer opens the document
+    created_at=models.DateTimeField(auto_now_add=True) # partition key
 
 class Feedback(models.Model):
     id=models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -139,6 +201,59 @@ class Feedback(models.Model):
 
 class Connector(models.Model):
     id=models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    provider=models.CharField(max_length=32) # google_drive|sharepoint
+    provider=models.CharField(max_length=32) # google_drive|sharepoint|local_directory
     created_at=models.DateTimeField(auto_now_add=True)
     config_json=models.JSONField(default=dict)
+    cursor=models.TextField(blank=True, null=True) # provider delta token (Drive page token, Graph deltaLink, scan time)
+    last_synced_at=models.DateTimeField(blank=True, null=True)
+    last_sync_stats=models.JSONField(default=dict, blank=True)
+
+class ConnectorItem(models.Model):
+    """One remote file seen by a connector, with the ETag it had when last fetched."""
+    id=models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    connector=models.ForeignKey(Connector, on_delete=models.CASCADE, related_name="items")
+    external_id=models.CharField(max_length=255)
+    name=models.CharField(max_length=255)
+    etag=models.CharField(max_length=255)
+    modified_at=models.DateTimeField(blank=True, null=True)
+    source=models.ForeignKey(Source, on_delete=models.SET_NULL, null=True, blank=True, related_name="connector_items")
+    synced_at=models.DateTimeField(auto_now=True)
+    class Meta:
+        constraints=[models.UniqueConstraint(fields=["connector","external_id"], name="uniq_connector_item")]
+
+# --- Chat analytics rollups (maintained incrementally by core.analytics) ---
+class InstrumentDailyStats(models.Model):
+    instrument=models.ForeignKey(Instrument, on_delete=models.CASCADE, related_name="daily_stats")
+    day=models.DateField()
+    user_turns=models.IntegerField(default=0)
+    assistant_turns=models.IntegerField(default=0)
+    likes=models.IntegerField(default=0)
+    dislikes=models.IntegerField(default=0)
+    citations=models.IntegerField(default=0)
+    class Meta:
+        constraints=[models.UniqueConstraint(fields=["instrument","day"], name="uq_stats_instrument_day")]
+
+class FeedbackTagDailyStats(models.Model):
+    instrument=models.ForeignKey(Instrument, on_delete=models.CASCADE)
+    day=models.DateField()
+    tag=models.CharField(max_length=32) # hallucination|offtopic|etc
+    count=models.IntegerField(default=0)
+    class Meta:
+        constraints=[models.UniqueConstraint(fields=["instrument","day","tag"], name="uq_tagstats_instrument_day_tag")]
+
+class SourceCitationDailyStats(models.Model):
+    instrument=models.ForeignKey(Instrument, on_delete=models.CASCADE)
+    day=models.DateField()
+    source=models.ForeignKey(Source, on_delete=models.CASCADE)
+    count=models.IntegerField(default=0)
+    class Meta:
+        constraints=[models.UniqueConstraint(fields=["instrument","day","source"], name="uq_citestats_instrument_day_source")]
+
+# --- Knowledge Store counters (maintained incrementally by core.source_stats) ---
+class SourceCount(models.Model):
+    instrument=models.ForeignKey(Instrument, on_delete=models.CASCADE, related_name="source_counts")
+    dimension=models.CharField(max_length=16) # total|archived|folder|type|status|category
+    value=models.CharField(max_length=64, blank=True, default="") # "" = none (root folder, no category)
+    count=models.IntegerField(default=0)
+    class Meta:
+        constraints=[models.UniqueConstraint(fields=["instrument","dimension","value"], name="uq_sourcecount_instrument_dim_value")]
@@ -0,0 +1,305 @@
+# core/partitions.py
+"""
+Monthly range partitioning of the chat history tables by created_at.
+
+ChatSession, ChatTurn and Citation are written on every chat request and only
+ever read recently, so each is a Postgres table PARTITION BY RANGE (created_at)
+with one partition per month ("core_chatturn_p202410") and a default partition
+that catches rows outside every range. Inserts and autovacuum only touch the
+current month's small table and indexes, and retention detaches whole months
+instead of DELETEing rows.
+
+convert() turns the plain tables Django created into partitioned ones (once;
+it copies the rows). ensure_partitions() creates the coming months, moving any
+rows that already landed in the default partition. For retention,
+cold_partitions() lists the months older than the window, export_partition()
+writes one to object storage as Parquet or Arrow IPC (zstd) for analytics, and
+drop_partition() then detaches and drops it.
+
+Postgres cannot enforce a foreign key that points into a partitioned table, so
+the chat models declare those with db_constraint=False; Django still cascades
+deletes itself. Primary keys become (id, created_at). A unique index there must
+include created_at too, so it would only be unique per month: other unique
+columns (ChatSession.share_token) are instead registered by a trigger in a plain
+side table ("<table>_<column>_unique") whose primary key enforces uniqueness
+across every partition.
+
+Retention never drops a partition whose rows are still referenced from a newer
+partition (a session whose conversation continued into a retained month, or
+turns whose citations landed in the next month); it is kept until they expire.
+"""
+import os
+import re
+import tempfile
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+
+from django.db import connection, transaction
+
+from .models import Attachment, ChatSession, ChatTurn, Citation
+from .storage import get_storage
+
+# children first: retention drops a month of citations before the turns they point at
+PARTITIONED = (Citation, ChatTurn, ChatSession)
+ARCHIVE_PREFIX = "archive/chat"
+EXPORT_BATCH = 10000
+_SUFFIX = re.compile(r"_p(\d{4})(\d{2})$")
+
+
+def _qn(name: str) -> str:
+    return connection.ops.quote_name(name)
+
+
+def month_start(d: date, offset: int = 0) -> date:
+    """First day of the month `offset` months after the month of `d`."""
+    n = d.year * 12 + d.month - 1 + offset
+    return date(n // 12, n % 12 + 1, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_p{month:%Y%m}"
+
+
+def _unique_fields(model) -> List:
+    """Unique columns besides the key, which a partitioned table cannot index as unique."""
+    return [f for f in model._meta.concrete_fields if f.unique and not f.primary_key]
+
+
+def _unique_table(table: str, column: str) -> str:
+    return f"{table}_{column}_unique"
+
+
+def _create_unique_registry(cursor, model, field):
+    """Side table and row trigger that keep `field` unique across every partition of the model's table."""
+    table, pk = model._meta.db_table, model._meta.pk
+    side = _unique_table(table, field.column)
+    col, key = _qn(field.column), _qn(pk.column)
+    cursor.execute(f"CREATE TABLE {_qn(side)} (value {field.db_type(connection)} PRIMARY KEY, "
+                   f"row_id {pk.db_type(connection)} NOT NULL)")
+    # an UPDATE that keeps the value deletes and re-registers it; a duplicate fails the INSERT
+    cursor.execute(f"""CREATE FUNCTION {_qn(side + '_sync')}() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP <> 'INSERT' AND OLD.{col} IS NOT NULL THEN
+        DELETE FROM {_qn(side)} WHERE value = OLD.{col} AND row_id = OLD.{key};
+    END IF;
+    IF TG_OP <> 'DELETE' AND NEW.{col} IS NOT NULL THEN
+        INSERT INTO {_qn(side)} (value, row_id) VALUES (NEW.{col}, NEW.{key});
+    END IF;
+    RETURN NULL;
+END $$""")
+    cursor.execute(f"CREATE TRIGGER {_qn(side + '_sync')} AFTER INSERT OR DELETE OR UPDATE OF {col} ON {_qn(table)} "
+                   f"FOR EACH ROW EXECUTE FUNCTION {_qn(side + '_sync')}()")
+
+
+def _register_unique(cursor, model, partition: str, register: bool = True):
+    """(Un)register the unique values of the rows of `partition` when they move without the trigger seeing it."""
+    key = _qn(model._meta.pk.column)
+    for field in _unique_fields(model):
+        side = _qn(_unique_table(model._meta.db_table, field.column))
+        if register:
+            cursor.execute(f"INSERT INTO {side} (value, row_id) SELECT {_qn(field.column)}, {key} "
+                           f"FROM {_qn(partition)} WHERE {_qn(field.column)} IS NOT NULL")
+        else:
+            cursor.execute(f"DELETE FROM {side} WHERE row_id IN (SELECT {key} FROM {_qn(partition)})")
+
+
+def is_partitioned(table: str) -> bool:
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)", [table])
+        return cursor.fetchone() is not None
+
+
+def partitions(table: str) -> Dict[date, str]:
+    """The monthly partitions of `table`, by month."""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                       "WHERE i.inhparent = to_regclass(%s)", [table])
+        names = [r[0] for r in cursor.fetchall()]
+    found = {}
+    for name in names:
+        m = _SUFFIX.search(name)
+        if m and name == partition_name(table, date(int(m[1]), int(m[2]), 1)):
+            found[date(int(m[1]), int(m[2]), 1)] = name
+    return found
+
+
+def _create_partition(cursor, model, month: date) -> int:
+    """Attach `month` as a partition of the model's table, taking over its rows from the default partition."""
+    table = model._meta.db_table
+    name, default = partition_name(table, month), f"{table}_default"
+    lo, hi = f"{month:%Y-%m-%d} 00:00:00+00", f"{month_start(month, 1):%Y-%m-%d} 00:00:00+00"
+    cursor.execute(f"CREATE TABLE {_qn(name)} (LIKE {_qn(table)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+    cursor.execute(f"WITH moved AS (DELETE FROM {_qn(default)} WHERE created_at >= %s AND created_at < %s RETURNING *) "
+                   f"INSERT INTO {_qn(name)} SELECT * FROM moved", [lo, hi])
+    moved = cursor.rowcount
+    # indexes and the primary key are created on attach, from the parent's
+    cursor.execute(f"ALTER TABLE {_qn(table)} ATTACH PARTITION {_qn(name)} FOR VALUES FROM (%s) TO (%s)", [lo, hi])
+    if moved:
+        # deleting them from the default partition unregistered their unique values
+        _register_unique(cursor, model, name)
+    return moved
+
+
+def ensure_partitions(today: date, ahead: int) -> List[Tuple[str, int]]:
+    """Create the partitions of this month and the `ahead` next ones; returns (created, rows moved in)."""
+    created = []
+    for model in PARTITIONED:
+        table = model._meta.db_table
+        if not is_partitioned(table):
+            continue
+        existing = partitions(table)
+        for i in range(ahead + 1):
+            month = month_start(today, i)
+            if month in existing:
+                continue
+            with transaction.atomic(), connection.cursor() as cursor:
+                created.append((partition_name(table, month), _create_partition(cursor, model, month)))
+    return created
+
+
+def convert(model, today: date, ahead: int) -> int:
+    """Replace the plain table of `model` with a partitioned one holding the same rows; returns the row count."""
+    table = model._meta.db_table
+    old = f"{table}_unpartitioned"
+    with transaction.atomic(), connection.cursor() as cursor:
+        if model is Citation:
+            # citations predate their created_at column: they take their turn's
+            cursor.execute(f"ALTER TABLE {_qn(table)} ADD COLUMN IF NOT EXISTS created_at timestamptz")
+            cursor.execute(f"UPDATE {_qn(table)} c SET created_at = t.created_at FROM {_qn(ChatTurn._meta.db_table)} t "
+                           f"WHERE c.turn_id = t.id AND c.created_at IS NULL")
+            cursor.execute(f"UPDATE {_qn(table)} SET created_at = now() WHERE created_at IS NULL")
+            cursor.execute(f"ALTER TABLE {_qn(table)} ALTER COLUMN created_at SET NOT NULL")
+        # foreign keys into this table (from the other chat tables) cannot point at a partitioned one
+        cursor.execute("SELECT conrelid::regclass::text, conname FROM pg_constraint "
+                       "WHERE contype = 'f' AND confrelid = to_regclass(%s)", [table])
+        for referencing, constraint in cursor.fetchall():
+            cursor.execute(f"ALTER TABLE {referencing} DROP CONSTRAINT {_qn(constraint)}")
+        cursor.execute(f"ALTER TABLE {_qn(table)} RENAME TO {_qn(old)}")
+        cursor.execute(f"CREATE TABLE {_qn(table)} (LIKE {_qn(old)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) "
+                       f"PARTITION BY RANGE (created_at)")
+        cursor.execute(f"ALTER TABLE {_qn(table)} ADD PRIMARY KEY (id, created_at)")
+        for field in model._meta.concrete_fields:
+            if field.primary_key or field.column == "created_at":
+                continue
+            if field.unique or field.db_index or field.is_relation:
+                cursor.execute(f"CREATE INDEX {_qn(f'{table}_{field.column}_pidx')} ON {_qn(table)} ({_qn(field.column)})")
+            if field.is_relation and field.db_constraint:
+                rel = field.related_model._meta
+                cursor.execute(f"ALTER TABLE {_qn(table)} ADD FOREIGN KEY ({_qn(field.column)}) "
+                               f"REFERENCES {_qn(rel.db_table)} ({_qn(rel.pk.column)}) DEFERRABLE INITIALLY DEFERRED")
+        for field in _unique_fields(model):
+            # filled by the INSERT below
+            _create_unique_registry(cursor, model, field)
+        cursor.execute(f"CREATE TABLE {_qn(table + '_default')} PARTITION OF {_qn(table)} DEFAULT")
+        cursor.execute(f"SELECT min(created_at) FROM {_qn(old)}")
+        first = cursor.fetchone()[0]
+        month = month_start(first.date() if first else today)
+        while month <= month_start(today, ahead):
+            _create_partition(cursor, model, month)
+            month = month_start(month, 1)
+        cursor.execute(f"INSERT INTO {_qn(table)} SELECT * FROM {_qn(old)}")
+        rows = cursor.rowcount
+        cursor.execute(f"DROP TABLE {_qn(old)}")
+    return rows
+
+
+def cold_partitions(today: date, retention_months: int) -> List[Tuple[object, date, str]]:
+    """(model, month, partition) of every monthly partition that ended before the retention window."""
+    cutoff = month_start(today, -retention_months)
+    return [(model, month, name) for model in PARTITIONED if is_partitioned(model._meta.db_table)
+            for month, name in sorted(partitions(model._meta.db_table).items()) if month_start(month, 1) <= cutoff]
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:  # optional dependency
+        raise RuntimeError("pyarrow is required to export chat partitions (pip install pyarrow), or pass --no-export")
+    return pyarrow
+
+
+def _arrow_column(pa, field, values):
+    kind = field.get_internal_type()
+    if kind == "DateTimeField":
+        return pa.array(values, pa.timestamp("us", tz="UTC"))
+    if kind == "BooleanField":
+        return pa.array(values, pa.bool_())
+    if kind in ("IntegerField", "BigIntegerField", "PositiveIntegerField", "SmallIntegerField"):
+        return pa.array(values, pa.int64())
+    # UUIDs (keys and foreign keys) and text
+    return pa.array([None if v is None else str(v) for v in values], pa.string())
+
+
+def export_partition(model, partition: str, fmt: str = "parquet") -> Tuple[str, int]:
+    """Write `partition` to object storage as a zstd-compressed Parquet or Arrow IPC file; returns (uri, rows)."""
+    pa = _pyarrow()
+    fields = model._meta.concrete_fields
+    arrays = [_arrow_column(pa, f, []) for f in fields]
+    schema = pa.schema([(f.column, a.type) for f, a in zip(fields, arrays)])
+    ext = "parquet" if fmt == "parquet" else "arrow"
+    fd, path = tempfile.mkstemp(suffix=f".{ext}")
+    os.close(fd)
+    rows = 0
+    try:
+        if fmt == "parquet":
+            writer = pa.parquet.ParquetWriter(path, schema, compression="zstd")
+        else:
+            writer = pa.ipc.new_file(path, schema, options=pa.ipc.IpcWriteOptions(compression="zstd"))
+        with writer, transaction.atomic(), connection.chunked_cursor() as cursor:
+            cursor.execute(f"SELECT {', '.join(_qn(f.column) for f in fields)} FROM {_qn(partition)}")
+            while batch := cursor.fetchmany(EXPORT_BATCH):
+                columns = list(zip(*batch))
+                writer.write_batch(pa.record_batch([_arrow_column(pa, f, list(c)) for f, c in zip(fields, columns)],
+                                                   schema=schema))
+                rows += len(batch)
+        key = f"{ARCHIVE_PREFIX}/{model._meta.db_table}/{partition}.{ext}"
+        storage = get_storage()
+        with open(path, "rb") as fh:
+            storage.put(key, fh)
+        return storage.uri(key), rows
+    finally:
+        os.unlink(path)
+
+
+def referenced(model, partition: str) -> bool:
+    """Whether rows of another chat table still point at rows of `partition`, which must then stay."""
+    key = _qn(model._meta.pk.column)
+    with connection.cursor() as cursor:
+        for other in PARTITIONED:
+            if not is_partitioned(other._meta.db_table):
+                continue
+            for field in other._meta.concrete_fields:
+                if field.is_relation and field.related_model is model:
+                    cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {_qn(other._meta.db_table)} "
+                                   f"WHERE {_qn(field.column)} IN (SELECT {key} FROM {_qn(partition)}))")
+                    if cursor.fetchone()[0]:
+                        return True
+    return False
+
+
+def drop_partition(model, partition: str, keep: bool = False):
+    """Detach `partition` from its table and drop it unless `keep`."""
+    table = model._meta.db_table
+    with transaction.atomic(), connection.cursor() as cursor:
+        if model is ChatTurn:
+            # attachments are not partitioned: remove the ones of the turns going away
+            cursor.execute(f"DELETE FROM {_qn(Attachment._meta.db_table)} WHERE turn_id IN (SELECT id FROM {_qn(partition)})")
+        # a detach fires no triggers: free the unique values of its rows
+        _register_unique(cursor, model, partition, register=False)
+        # not CONCURRENTLY: Postgres does not allow it next to a default partition; a plain detach
+        # only changes the catalog, under a short exclusive lock on the parent
+        cursor.execute(f"ALTER TABLE {_qn(table)} DETACH PARTITION {_qn(partition)}")
+        if not keep:
+            cursor.execute(f"DROP TABLE {_qn(partition)}")
+
+
+def default_rows(table: str) -> Optional[int]:
+    """Rows in the default partition (a sign partitions are not created far enough ahead)."""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s)", [f"{table}_default"])
+        if cursor.fetchone()[0] is None:
+            return None
+        cursor.execute(f"SELECT count(*) FROM {_qn(table + '_default')}")
+        return cursor.fetchone()[0]
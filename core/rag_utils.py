@@ -5,8 +5,13 @@ RAG (Retrieval Augmented Generation) utilities for grounding chat responses in s
 import re
 from io import BytesIO
 from typing import List, Dict, Tuple
+from django.contrib.postgres.search import SearchQuery, SearchRank
 from django.db.models import Q
-from .models import Source
+from .entity_match import detect, normalize
+from .models import Source, VideoFragment
+
+# score added per detected model or error code a source is tagged with (or names in its title)
+ENTITY_BOOST = 5
 
 
 def extract_text_from_pdf(pdf_bytes: bytes, max_pages: int = 50) -> str:
@@ -42,7 +47,8 @@ def extract_text_from_pdf(pdf_bytes: bytes, max_pages: int = 50) -> str:
         return ""
 
 
-def search_sources(instrument_id: str, query: str, limit: int = 5) -> List[Dict]:
+def search_sources(instrument_id: str, query: str, limit: int = 5, transcripts: bool = True,
+                   entities: bool = True) -> List[Dict]:
     """
     Search sources for an instrument using keyword matching.
 
@@ -50,6 +56,11 @@ def search_sources(instrument_id: str, query: str, limit: int = 5) -> List[Dict]
         instrument_id: UUID of instrument
         query: User's search query
         limit: Maximum number of sources to return
+        transcripts: Also match video sources on their transcript windows
+        entities: Detect model names, the instrument name/vendor and error codes in the query
+            (core.entity_match): sources tagged for other models are filtered out, sources
+            matching a detected model or code are boosted, and the remaining words are
+            matched at word starts, short model-like tokens ("LSM", "980") included
 
     Returns:
         List of source dicts with id, title, excerpt, type
@@ -60,8 +71,23 @@ def search_sources(instrument_id: str, query: str, limit: int = 5) -> List[Dict]
         archived=False
     ).exclude(status='rejected')
 
-    # Extract keywords from query (simple approach)
-    keywords = [w.lower() for w in re.findall(r'\w+', query) if len(w) > 3]
+    detected, labels = None, None
+    if entities:
+        detected = detect(instrument_id, query)
+        # only models that map to model_tags can filter: a variant no source is tagged for
+        # (e.g. from Instrument.models_arr) would otherwise exclude every tagged source
+        tagged = [e for e in detected.of_kind("model") if e.labels]
+        if tagged:
+            # sources tagged for other models do not apply; untagged ones apply to every model
+            labels = sorted({label for e in tagged for label in e.labels})
+            sources = sources.filter(Q(model_tags=[]) | Q(model_tags__overlap=labels))
+        keywords = _residual_keywords(detected.residual, query)
+        patterns = [re.compile(r'\b' + re.escape(k)) for k in keywords]
+        boosted = [e for e in detected.entities if e.kind != "instrument"]
+        unknown_code = any(e.kind == "code" and not e.source_ids for e in detected.entities)
+    else:
+        # Extract keywords from query (simple approach)
+        keywords = [w.lower() for w in re.findall(r'\w+', query) if len(w) > 3]
 
     # Score sources based on keyword matches in title, description, category
     scored_sources = []
@@ -70,10 +96,19 @@ def search_sources(instrument_id: str, query: str, limit: int = 5) -> List[Dict]
         score = 0
         searchable_text = f"{source.title} {source.description or ''} {source.category or ''}".lower()
 
-        # Count keyword matches
-        for keyword in keywords:
-            if keyword in searchable_text:
-                score += searchable_text.count(keyword)
+        if detected:
+            score += sum(len(p.findall(searchable_text)) for p in patterns)
+            title = normalize(source.title)
+            for entity in boosted:
+                if source.id in entity.source_ids or f" {entity.term} " in title:
+                    score += ENTITY_BOOST
+            if unknown_code and source.category == 'troubleshooting':
+                score += ENTITY_BOOST / 2
+        else:
+            # Count keyword matches
+            for keyword in keywords:
+                if keyword in searchable_text:
+                    score += searchable_text.count(keyword)
 
         # Boost certain document types
         if source.category in ['manual', 'troubleshooting', 'sop']:
@@ -85,6 +120,19 @@ def search_sources(instrument_id: str, query: str, limit: int = 5) -> List[Dict]
                 'score': score
             })
 
+    # Video sources also match on their transcript windows (GIN full-text index)
+    terms = keywords + [e.term for e in boosted] if detected else keywords
+    for hit in (search_transcripts(instrument_id, terms) if transcripts else []):
+        if labels is not None and hit['source'].model_tags and not set(hit['source'].model_tags) & set(labels):
+            continue
+        item = next((x for x in scored_sources if x['source'].id == hit['source'].id), None)
+        if item is None:
+            item = {'source': hit['source'], 'score': 0}
+            scored_sources.append(item)
+        if 'fragment' not in item:
+            item['score'] += hit['score']
+            item['fragment'] = hit['fragment']
+
     # Sort by score and take top results
     scored_sources.sort(key=lambda x: x['score'], reverse=True)
     top_sources = scored_sources[:limit]
@@ -99,18 +147,73 @@ def search_sources(instrument_id: str, query: str, limit: int = 5) -> List[Dict]
         if len(source.description or '') > 200:
             excerpt += "..."
 
-        results.append({
+        result = {
             'id': str(source.id),
             'title': source.title,
             'excerpt': excerpt,
             'type': source.type,
             'category': source.category,
             'score': item['score']
-        })
+        }
+        fragment = item.get('fragment')
+        if fragment is not None:
+            text = fragment.transcript_text or ''
+            result['excerpt'] = f"[{_clock(fragment.t_start)}] " + (text[:400] + "..." if len(text) > 400 else text)
+            result['fragment_id'] = str(fragment.id)
+            result['t_start'] = fragment.t_start
+        results.append(result)
 
     return results
 
 
+def _residual_keywords(residual: str, query: str) -> List[str]:
+    """Words of the query left after entity detection: longer words, plus short acronyms and numbers."""
+    acronyms = {w.lower() for w in re.findall(r'\w+', query) if len(w) > 1 and w.isupper()}
+    return [w for w in residual.split()
+            if len(w) > 3 or w in acronyms or (len(w) > 1 and any(c.isdigit() for c in w))]
+
+
+# Retrieval modes compared by `manage.py eval_retrieval`; each takes (instrument_id, query, limit).
+RETRIEVAL_MODES = {
+    "keyword": lambda instrument_id, query, limit=5: search_sources(
+        instrument_id, query, limit, transcripts=False, entities=False),
+    "keyword+transcripts": lambda instrument_id, query, limit=5: search_sources(
+        instrument_id, query, limit, entities=False),
+    "entities": lambda instrument_id, query, limit=5: search_sources(instrument_id, query, limit, transcripts=False),
+    "entities+transcripts": search_sources,
+}
+
+
+def _clock(seconds: float) -> str:
+    m, sec = divmod(int(seconds), 60)
+    return f"{m // 60:d}:{m % 60:02d}:{sec:02d}" if m >= 60 else f"{m:d}:{sec:02d}"
+
+
+def search_transcripts(instrument_id: str, keywords: List[str], limit: int = 20) -> List[Dict]:
+    """
+    Full-text search over the video transcript windows of an instrument.
+
+    Returns the best-ranked window per video source as dicts with source, fragment and score.
+    """
+    if not keywords:
+        return []
+    query = SearchQuery(keywords[0], config="english")
+    for keyword in keywords[1:]:
+        query |= SearchQuery(keyword, config="english")
+    fragments = (VideoFragment.objects
+                 .filter(source__instrument_id=instrument_id, source__archived=False, search_vector=query)
+                 .exclude(source__status='rejected')
+                 .annotate(rank=SearchRank("search_vector", query))
+                 .select_related("source")
+                 .order_by("-rank")[:limit])
+    best = {}
+    for fragment in fragments:
+        if fragment.source_id not in best:
+            # ts_rank is ~0.1 per matched term; scale it to the keyword-count scores above
+            best[fragment.source_id] = {'source': fragment.source, 'fragment': fragment, 'score': fragment.rank * 10}
+    return list(best.values())
+
+
 def build_context_prompt(question: str, sources: List[Dict], instrument_context: dict = None) -> str:
     """
     Build a context-aware prompt for OpenAI with source information and instrument context.
@@ -175,51 +278,93 @@ Answer:"""
     return prompt
 
 
+_MARKER = "[Source "
+_MAX_DIGITS = 4
+
+
+class CitationParser:
+    """
+    Incremental [Source N] detector for streamed answers.
+
+    feed() takes text chunks as they arrive and returns the citations completed
+    by that chunk, so a marker split across chunks ("...[Sou" + "rce 2] ...") is
+    still found, exactly once. The scanner is a small state machine: outside a
+    marker it jumps from "[" to "[" with str.find; inside it matches "[Source "
+    one character at a time (state = characters matched so far), then up to
+    _MAX_DIGITS digits, then "]". Each source is cited once, in order of first
+    mention; markers for sources that were not in the prompt are ignored.
+    """
+
+    def __init__(self, sources: List[Dict]):
+        self.sources = sources
+        self.citations: List[Dict] = []
+        self._seen = set()
+        self._state = 0      # 0: outside a marker; 1..len(_MARKER): prefix matched
+        self._digits = ""
+
+    def feed(self, text: str) -> List[Dict]:
+        found = []
+        i, n = 0, len(text)
+        while i < n:
+            if self._state == 0:
+                i = text.find("[", i)
+                if i < 0:
+                    break
+                self._state, i = 1, i + 1
+                continue
+            ch = text[i]
+            if self._state < len(_MARKER):
+                if ch == _MARKER[self._state]:
+                    self._state, i = self._state + 1, i + 1
+                else:
+                    self._state = 0  # re-examine ch: it may open the next marker
+                continue
+            if ch.isdigit() and len(self._digits) < _MAX_DIGITS:
+                self._digits += ch
+                i += 1
+                continue
+            if ch == "]" and self._digits:
+                cite = self._cite(int(self._digits))
+                if cite:
+                    found.append(cite)
+                i += 1
+            self._state, self._digits = 0, ""
+        return found
+
+    def _cite(self, num: int):
+        idx = num - 1
+        if not 0 <= idx < len(self.sources):
+            return None
+        source = self.sources[idx]
+        if source['id'] in self._seen:
+            return None
+        self._seen.add(source['id'])
+        cite = {
+            'source_id': source['id'],
+            'source_title': source['title'],
+            'source_type': source['type'],
+            'citation_text': f"[Source {num}]",
+            'score': 0.9,  # High confidence for direct citations
+            'fragment_id': source.get('fragment_id'),
+        }
+        self.citations.append(cite)
+        return cite
+
+
 def parse_citations_from_response(response_text: str, sources: List[Dict]) -> Tuple[str, List[Dict]]:
     """
-    Parse citation markers from OpenAI response and link to actual sources.
+    Parse citation markers from a complete OpenAI response and link to actual sources.
 
     Args:
         response_text: OpenAI's response text containing [Source N] markers
         sources: List of source dicts used in the prompt
 
     Returns:
-        Tuple of (response_text, list of citation dicts)
+        Tuple of (response_text, list of unique citation dicts)
     """
-    citations = []
-    citation_pattern = r'\[Source (\d+)\]'
-
-    # Find all citation markers
-    matches = re.finditer(citation_pattern, response_text)
-
-    for match in matches:
-        source_num = int(match.group(1))
-
-        # Convert to 0-based index
-        source_idx = source_num - 1
-
-        if 0 <= source_idx < len(sources):
-            source = sources[source_idx]
-
-            # Create citation entry
-            citations.append({
-                'source_id': source['id'],
-                'source_title': source['title'],
-                'source_type': source['type'],
-                'citation_text': match.group(0),
-                'score': 0.9  # High confidence for direct citations
-            })
-
-    # Remove duplicates
-    seen = set()
-    unique_citations = []
-    for cite in citations:
-        key = cite['source_id']
-        if key not in seen:
-            seen.add(key)
-            unique_citations.append(cite)
-
-    return response_text, unique_citations
+    parser = CitationParser(sources)
+    parser.feed(response_text)
+    return response_text, parser.citations
 
 
 def get_or_extract_source_text(source: Source) -> str:
@@ -34,3 +34,12 @@ class AccessGrantSerializer(serializers.ModelSerializer):
 
 class ConnectorSerializer(serializers.ModelSerializer):
     class Meta: model=Connector; fields="__all__"
+
+
+def plain_rows(qs, serializer_class):
+    """
+    What serializer_class(qs, many=True).data holds for a fields="__all__" ModelSerializer
+    (same keys, same order), read with one .values() query and no per-field
+    to_representation. UUIDs and datetimes stay native for core.fastjson to encode.
+    """
+    return list(qs.values(*[f.name for f in serializer_class.Meta.model._meta.concrete_fields]))
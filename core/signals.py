@@ -0,0 +1,74 @@
+# core/signals.py
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from .entity_match import ENTITY_FIELDS, ENTITY_NAMES, entity_terms, stored_terms
+from .fragment_index import invalidate_fragment_index
+from .models import Folder, Instrument, Source, PDFFragment, VideoFragment, ImageFragment
+from .source_stats import TRACKED, TRACKED_NAMES, apply as apply_counts, counted, stored, folder_removed
+from .versioning import bump_version
+
+
+# stored Source fields the pre_save bookkeeping compares against, read in one query
+_STORED_FIELDS = tuple(dict.fromkeys((*TRACKED, *ENTITY_FIELDS)))
+
+
+@receiver(pre_save, sender=Source)
+def source_saving(sender, instance, update_fields=None, **kwargs):
+    row = None
+    if not instance._state.adding and (update_fields is None or set(update_fields) & (TRACKED_NAMES | ENTITY_NAMES)):
+        row = Source.objects.filter(id=instance.id).values(*_STORED_FIELDS).first() or {}
+    # what the Knowledge Store counters currently hold for this source (None: nothing to move)
+    instance._counted = stored(instance, update_fields, row)
+    # what it contributed to the instrument's query entity matcher (None: unchanged by this save)
+    instance._entity_terms = stored_terms(instance, update_fields, row)
+
+
+@receiver([post_save, post_delete], sender=Source)
+def source_changed(sender, instance, **kwargs):
+    if kwargs.get("created"):
+        apply_counts(None, counted(instance))
+    elif "created" in kwargs:
+        old = instance.__dict__.pop("_counted", None)
+        if old:
+            apply_counts(old, counted(instance))
+    elif not isinstance(kwargs.get("origin"), Instrument):
+        apply_counts(counted(instance), None)
+    if kwargs.get("created") or "created" not in kwargs:
+        if entity_terms(instance):
+            bump_version("entities", instance.instrument_id)
+    else:
+        old_terms = instance.__dict__.pop("_entity_terms", None)
+        if old_terms is not None and old_terms != entity_terms(instance):
+            bump_version("entities", instance.instrument_id)
+    # Anything keyed on an instrument's source set (single-flight keys, caches) rolls over
+    bump_version("sources", instance.instrument_id)
+    bump_version("sources", "all")
+    bump_version("viewer", instance.id)
+
+
+@receiver([post_save, post_delete], sender=PDFFragment)
+@receiver([post_save, post_delete], sender=VideoFragment)
+@receiver([post_save, post_delete], sender=ImageFragment)
+def fragment_changed(sender, instance, **kwargs):
+    # Per-row changes (admin, shell); bulk ingestion deletes with delete_fragment_rows()
+    # and calls invalidate_fragment_index() itself
+    invalidate_fragment_index(instance.source_id)
+
+
+@receiver([post_save, post_delete], sender=Folder)
+def folder_changed(sender, instance, **kwargs):
+    if "created" not in kwargs and not isinstance(kwargs.get("origin"), Instrument):
+        folder_removed(instance.instrument_id, instance.id)
+        # its sources moved to the root (ON DELETE SET NULL, no Source signals)
+        bump_version("sources", instance.instrument_id)
+        bump_version("sources", "all")
+    bump_version("folders", instance.instrument_id)
+    bump_version("folders", "all")
+
+
+@receiver([post_save, post_delete], sender=Instrument)
+def instrument_changed(sender, instance, **kwargs):
+    bump_version("instruments", "all")
+    # name, vendor and models_arr feed its query entity matcher
+    bump_version("entities", instance.id)
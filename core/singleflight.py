@@ -0,0 +1,118 @@
+# core/singleflight.py
+"""
+Single-flight deduplication of identical in-flight chat questions.
+
+The first request for a (instrument, normalized question, source-set version,
+upstream mode) key becomes the leader: it runs the upstream generation and publishes every
+chunk to a shared stream buffer. Concurrent identical requests become
+followers and replay that buffer instead of calling the LLM again. The flight
+registry lives in the default cache and the buffer in core.streams, so with
+Redis configured followers in other processes attach through pub/sub.
+"""
+import hashlib
+import re
+import time
+import uuid
+from typing import Callable, Iterable, Iterator, Union
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .fastjson import dumps_str, loads
+from .llm_limiter import LLMBusy
+from .streams import get_stream_buffer
+from .versioning import get_version
+
+Chunk = Union[str, dict]
+
+
+def normalize_question(question: str) -> str:
+    """Case-fold, collapse whitespace and drop trailing punctuation."""
+    q = re.sub(r"\s+", " ", (question or "").strip().lower())
+    return q.rstrip(" ?!.")
+
+
+def flight_key(instrument_id, question: str, mode: str) -> str:
+    """
+    Key shared by identical questions. `mode` names the upstream ("complete",
+    "stream", "mock"): only requests whose factories produce the same chunks and
+    fail the same way may share a generation.
+    """
+    version = get_version("sources", instrument_id)
+    raw = f"{instrument_id}|{normalize_question(question)}|{version}|{mode}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def _registry_key(key: str) -> str:
+    return f"flight:{key}"
+
+
+def shared_generation(key: str, factory: Callable[[], Iterable[Chunk]]) -> Iterator[Chunk]:
+    """
+    Yield the chunks of the generation for `key`, running `factory()` only once.
+
+    Chunks are text strings, {"citation": {...}} dicts and an optional trailing
+    {"citations": [...]} dict, the same shape `_stream_tokens_openai` produces. If the leader's generation
+    raises, the leader re-raises and followers raise LLMBusy (when the leader was
+    rate limited) or RuntimeError.
+    """
+    if not getattr(settings, "SINGLEFLIGHT_ENABLED", True):
+        yield from factory()
+        return
+
+    buf = get_stream_buffer()
+    ttl = int(getattr(settings, "SSE_STREAM_TTL", 600))
+    flight_id = f"flight-{uuid.uuid4()}"
+    for _ in range(2):
+        if cache.add(_registry_key(key), flight_id, timeout=ttl):
+            buf.create(flight_id)
+            yield from _lead(buf, key, flight_id, factory)
+            return
+        current = cache.get(_registry_key(key))
+        if current and _created(buf, current):
+            yield from _follow(buf, current)
+            return
+    # Registry entry vanished (or its leader never started) twice in a row; just run it ourselves.
+    yield from factory()
+
+
+def _created(buf, flight_id, wait: float = 1.0) -> bool:
+    """The leader registers before it creates its buffer: give it a moment to."""
+    deadline = time.monotonic() + wait
+    while buf.status(flight_id) is None:
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def _lead(buf, key, flight_id, factory):
+    try:
+        for chunk in factory():
+            if isinstance(chunk, dict):
+                buf.append(flight_id, "result", dumps_str(chunk))
+            else:
+                buf.append(flight_id, "token", dumps_str(chunk))
+            yield chunk
+    except Exception as e:
+        buf.append(flight_id, "error", dumps_str({"detail": str(e), "retry_after": getattr(e, "retry_after", None)}))
+        raise
+    finally:
+        buf.finish(flight_id)
+        if cache.get(_registry_key(key)) == flight_id:
+            cache.delete(_registry_key(key))
+
+
+def _follow(buf, flight_id):
+    wait = float(getattr(settings, "SINGLEFLIGHT_WAIT_SECONDS", 90))
+    for batch in buf.follow(flight_id, 0, wait):
+        if not batch:
+            raise RuntimeError("shared generation stalled")
+        for _, event, data in batch:
+            if event in ("token", "result"):
+                yield loads(data)
+            elif event == "error":
+                err = loads(data)
+                if err.get("retry_after") is not None:
+                    raise LLMBusy(err["retry_after"], err["detail"])
+                raise RuntimeError(err["detail"])
@@ -0,0 +1,114 @@
+# core/source_stats.py
+"""
+Knowledge Store counters: sources per instrument by folder, type, status and category.
+
+One SourceCount row per (instrument, dimension, value) is adjusted by the Source
+signals as sources are created, edited, archived and deleted, so the stats
+endpoint reads a few dozen rows no matter how many sources an instrument has.
+Archived sources only count towards "archived"; every other dimension counts
+active sources.
+
+Queryset .update() skips the per-row signals: callers that change sources that
+way (bulk ops, connector syncs) call rebuild_counts() for the affected
+instruments instead, which recomputes them with one GROUP BY each.
+"""
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.db import transaction
+from django.db.models import Count, F
+
+from .analytics import bump
+from .models import Source, SourceCount
+
+DIMENSIONS = ("folder", "type", "status", "category")
+# Source fields the counters depend on; saves touching none of them leave the counters alone
+TRACKED = ("instrument_id", "archived", "folder_id", "type", "status", "category")
+TRACKED_NAMES = {*TRACKED, "instrument", "folder"}
+_LABELS = {"folder": "root", "category": "uncategorized"}
+
+
+def _keys(archived, folder_id, typ, status, category) -> List[Tuple[str, str]]:
+    if archived:
+        return [("archived", "")]
+    return [("total", ""), ("folder", str(folder_id) if folder_id else ""), ("type", typ or ""),
+            ("status", status or ""), ("category", category or "")]
+
+
+def counted(source) -> Tuple:
+    """(instrument_id, counter keys) of a Source as it is now."""
+    return source.instrument_id, _keys(source.archived, source.folder_id, source.type, source.status, source.category)
+
+
+def stored(source, update_fields=None, row: Optional[Dict] = None) -> Optional[Tuple]:
+    """
+    counted() for the row as stored, or None for a new source / a save of untracked fields.
+    `row` holds the TRACKED values already read for this save ({} if the row is gone).
+    """
+    if source._state.adding:
+        return None
+    if update_fields is not None and not set(update_fields) & TRACKED_NAMES:
+        return None
+    if row is None:
+        row = Source.objects.filter(id=source.id).values(*TRACKED).first()
+    return (row["instrument_id"], _keys(*(row[f] for f in TRACKED[1:]))) if row else None
+
+
+def apply(old: Optional[Tuple], new: Optional[Tuple]):
+    """Move a source's counts from `old` to `new` (either may be None: created / deleted)."""
+    deltas = Counter()
+    if old:
+        deltas.update({(old[0], *k): -1 for k in old[1]})
+    if new:
+        deltas.update({(new[0], *k): 1 for k in new[1]})
+    for (instrument_id, dimension, value), n in deltas.items():
+        lookup = {"instrument_id": instrument_id, "dimension": dimension, "value": value}
+        if n > 0:
+            bump(SourceCount, lookup, count=n)
+        elif n < 0:
+            # never create a row for a decrement (its instrument may be going away in the same cascade)
+            SourceCount.objects.filter(**lookup).update(count=F("count") + n)
+
+
+def folder_removed(instrument_id, folder_id):
+    """A deleted folder's sources were moved to the root by ON DELETE SET NULL, without signals."""
+    with transaction.atomic():
+        row = (SourceCount.objects.select_for_update()
+               .filter(instrument_id=instrument_id, dimension="folder", value=str(folder_id)).first())
+        if row:
+            row.delete()
+            bump(SourceCount, {"instrument_id": instrument_id, "dimension": "folder", "value": ""}, count=row.count)
+
+
+def rebuild_counts(instrument_ids: Optional[Iterable] = None) -> int:
+    """Recompute the counters from Source (all instruments, or just `instrument_ids`); returns rows written."""
+    qs = Source.objects.all()
+    if instrument_ids is not None:
+        instrument_ids = list(set(instrument_ids))
+        if not instrument_ids:
+            return 0
+        qs = qs.filter(instrument_id__in=instrument_ids)
+    groups = qs.order_by().values_list(*TRACKED).annotate(n=Count("id"))
+    totals = Counter()
+    for *row, n in groups:
+        for k in _keys(*row[1:]):
+            totals[(row[0], *k)] += n
+    rows = [SourceCount(instrument_id=i, dimension=d, value=v, count=n) for (i, d, v), n in totals.items()]
+    with transaction.atomic():
+        stale = SourceCount.objects.all()
+        if instrument_ids is not None:
+            stale = stale.filter(instrument_id__in=instrument_ids)
+        stale.delete()
+        SourceCount.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+def instrument_counts(instrument_id) -> Dict:
+    """Stats payload for one instrument, read from its counter rows only."""
+    out = {"instrument": str(instrument_id), "total": 0, "archived": 0, **{f"by_{d}": {} for d in DIMENSIONS}}
+    for dimension, value, n in SourceCount.objects.filter(instrument_id=instrument_id, count__gt=0).values_list("dimension", "value", "count"):
+        if dimension in ("total", "archived"):
+            out[dimension] = n
+        elif dimension in DIMENSIONS:
+            out[f"by_{dimension}"][value or _LABELS.get(dimension, "")] = n
+    return out
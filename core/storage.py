@@ -0,0 +1,445 @@
+# core/storage.py
+"""
+Object storage for uploaded files.
+
+Two backends with the same interface:
+
+  LocalStorage - files under STORAGE_LOCAL_ROOT (dev / tests). Presigned part
+                 URLs point back at this API, signed with SECRET_KEY.
+  S3Storage    - any S3-compatible store (the MinIO in docker-compose, or S3),
+                 through boto3. Clients PUT parts directly to the bucket.
+
+Multipart flow: create_multipart -> presign_part per part (clients upload
+parts in parallel, and can resume by asking list_parts what is missing) ->
+complete_multipart. Objects are read back as streams, never as whole bytes.
+
+Source.storage_uri values (file://, minio://, s3://) resolve to a backend and
+key with resolve(). Readers get ranged streams (open_range), a local path
+through a bounded disk cache (cached_path), or a read-only mmap (open_mmap).
+"""
+import hashlib
+import mmap
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import BinaryIO, Dict, List, Optional, Tuple
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core import signing
+
+CHUNK_SIZE = 8 * 1024 * 1024
+_PART_SIGNER_SALT = "rayni.storage.part"
+
+
+class StorageError(Exception):
+    pass
+
+
+class LocalStorage:
+    scheme = "file"
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+
+    def _path(self, key: str) -> str:
+        path = os.path.abspath(os.path.join(self.root, key))
+        if not path.startswith(self.root + os.sep):
+            raise StorageError(f"key outside storage root: {key}")
+        return path
+
+    def _parts_dir(self, multipart_id: str) -> str:
+        return os.path.join(self.root, ".multipart", multipart_id)
+
+    def uri(self, key: str) -> str:
+        return f"file://{self._path(key)}"
+
+    # --- multipart ---
+    def create_multipart(self, key: str, content_type: Optional[str] = None) -> str:
+        multipart_id = hashlib.sha1(os.urandom(16)).hexdigest()
+        os.makedirs(self._parts_dir(multipart_id))
+        return multipart_id
+
+    def presign_part(self, key: str, multipart_id: str, part_number: int, expires: int) -> str:
+        # Relative to this API; the view makes it absolute. Expiry is checked on PUT.
+        token = signing.dumps({"k": key, "m": multipart_id, "n": part_number}, salt=_PART_SIGNER_SALT)
+        return "/api/uploads/parts?" + urlencode({"token": token})
+
+    @staticmethod
+    def verify_part_token(token: str, max_age: int) -> Dict:
+        try:
+            return signing.loads(token, salt=_PART_SIGNER_SALT, max_age=max_age)
+        except signing.BadSignature as e:
+            raise StorageError(str(e))
+
+    def put_part(self, multipart_id: str, part_number: int, stream: BinaryIO) -> str:
+        """Write one part from a stream; returns its ETag (MD5, as S3 does)."""
+        parts = self._parts_dir(multipart_id)
+        if not os.path.isdir(parts):
+            raise StorageError("unknown or finished upload")
+        md5 = hashlib.md5()
+        tmp = os.path.join(parts, f"{part_number:05d}.tmp")
+        with open(tmp, "wb") as out:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                md5.update(chunk)
+                out.write(chunk)
+        os.replace(tmp, os.path.join(parts, f"{part_number:05d}"))
+        return md5.hexdigest()
+
+    def list_parts(self, key: str, multipart_id: str) -> List[Dict]:
+        parts = self._parts_dir(multipart_id)
+        if not os.path.isdir(parts):
+            raise StorageError("unknown or finished upload")
+        return [{"part_number": int(name), "size": os.path.getsize(os.path.join(parts, name)), "etag": None}
+                for name in sorted(os.listdir(parts)) if name.isdigit()]
+
+    def complete_multipart(self, key: str, multipart_id: str, parts: List[Dict]):
+        path, src = self._path(key), self._parts_dir(multipart_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "wb") as out:
+            for p in sorted(parts, key=lambda p: p["part_number"]):
+                with open(os.path.join(src, f"{p['part_number']:05d}"), "rb") as fh:
+                    shutil.copyfileobj(fh, out, CHUNK_SIZE)
+        os.replace(path + ".tmp", path)
+        shutil.rmtree(src, ignore_errors=True)
+
+    def abort_multipart(self, key: str, multipart_id: str):
+        shutil.rmtree(self._parts_dir(multipart_id), ignore_errors=True)
+
+    # --- objects ---
+    def open(self, key: str) -> BinaryIO:
+        return open(self._path(key), "rb")
+
+    def put(self, key: str, stream: BinaryIO):
+        """Store a stream as an object, CHUNK_SIZE at a time."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "wb") as out:
+            shutil.copyfileobj(stream, out, CHUNK_SIZE)
+        os.replace(path + ".tmp", path)
+
+    def path(self, key: str) -> str:
+        return self._path(key)
+
+    def size(self, key: str) -> int:
+        try:
+            return os.path.getsize(self._path(key))
+        except FileNotFoundError:
+            raise StorageError(f"no such object: {key}")
+
+    def open_range(self, key: str, start: int, length: int) -> BinaryIO:
+        fh = self.open(key)
+        fh.seek(start)
+        return RangeFile(fh, length)
+
+    def delete(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+
+class S3Storage:
+    def __init__(self, bucket: str, scheme: str = "s3", endpoint_url: Optional[str] = None,
+                 public_endpoint_url: Optional[str] = None, region: Optional[str] = None,
+                 access_key: Optional[str] = None, secret_key: Optional[str] = None):
+        import boto3
+        from botocore.config import Config
+
+        self.bucket = bucket
+        self.scheme = scheme
+        kwargs = dict(region_name=region, aws_access_key_id=access_key, aws_secret_access_key=secret_key,
+                      config=Config(signature_version="s3v4", s3={"addressing_style": "path"}))
+        self.client = boto3.client("s3", endpoint_url=endpoint_url, **kwargs)
+        # presigned URLs must carry the host the client will use, which may differ from ours
+        self.presign_client = (boto3.client("s3", endpoint_url=public_endpoint_url, **kwargs)
+                               if public_endpoint_url else self.client)
+
+    def uri(self, key: str) -> str:
+        return f"{self.scheme}://{self.bucket}/{key}"
+
+    def create_multipart(self, key: str, content_type: Optional[str] = None) -> str:
+        extra = {"ContentType": content_type} if content_type else {}
+        return self.client.create_multipart_upload(Bucket=self.bucket, Key=key, **extra)["UploadId"]
+
+    def presign_part(self, key: str, multipart_id: str, part_number: int, expires: int) -> str:
+        return self.presign_client.generate_presigned_url(
+            "upload_part", ExpiresIn=expires,
+            Params={"Bucket": self.bucket, "Key": key, "UploadId": multipart_id, "PartNumber": part_number})
+
+    def list_parts(self, key: str, multipart_id: str) -> List[Dict]:
+        from botocore.exceptions import ClientError
+
+        parts = []
+        try:
+            for page in self.client.get_paginator("list_parts").paginate(Bucket=self.bucket, Key=key, UploadId=multipart_id):
+                parts += [{"part_number": p["PartNumber"], "size": p["Size"], "etag": p["ETag"]} for p in page.get("Parts", [])]
+        except ClientError as e:
+            raise StorageError(str(e))
+        return parts
+
+    def complete_multipart(self, key: str, multipart_id: str, parts: List[Dict]):
+        from botocore.exceptions import ClientError
+
+        try:
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket, Key=key, UploadId=multipart_id,
+                MultipartUpload={"Parts": [{"PartNumber": p["part_number"], "ETag": p["etag"]}
+                                           for p in sorted(parts, key=lambda p: p["part_number"])]})
+        except ClientError as e:
+            raise StorageError(str(e))
+
+    def abort_multipart(self, key: str, multipart_id: str):
+        self.client.abort_multipart_upload(Bucket=self.bucket, Key=key, UploadId=multipart_id)
+
+    def open(self, key: str) -> BinaryIO:
+        return self.client.get_object(Bucket=self.bucket, Key=key)["Body"]
+
+    def put(self, key: str, stream: BinaryIO):
+        """Store a stream as an object; boto3 switches to a multipart upload for large bodies."""
+        from boto3.s3.transfer import TransferConfig
+
+        self.client.upload_fileobj(stream, self.bucket, key, Config=TransferConfig(multipart_chunksize=CHUNK_SIZE))
+
+    def path(self, key: str) -> None:
+        return None  # not on the local filesystem; see cached_path()
+
+    def size(self, key: str) -> int:
+        from botocore.exceptions import ClientError
+
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=key)["ContentLength"]
+        except ClientError as e:
+            raise StorageError(str(e))
+
+    def open_range(self, key: str, start: int, length: int) -> BinaryIO:
+        return self.client.get_object(Bucket=self.bucket, Key=key, Range=f"bytes={start}-{start + length - 1}")["Body"]
+
+    def delete(self, key: str):
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+
+class RangeFile:
+    """
+    `length` bytes of an open file from its current position.
+
+    Keeps fileno()/tell() so a WSGI server's file_wrapper can sendfile() the
+    range (it uses the fd offset and Content-Length); plain reads are capped.
+    """
+
+    def __init__(self, fh: BinaryIO, length: int):
+        self.fh = fh
+        self.remaining = length
+
+    def read(self, n: int = -1) -> bytes:
+        if self.remaining <= 0:
+            return b""
+        n = self.remaining if n is None or n < 0 else min(n, self.remaining)
+        data = self.fh.read(n)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self) -> int:
+        return self.fh.fileno()
+
+    def tell(self) -> int:
+        return self.fh.tell()
+
+    def seekable(self) -> bool:
+        return False
+
+    def close(self):
+        self.fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class HashingReader:
+    """Wraps a stream and computes its SHA-256 and size as it is read."""
+
+    def __init__(self, stream: BinaryIO):
+        self.stream = stream
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def read(self, n: int = -1) -> bytes:
+        data = self.stream.read(n)
+        self.sha256.update(data)
+        self.size += len(data)
+        return data
+
+
+def sha256_of(storage, key: str) -> str:
+    """Streaming SHA-256 of a stored object, CHUNK_SIZE at a time."""
+    h = hashlib.sha256()
+    with storage.open(key) as fh:
+        while True:
+            chunk = fh.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+_storage = None
+_storage_lock = threading.Lock()
+_backends: Dict[Tuple[str, str], object] = {}
+
+
+def get_storage():
+    """The configured upload storage (STORAGE_BACKEND), created once per process."""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                if settings.STORAGE_BACKEND in ("s3", "minio"):
+                    _storage = _s3(settings.STORAGE_BACKEND, settings.S3_BUCKET)
+                else:
+                    _storage = LocalStorage(settings.STORAGE_LOCAL_ROOT)
+    return _storage
+
+
+def _s3(scheme: str, bucket: str):
+    return S3Storage(
+        bucket, scheme=scheme, endpoint_url=settings.S3_ENDPOINT_URL,
+        public_endpoint_url=settings.S3_PUBLIC_ENDPOINT_URL, region=settings.S3_REGION,
+        access_key=settings.AWS_ACCESS_KEY_ID, secret_key=settings.AWS_SECRET_ACCESS_KEY)
+
+
+def resolve(uri: str):
+    """
+    (backend, key) for a storage URI.
+
+    file:///abs/path must lie under STORAGE_LOCAL_ROOT. minio://bucket/key and
+    s3://bucket/key use the configured S3 endpoint; a bare minio://<id> from
+    older uploads is a key in S3_BUCKET.
+    """
+    scheme, sep, rest = (uri or "").partition("://")
+    if not sep or not rest:
+        raise StorageError(f"not a storage URI: {uri!r}")
+    if scheme == "file":
+        backend = _backends.get(("file", ""))
+        if backend is None:
+            backend = _backends.setdefault(("file", ""), LocalStorage(settings.STORAGE_LOCAL_ROOT))
+        path = os.path.abspath(rest)
+        if not path.startswith(backend.root + os.sep):
+            raise StorageError(f"file outside storage root: {uri}")
+        return backend, os.path.relpath(path, backend.root)
+    if scheme in ("s3", "minio"):
+        bucket, _, key = rest.partition("/")
+        if not key:
+            bucket, key = settings.S3_BUCKET, bucket
+        with _storage_lock:
+            backend = _backends.get((scheme, bucket))
+            if backend is None:
+                backend = _backends[(scheme, bucket)] = _s3(scheme, bucket)
+        return backend, key
+    raise StorageError(f"unsupported storage scheme: {scheme}")
+
+
+class DiskCache:
+    """
+    Bounded local copies of remote objects, evicted least-recently-used.
+
+    Entries are named by the URI's hash. Storage keys are immutable per upload,
+    so an entry never goes stale. Hits refresh the mtime; eviction removes the
+    oldest entries once the total exceeds max_bytes.
+    """
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def path_for(self, uri: str) -> str:
+        return os.path.join(self.root, hashlib.sha256(uri.encode()).hexdigest())
+
+    def get(self, uri: str) -> Optional[str]:
+        path = self.path_for(uri)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def fetch(self, uri: str, backend, key: str) -> str:
+        os.makedirs(self.root, exist_ok=True)
+        path = self.path_for(uri)
+        fd, tmp = tempfile.mkstemp(dir=self.root, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as out, backend.open(key) as src:
+                shutil.copyfileobj(src, out, CHUNK_SIZE)
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except FileNotFoundError:
+                pass
+            raise
+        self.evict(keep=path)
+        return path
+
+    def evict(self, keep: Optional[str] = None):
+        with self._lock:
+            entries = []
+            with os.scandir(self.root) as it:
+                for e in it:
+                    if e.is_file() and not e.name.endswith(".part"):
+                        st = e.stat()
+                        entries.append((st.st_mtime, st.st_size, e.path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    os.remove(path)
+                    total -= size
+                except FileNotFoundError:
+                    pass
+
+
+_disk_cache = None
+
+
+def disk_cache() -> DiskCache:
+    global _disk_cache
+    if _disk_cache is None:
+        _disk_cache = DiskCache(settings.STORAGE_CACHE_DIR, settings.STORAGE_CACHE_MAX_BYTES)
+    return _disk_cache
+
+
+def local_path(uri: str) -> Optional[str]:
+    """A filesystem path holding the object, without downloading: file:// objects or cache hits."""
+    backend, key = resolve(uri)
+    return backend.path(key) or disk_cache().get(uri)
+
+
+def cached_path(uri: str) -> str:
+    """A filesystem path holding the object, downloading remote objects into the disk cache once."""
+    backend, key = resolve(uri)
+    return backend.path(key) or disk_cache().get(uri) or disk_cache().fetch(uri, backend, key)
+
+
+@contextmanager
+def open_mmap(uri: str):
+    """Read-only memory map of an object (via cached_path), for parsers that take file-like input."""
+    with open(cached_path(uri), "rb") as fh:
+        if os.fstat(fh.fileno()).st_size == 0:
+            yield b""  # mmap cannot map an empty file
+            return
+        mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield mm
+        finally:
+            mm.close()
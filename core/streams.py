@@ -0,0 +1,423 @@
+# core/streams.py
+"""
+Resumable Server-Sent Event streams.
+
+Chat generation runs in a background thread and appends every event to a
+per-stream buffer (Redis when REDIS_URL is set, in-process otherwise). The HTTP
+response only replays that buffer, so a client whose connection drops can
+reconnect with `Last-Event-ID` and continue from the next event while the LLM
+keeps generating.
+"""
+import asyncio
+import contextvars
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from json.encoder import encode_basestring_ascii
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import connections
+from django.http import HttpResponse, StreamingHttpResponse
+
+
+def _ttl() -> int:
+    return int(getattr(settings, "SSE_STREAM_TTL", 600))
+
+
+def _heartbeat() -> float:
+    return float(getattr(settings, "SSE_HEARTBEAT_SECONDS", 15))
+
+
+class LocalStreamBuffer:
+    """In-process buffer; only resumable within the same worker process."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._streams = {}  # stream_id -> {"events": [...], "done": bool, "expires": float}
+
+    def _purge(self):
+        t = time.monotonic()
+        for sid in [s for s, st in self._streams.items() if st["expires"] < t]:
+            del self._streams[sid]
+
+    def create(self, stream_id: str):
+        with self._cond:
+            self._purge()
+            self._streams[stream_id] = {"events": [], "done": False, "expires": time.monotonic() + _ttl()}
+
+    def status(self, stream_id: str) -> Optional[Tuple[int, bool]]:
+        """Return (event_count, done), or None if the stream is unknown or expired."""
+        with self._cond:
+            st = self._streams.get(stream_id)
+            if not st or st["expires"] < time.monotonic():
+                return None
+            return len(st["events"]), st["done"]
+
+    def append(self, stream_id: str, event: str, data: str) -> int:
+        with self._cond:
+            st = self._streams[stream_id]
+            st["events"].append((event, data))
+            st["expires"] = time.monotonic() + _ttl()
+            self._cond.notify_all()
+            return len(st["events"])
+
+    def finish(self, stream_id: str):
+        with self._cond:
+            st = self._streams.get(stream_id)
+            if st:
+                st["done"] = True
+            self._cond.notify_all()
+
+    def follow(self, stream_id: str, after: int = 0, idle_timeout: float = 15) -> Iterator[List[Tuple[int, str, str]]]:
+        """Yield batches of (seq, event, data) after `after`; an empty batch means idle for `idle_timeout`."""
+        deadline = time.monotonic() + idle_timeout
+        while True:
+            with self._cond:
+                st = self._streams.get(stream_id)
+                if not st:
+                    return
+                pending = st["events"][after:]
+                done = st["done"]
+                remaining = deadline - time.monotonic()
+                if not pending and not done and remaining > 0:
+                    self._cond.wait(remaining)
+                    continue
+            if pending:
+                batch = [(after + i, event, data) for i, (event, data) in enumerate(pending, 1)]
+                after += len(batch)
+                yield batch
+            elif done:
+                return
+            else:
+                yield []
+            deadline = time.monotonic() + idle_timeout
+
+
+class RedisStreamBuffer:
+    """
+    Redis-backed buffer shared by all worker processes.
+
+    Events live in a list under `rayni:sse:<id>` and writers publish on a channel
+    of the same name, so followers block on pub/sub instead of polling.
+    """
+
+    def __init__(self, url: str):
+        import redis
+        self._r = redis.Redis.from_url(url)
+
+    @staticmethod
+    def _key(stream_id):
+        return f"rayni:sse:{stream_id}"
+
+    @staticmethod
+    def _meta(stream_id):
+        return f"rayni:sse:{stream_id}:meta"
+
+    def create(self, stream_id: str):
+        pipe = self._r.pipeline()
+        pipe.delete(self._key(stream_id))
+        pipe.hset(self._meta(stream_id), "done", 0)
+        pipe.expire(self._meta(stream_id), _ttl())
+        pipe.execute()
+
+    def status(self, stream_id: str) -> Optional[Tuple[int, bool]]:
+        """Return (event_count, done), or None if the stream is unknown or expired."""
+        pipe = self._r.pipeline()
+        pipe.hget(self._meta(stream_id), "done")
+        pipe.llen(self._key(stream_id))
+        done, length = pipe.execute()
+        if done is None:
+            return None
+        return length, done == b"1"
+
+    def append(self, stream_id: str, event: str, data: str) -> int:
+        ttl = _ttl()
+        pipe = self._r.pipeline()
+        pipe.rpush(self._key(stream_id), f"{event}\n{data}")
+        pipe.expire(self._key(stream_id), ttl)
+        pipe.expire(self._meta(stream_id), ttl)
+        pipe.publish(self._key(stream_id), b"1")
+        seq = pipe.execute()[0]
+        return seq
+
+    def finish(self, stream_id: str):
+        pipe = self._r.pipeline()
+        pipe.hset(self._meta(stream_id), "done", 1)
+        pipe.publish(self._key(stream_id), b"1")
+        pipe.execute()
+
+    def follow(self, stream_id: str, after: int = 0, idle_timeout: float = 15) -> Iterator[List[Tuple[int, str, str]]]:
+        """Yield batches of (seq, event, data) after `after`; an empty batch means idle for `idle_timeout`."""
+        pubsub = self._r.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self._key(stream_id))
+        try:
+            while True:
+                # Subscribe first, then read, so an append between the two is never missed.
+                items = self._r.lrange(self._key(stream_id), after, -1)
+                if items:
+                    batch = []
+                    for raw in items:
+                        after += 1
+                        event, _, data = raw.decode("utf-8").partition("\n")
+                        batch.append((after, event, data))
+                    yield batch
+                    continue
+                done = self._r.hget(self._meta(stream_id), "done")
+                if done is None:
+                    return  # expired
+                if done == b"1":
+                    if self._r.llen(self._key(stream_id)) <= after:
+                        return
+                    continue
+                if pubsub.get_message(timeout=idle_timeout) is None:
+                    yield []
+        finally:
+            pubsub.close()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_stream_buffer():
+    """Return the process-wide stream buffer (Redis if REDIS_URL is configured)."""
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                url = getattr(settings, "REDIS_URL", None)
+                buf = None
+                if url:
+                    try:
+                        buf = RedisStreamBuffer(url)
+                        buf._r.ping()
+                    except Exception as e:
+                        print(f"SSE buffer: Redis unavailable ({e}); falling back to in-process buffer")
+                        buf = None
+                _buffer = buf or LocalStreamBuffer()
+    return _buffer
+
+
+_producers = set()
+_producers_lock = threading.Lock()
+
+
+def start_stream(stream_id: str, producer: Iterable[Tuple[str, str]]):
+    """
+    Run `producer` in a background thread, appending each (event, data_json) to the buffer.
+
+    The generation is decoupled from the HTTP connection: it runs to completion
+    (and persists its results) even if every client disconnects.
+    """
+    buf = get_stream_buffer()
+    buf.create(stream_id)
+
+    def _run():
+        try:
+            for event, data in producer:
+                buf.append(stream_id, event, data)
+        except Exception as e:
+            print(f"SSE stream {stream_id} failed: {e}")
+            buf.append(stream_id, "error", '{"detail": "stream failed"}')
+        finally:
+            buf.finish(stream_id)
+            connections.close_all()
+            with _producers_lock:
+                _producers.discard(threading.current_thread())
+
+    t = threading.Thread(target=_run, name=f"sse-{stream_id}", daemon=True)
+    with _producers_lock:
+        _producers.add(t)
+    t.start()
+
+
+def drain_streams(timeout: float) -> int:
+    """
+    Wait up to `timeout` seconds for this process's in-flight generations to finish
+    (called by the server on graceful shutdown); returns how many were still running.
+    """
+    deadline = time.monotonic() + max(timeout, 0)
+    with _producers_lock:
+        pending = list(_producers)
+    for t in pending:
+        t.join(max(deadline - time.monotonic(), 0))
+    return sum(t.is_alive() for t in pending)
+
+
+_PING = ": ping\n\n"
+_EVENT_HEADERS = {e: f"\nevent: {e}\ndata: " for e in ("start", "token", "citation", "done", "error")}
+
+
+def _event_header(event: str) -> str:
+    return _EVENT_HEADERS.get(event) or f"\nevent: {event}\ndata: "
+
+
+def token_data(chunk: str) -> str:
+    """JSON payload of a `token` event, without a json.dumps() per chunk."""
+    return '{"t": ' + encode_basestring_ascii(chunk) + "}"
+
+
+_END = object()
+
+
+def _pump(items: Iterable, out: "queue.Queue", stop: threading.Event):
+    """Feed `items` into `out` from a helper thread, then (_END, error or None)."""
+    try:
+        for item in items:
+            out.put((item, None))
+            if stop.is_set():
+                break
+        out.put((_END, None))
+    except BaseException as e:
+        out.put((_END, e))
+    finally:
+        close = getattr(items, "close", None)
+        if close:
+            close()
+        connections.close_all()
+
+
+def coalesce_tokens(items: Iterable, max_bytes: Optional[int] = None, max_ms: Optional[float] = None) -> Iterator:
+    """
+    Merge small upstream text deltas into larger chunks.
+
+    A chunk is flushed once it holds `max_bytes` characters, or `max_ms` after its
+    first delta arrived even if the upstream has gone quiet meanwhile: `items` is
+    read on a helper thread and the wait for the next delta is bounded by that
+    deadline. Whatever is left is flushed at the end. Non-string items (e.g. the
+    trailing citations dict) flush the pending text and are passed through
+    unchanged; an exception from `items` is re-raised here. Both thresholds default
+    to SSE_COALESCE_BYTES / SSE_COALESCE_MS; 0 disables coalescing.
+    """
+    if max_bytes is None:
+        max_bytes = int(getattr(settings, "SSE_COALESCE_BYTES", 64))
+    if max_ms is None:
+        max_ms = float(getattr(settings, "SSE_COALESCE_MS", 20))
+    if max_bytes <= 0 or max_ms <= 0:
+        for item in items:
+            if not isinstance(item, str) or item:
+                yield item
+        return
+    max_s = max_ms / 1000.0
+
+    pending: "queue.Queue" = queue.Queue()
+    stop = threading.Event()
+    # the upstream may read request-scoped state (e.g. the replica pin)
+    ctx = contextvars.copy_context()
+    threading.Thread(target=ctx.run, args=(_pump, items, pending, stop), name="sse-coalesce", daemon=True).start()
+    parts, size, deadline = [], 0, None
+    try:
+        while True:
+            try:
+                item, error = pending.get(timeout=None if deadline is None else max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                yield "".join(parts)
+                parts, size, deadline = [], 0, None
+                continue
+            if item is _END:
+                if error is not None:
+                    raise error
+                break
+            if not isinstance(item, str):
+                if parts:
+                    yield "".join(parts)
+                    parts, size, deadline = [], 0, None
+                yield item
+                continue
+            if not item:
+                continue
+            parts.append(item)
+            size += len(item)
+            if deadline is None:
+                deadline = time.monotonic() + max_s
+            if size >= max_bytes:
+                yield "".join(parts)
+                parts, size, deadline = [], 0, None
+    finally:
+        # a consumer that stops early lets the helper thread finish at the next delta
+        stop.set()
+    if parts:
+        yield "".join(parts)
+
+
+def parse_last_event_id(value: Optional[str]) -> Optional[Tuple[str, int]]:
+    """Parse a `<stream_id>:<seq>` event ID into (stream_id, seq)."""
+    if not value:
+        return None
+    stream_id, sep, seq = value.strip().rpartition(":")
+    if not sep or not stream_id or not seq.isdigit():
+        return None
+    return stream_id, int(seq)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _stream_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=int(getattr(settings, "SSE_ASGI_THREADS", 256)),
+                                               thread_name_prefix="sse-follow")
+    return _executor
+
+
+async def _aiter(gen: Iterator[str]):
+    """
+    Serve a blocking chunk generator to an ASGI server without materializing it:
+    each next() runs on the stream executor, so a buffer wait never blocks the event
+    loop (Django would otherwise read a sync iterator to the end before sending).
+    """
+    loop = asyncio.get_running_loop()
+    done = object()
+    try:
+        while True:
+            chunk = await loop.run_in_executor(_stream_executor(), next, gen, done)
+            if chunk is done:
+                return
+            yield chunk
+    finally:
+        await loop.run_in_executor(_stream_executor(), gen.close)
+
+
+def is_asgi(request) -> bool:
+    return isinstance(request, ASGIRequest)
+
+
+def stream_response(stream_id: str, after: int = 0, asynchronous: bool = False) -> HttpResponse:
+    """
+    Replay a buffered stream as SSE, starting after event `after`.
+
+    Every event carries `id: <stream_id>:<seq>` so the browser can resume, and
+    idle periods emit `: ping` comments to keep proxies from closing the socket.
+    Unknown or expired streams answer 204, which tells EventSource to stop
+    reconnecting instead of silently regenerating the answer. Pass
+    `asynchronous=True` when serving under ASGI (see is_asgi).
+    """
+    buf = get_stream_buffer()
+    st = buf.status(stream_id)
+    if st is None or (st[1] and st[0] <= after):
+        return HttpResponse(status=204)
+    retry_ms = int(getattr(settings, "SSE_RETRY_MS", 3000))
+
+    id_prefix = f"id: {stream_id}:"
+
+    def gen():
+        yield f"retry: {retry_ms}\n\n"
+        # One write per batch of buffered events rather than per event/line.
+        for batch in buf.follow(stream_id, after, _heartbeat()):
+            if not batch:
+                yield _PING
+                continue
+            yield "".join([id_prefix + str(seq) + _event_header(event) + data + "\n\n" for seq, event, data in batch])
+
+    resp = StreamingHttpResponse(_aiter(gen()) if asynchronous else gen(), content_type="text/event-stream")
+    # help the browser/proxies treat it as a live stream
+    resp["Cache-Control"] = "no-cache"
+    resp["X-Accel-Buffering"] = "no"
+    return resp
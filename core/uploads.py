@@ -0,0 +1,179 @@
+# core/uploads.py
+"""
+Resumable multipart uploads into object storage.
+
+initiate -> the client PUTs parts (in parallel) to presigned URLs -> complete.
+An interrupted client asks upload_status() which parts are missing and gets
+fresh URLs for just those. On completion the object is hashed as a stream
+(SHA-256 into Source.checksum) and deduplicated against existing sources.
+A video and its WebVTT/SRT sidecar (lecture.mp4, lecture.en.vtt) are separate
+uploads: whichever completes second ingests the transcript into the video.
+"""
+import math
+import os
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+
+from .ingest import TRANSCRIPT_EXTS, ingest_video_transcript, transcript_sidecar_of
+from .models import Source, Upload, VideoFragment
+from .storage import get_storage, open_mmap, sha256_of, StorageError
+
+MAX_PARTS = 10000  # S3 limit
+MIN_PART_SIZE = 5 * 1024 * 1024  # S3 minimum for all but the last part
+
+
+class UploadError(Exception):
+    def __init__(self, detail: str, **extra):
+        super().__init__(detail)
+        self.extra = extra
+
+
+def plan_parts(size: Optional[int]) -> Tuple[int, Optional[int]]:
+    """(part_size, part_count) for a file of `size` bytes; part_count is None if the size is unknown."""
+    part_size = max(settings.UPLOAD_PART_SIZE, MIN_PART_SIZE)
+    if not size:
+        return part_size, None
+    part_size = max(part_size, math.ceil(size / MAX_PARTS))
+    return part_size, max(1, math.ceil(size / part_size))
+
+
+def start_upload(filename: str, size: Optional[int] = None, content_type: Optional[str] = None) -> Upload:
+    part_size, _ = plan_parts(size)
+    upload = Upload(filename=filename, content_type=content_type, size=size, part_size=part_size)
+    safe_name = re.sub(r"[^\w.\-]+", "_", os.path.basename(filename or "")).strip("._") or "file"
+    upload.storage_key = f"uploads/{upload.id}/{safe_name}"
+    upload.multipart_id = get_storage().create_multipart(upload.storage_key, content_type)
+    upload.save()
+    return upload
+
+
+def part_urls(upload: Upload, part_numbers: Iterable[int]) -> List[Dict]:
+    storage = get_storage()
+    return [{"part_number": n, "url": storage.presign_part(upload.storage_key, upload.multipart_id, n, settings.UPLOAD_URL_EXPIRY)}
+            for n in part_numbers]
+
+
+def upload_status(upload: Upload) -> Dict:
+    """Uploaded parts, and the part numbers still missing (when the size is known)."""
+    parts = get_storage().list_parts(upload.storage_key, upload.multipart_id) if upload.status == "pending" else []
+    _, count = plan_parts(upload.size)
+    have = {p["part_number"] for p in parts}
+    return {
+        "upload_id": str(upload.id),
+        "status": upload.status,
+        "part_size": upload.part_size,
+        "part_count": count,
+        "uploaded": [{"part_number": p["part_number"], "size": p["size"]} for p in parts],
+        "missing": [n for n in range(1, count + 1) if n not in have] if count else [],
+    }
+
+
+def abort_upload(upload: Upload):
+    if upload.status == "pending":
+        get_storage().abort_multipart(upload.storage_key, upload.multipart_id)
+        upload.status = "aborted"
+        upload.save(update_fields=["status"])
+
+
+def complete_upload(upload: Upload, fields: Dict) -> Tuple[Source, bool]:
+    """
+    Assemble the parts, checksum the object and attach it to a Source.
+
+    `fields` are the Source fields sent by the client (instrument_id, title, ...).
+    Returns (source, deduplicated). When the same bytes already back a source of
+    the same instrument, that source is returned and the new object is dropped;
+    when they back a source elsewhere, the new source shares that object.
+    """
+    if upload.status == "complete" and upload.source_id:
+        return upload.source, False
+    if upload.status != "pending":
+        raise UploadError(f"upload is {upload.status}")
+    storage = get_storage()
+    parts = storage.list_parts(upload.storage_key, upload.multipart_id)
+    numbers = [p["part_number"] for p in parts]
+    _, count = plan_parts(upload.size)
+    if count and numbers != list(range(1, count + 1)):
+        raise UploadError("missing parts", missing=sorted(set(range(1, count + 1)) - set(numbers)))
+    if not parts or numbers != list(range(1, len(parts) + 1)):
+        raise UploadError("parts must be numbered 1..N without gaps", uploaded=numbers)
+    received = sum(p["size"] for p in parts)
+    if upload.size is not None and received != upload.size:
+        raise UploadError(f"received {received} bytes, expected {upload.size}")
+    storage.complete_multipart(upload.storage_key, upload.multipart_id, parts)
+    checksum = sha256_of(storage, upload.storage_key)
+
+    instrument_id = fields.get("instrument_id")
+    deduplicated = False
+    with transaction.atomic():
+        source = (Source.objects.filter(instrument_id=instrument_id, checksum=checksum, archived=False)
+                  .order_by("created_at").first())
+        if source:
+            deduplicated = True
+        else:
+            shared_uri = (Source.objects.filter(checksum=checksum).exclude(storage_uri="")
+                          .values_list("storage_uri", flat=True).first())
+            source = Source.objects.create(
+                instrument_id=instrument_id,
+                folder_id=fields.get("folder_id"),
+                type=fields.get("type", "pdf"),
+                title=fields.get("title") or upload.filename or "Uploaded File",
+                category=fields.get("category"),
+                description=fields.get("description"),
+                version=fields.get("version"),
+                model_tags=fields.get("model_tags", []),
+                storage_uri=shared_uri or storage.uri(upload.storage_key),
+                checksum=checksum,
+                status="uploaded",
+            )
+            deduplicated = bool(shared_uri)
+        upload.status, upload.source = "complete", source
+        upload.save(update_fields=["status", "source"])
+    if deduplicated:
+        storage.delete(upload.storage_key)
+    ingest_sidecar_transcript(upload, source)
+    return source, deduplicated
+
+
+def ingest_sidecar_transcript(upload: Upload, source: Source) -> Optional[int]:
+    """
+    Ingest the transcript of a video once both it and its sidecar upload are complete.
+
+    A completed video takes the latest completed sidecar of the same instrument
+    (lecture.mp4 -> lecture.vtt, lecture.en.srt, ...); a completed sidecar goes into
+    the latest completed video it belongs to. Videos that already have fragments
+    are left alone. Returns the fragment count, or None when there is nothing to
+    pair or the transcript cannot be read (`ingest_source` can still ingest it).
+    """
+    name = os.path.basename(upload.filename or "")
+    stem = name.split(".")[0]
+    if not stem:
+        return None
+    done = (Upload.objects.filter(status="complete", source__instrument_id=source.instrument_id, filename__startswith=stem)
+            .exclude(id=upload.id).select_related("source").order_by("-created_at"))
+    if source.type == "video":
+        sidecars = {}
+        for u in done:
+            sidecars.setdefault(os.path.basename(u.filename), u)
+        found = transcript_sidecar_of(name, sidecars)
+        if not found:
+            return None
+        video, transcript = source, sidecars[found].source
+    elif name.lower().endswith(TRANSCRIPT_EXTS):
+        video = next((u.source for u in done if u.source.type == "video"
+                      and transcript_sidecar_of(u.filename, [name]) == name), None)
+        if video is None:
+            return None
+        transcript = source
+    else:
+        return None
+    if VideoFragment.objects.filter(source=video).exists():
+        return None
+    try:
+        with open_mmap(transcript.storage_uri) as data:
+            text = bytes(data).decode("utf-8-sig")
+    except (StorageError, OSError, UnicodeDecodeError):
+        return None
+    return ingest_video_transcript(video, text)
@@ -0,0 +1,42 @@
+# core/versioning.py
+"""
+Cache-backed version counters.
+
+Readers fold a version into cache keys (or ETags); writers bump it. Counters live
+in the default cache, so they are shared across processes when Redis is
+configured. A missing counter is re-seeded from the clock, so an evicted counter
+never hands out a version that was already used.
+"""
+import time
+
+from django.core.cache import cache
+
+
+def _key(scope: str, key) -> str:
+    return f"ver:{scope}:{key}"
+
+
+def _seed() -> int:
+    return int(time.time() * 1000)
+
+
+def get_version(scope: str, key) -> int:
+    """Current version of `scope`/`key` (e.g. get_version("sources", instrument_id))."""
+    k = _key(scope, key)
+    v = cache.get(k)
+    if v is None:
+        v = _seed()
+        if not cache.add(k, v, timeout=None):
+            v = cache.get(k, v)
+    return v
+
+
+def bump_version(scope: str, key) -> int:
+    """Invalidate everything derived from `scope`/`key` and return the new version."""
+    k = _key(scope, key)
+    try:
+        return cache.incr(k)
+    except ValueError:
+        # Counter missing (never read, or evicted): start over from the clock.
+        cache.add(k, _seed(), timeout=None)
+        return cache.incr(k)
@@ -1,11 +1,10 @@
 # core/views.py
 import uuid, json, time, random
-import os
-import urllib.request
+import os, re, io, mimetypes, base64, hashlib
+import urllib.request, urllib.error
 
-from django.http import StreamingHttpResponse, HttpResponse
+from django.http import HttpResponse, JsonResponse, FileResponse
 from django.shortcuts import get_object_or_404
-from django.db.models import Q
 from django.utils.timezone import now
 from django.views.decorators.csrf import csrf_exempt
 
@@ -14,10 +13,23 @@ from rest_framework.decorators import api_view, permission_classes, renderer_cla
 from rest_framework.permissions import AllowAny
 from rest_framework.viewsets import ModelViewSet
 from rest_framework import status
+from rest_framework.exceptions import ValidationError
 from rest_framework.renderers import BaseRenderer
 
 from .models import *
 from .serializers import *
+from .singleflight import flight_key, shared_generation
+from .analytics import record_turn, record_citations, record_feedback, instrument_summary
+from .fragment_index import get_fragment_index
+from .storage import get_storage, resolve, local_path, LocalStorage, RangeFile, StorageError
+from .uploads import start_upload, part_urls, plan_parts, upload_status, abort_upload, complete_upload, UploadError
+from .connectors import validate as validate_connector, try_sync, start_sync, ConnectorError
+from .folders import folder_tree
+from .conditional import cached_response
+from .fastjson import dumps_str
+from .source_stats import instrument_counts
+from .bulk import filter_sources, run_bulk, get_job as get_bulk_job, BulkError
+from .llm_limiter import llm_limiter, LLMBusy, INTERACTIVE, STANDARD, estimate_tokens, parse_retry_after
 
 # ---- Renderer to allow text/event-stream (SSE) ----
 class EventStreamRenderer(BaseRenderer):
@@ -25,7 +37,7 @@ class EventStreamRenderer(BaseRenderer):
     format = "event-stream"
     charset = "utf-8"
     def render(self, data, accepted_media_type=None, renderer_context=None):
-        # Not actually used because we return StreamingHttpResponse,
+        # Not actually used because streams return a StreamingHttpResponse (core/streams.py),
         # but its presence allows DRF to negotiate the Accept header.
         return data
 
@@ -34,6 +46,9 @@ class InstrumentViewSet(ModelViewSet):
     queryset = Instrument.objects.all().order_by("name")
     serializer_class = InstrumentSerializer
     permission_classes = [AllowAny]
+    def list(self, request, *a, **kw):
+        return cached_response(request, "instruments", [("instruments", "all")],
+                               lambda: plain_rows(self.filter_queryset(self.queryset), InstrumentSerializer))
 
 class FolderViewSet(ModelViewSet):
     queryset = Folder.objects.all()
@@ -43,22 +58,54 @@ class FolderViewSet(ModelViewSet):
         qs = self.queryset
         instrument = request.GET.get("instrument")
         if instrument: qs = qs.filter(instrument_id=instrument)
-        return Response(FolderSerializer(qs, many=True).data)
+        return cached_response(request, "folders", [("folders", instrument or "all")],
+                               lambda: plain_rows(qs, FolderSerializer))
+    def perform_create(self, serializer):
+        self._save(serializer)
+    def perform_update(self, serializer):
+        self._save(serializer)
+    def _save(self, serializer):
+        try:
+            serializer.save()
+        except ValueError as e:  # moved into its own subtree
+            raise ValidationError({"parent": [str(e)]})
+
+@api_view(["GET"])
+@permission_classes([AllowAny])
+def folders_tree(request):
+    """Nested folder tree of ?instrument=, with non-archived source counts (cached per instrument)."""
+    instrument = request.GET.get("instrument")
+    if not instrument:
+        return Response({"detail": "instrument is required"}, status=400)
+    try:
+        uuid.UUID(instrument)
+    except ValueError:
+        return Response({"detail": "invalid instrument"}, status=400)
+    return Response({"instrument": instrument, "items": folder_tree(instrument)})
+
+@api_view(["GET"])
+@permission_classes([AllowAny])
+def sources_stats(request):
+    """Knowledge Store counts of ?instrument= by folder, type, status and category (from maintained counters)."""
+    instrument = request.GET.get("instrument")
+    if not instrument:
+        return Response({"detail": "instrument is required"}, status=400)
+    try:
+        uuid.UUID(instrument)
+    except ValueError:
+        return Response({"detail": "invalid instrument"}, status=400)
+    return Response(instrument_counts(instrument))
 
 class SourceViewSet(ModelViewSet):
     queryset = Source.objects.all().order_by("-created_at")
     serializer_class = SourceSerializer
     permission_classes = [AllowAny]
     def list(self, request, *a, **kw):
-        qs = self.queryset
-        instrument = request.GET.get("instrument")
-        q = request.GET.get("q"); typ = request.GET.get("type"); status_f = request.GET.get("status"); folder = request.GET.get("folder")
-        if instrument: qs = qs.filter(instrument_id=instrument)
-        if folder: qs = qs.filter(folder_id=folder)
-        if q: qs = qs.filter(Q(title__icontains=q)|Q(version__icontains=q)|Q(model_tags__icontains=q))
-        if typ: qs = qs.filter(type=typ)
-        if status_f: qs = qs.filter(status=status_f)
-        return Response(SourceSerializer(qs, many=True).data)
+        qs = filter_sources(self.queryset, request.GET)
+        instrument = request.GET.get("instrument") or "all"
+        # folder_subtree also depends on where folders sit in the tree
+        scopes = [("sources", instrument)] + ([("folders", instrument)] if request.GET.get("folder_subtree") else [])
+        return cached_response(request, "sources", scopes, lambda: plain_rows(qs, SourceSerializer))
 
 class SourceVersionViewSet(ModelViewSet):
     queryset = SourceVersion.objects.all().order_by("-created_at")
@@ -84,6 +131,38 @@ DEMO_USERS = {
     },
 }
 
+def _pack_ids(ids) -> str:
+    """Instrument ids as one base64 string of sorted 16-byte UUIDs (~22 chars each instead of 38 in a JSON list)."""
+    return base64.b64encode(b"".join(sorted(uuid.UUID(str(i)).bytes for i in ids))).decode("ascii")
+
+def _unpack_ids(packed: str):
+    raw = base64.b64decode(packed)
+    return [str(uuid.UUID(bytes=raw[i:i + 16])) for i in range(0, len(raw), 16)]
+
+def _allowed_instruments(user):
+    if user["is_admin"]:
+        # Admins have access to all instruments
+        return Instrument.objects.values_list("id", flat=True)
+    # Regular users only have access to instruments they've been granted
+    return AccessGrant.objects.filter(
+        user_id=1,  # Demo: would use real user ID in production
+        status="active"
+    ).values_list("instrument_id", flat=True)
+
+def _remember_user(session, user):
+    """
+    Store the user in the session, only touching keys whose value changed: an
+    unmodified session is not written back (no cache/DB write per request).
+    Returns the user payload with `allowed` expanded.
+    """
+    profile = {k: v for k, v in user.items() if k != "allowed"}
+    packed = _pack_ids(user["allowed"])
+    if session.get("user") != profile:
+        session["user"] = profile
+    if session.get("allowed") != packed:
+        session["allowed"] = packed
+    return {**profile, "allowed": _unpack_ids(packed)}
+
 @csrf_exempt
 @api_view(["POST"])
 @permission_classes([AllowAny])
@@ -98,25 +177,11 @@ def auth_login(request):
         return Response({"error": "User not found"}, status=400)
 
     user_data = DEMO_USERS[email].copy()
-
     # Get allowed instruments based on user role
-    if user_data["is_admin"]:
-        # Admins have access to all instruments
-        allowed = list(Instrument.objects.values_list("id", flat=True))
-    else:
-        # Regular users only have access to instruments they've been granted
-        grants = AccessGrant.objects.filter(
-            user_id=1,  # Demo: would use real user ID in production
-            status="active"
-        ).values_list("instrument_id", flat=True)
-        allowed = list(grants)
-
-    user_data["allowed"] = [str(x) for x in allowed]
+    user_data["allowed"] = list(_allowed_instruments(user_data))
 
-    # Store in session
-    request.session["user"] = user_data
-
-    return Response(user_data)
+    # Store in session (written only if it differs from what is there)
+    return Response(_remember_user(request.session, user_data))
 
 @api_view(["POST"])
 @permission_classes([AllowAny])
@@ -143,20 +208,9 @@ def auth_me(request):
             "isGuest": True
         })
 
-    # Refresh allowed instruments in case access was granted/revoked
-    if user["is_admin"]:
-        allowed = list(Instrument.objects.values_list("id", flat=True))
-    else:
-        grants = AccessGrant.objects.filter(
-            user_id=1,
-            status="active"
-        ).values_list("instrument_id", flat=True)
-        allowed = list(grants)
-
-    user["allowed"] = [str(x) for x in allowed]
-    request.session["user"] = user  # Update session
-
-    return Response(user)
+    # Refresh allowed instruments in case access was granted/revoked; the session
+    # is only saved when the set actually changed
+    return Response(_remember_user(request.session, {**user, "allowed": list(_allowed_instruments(user))}))
 
 # --- Access control ---
 @api_view(["POST"])
@@ -220,10 +274,11 @@ def users_invite(request):
     return Response({"status":"invited","email":request.data.get("email")}, status=201)
 
 # --- OpenAI simple completion (non-stream) with RAG ---
-def _openai_complete(prompt: str, instrument_id: str = None) -> tuple:
+def _openai_complete(prompt: str, instrument_id: str = None, priority: int = STANDARD) -> tuple:
     """
     Minimal HTTP call to OpenAI Chat Completions with RAG support.
     Reads OPENAI_API_KEY (required), OPENAI_BASE_URL and OPENAI_MODEL (optional) from env/settings.
+    The call goes through the LLM limiter; raises LLMBusy when it cannot be admitted.
 
     Returns:
         Tuple of (answer_text, citations_list)
@@ -276,8 +331,19 @@ def _openai_complete(prompt: str, instrument_id: str = None) -> tuple:
         },
         method="POST",
     )
-    with urllib.request.urlopen(req, timeout=30) as resp:
-        data = json.loads(resp.read().decode("utf-8"))
+    limiter = llm_limiter()
+    est_output = getattr(dj_settings, "LLM_EST_OUTPUT_TOKENS", 600)
+    with limiter.slot(priority, estimate_tokens(prompt) + est_output) as lease:
+        try:
+            with urllib.request.urlopen(req, timeout=30) as resp:
+                data = json.loads(resp.read().decode("utf-8"))
+        except urllib.error.HTTPError as e:
+            if e.code == 429:
+                retry_after = parse_retry_after(e.headers.get("Retry-After"))
+                limiter.penalize(retry_after)
+                raise LLMBusy(retry_after, "LLM provider rate limit")
+            raise
+        lease.used_tokens = (data.get("usage") or {}).get("total_tokens")
 
     if "choices" not in data or not data["choices"]:
         raise RuntimeError(f"Bad OpenAI response: {data}")
@@ -289,6 +355,70 @@ def _openai_complete(prompt: str, instrument_id: str = None) -> tuple:
 
     return answer_text, citations
 
+def _cited_fragment(source, fragment_id):
+    """
+    The retrieved fragment a citation points at (e.g. the matching transcript window), if it
+    still belongs to the source; else None, and the Proof Viewer opens the document itself
+    rather than an arbitrary fragment of it.
+    """
+    if not fragment_id or source.type not in ("pdf", "video", "image"):
+        return None
+    idx = get_fragment_index(source.id, source.type)
+    try:
+        row = idx.find(fragment_id) if idx else None
+    except ValueError:
+        return None
+    return idx.fragment_id(row) if row is not None else None
+
+def _persist_answer(sess, ans_text, citations_data):
+    """
+    Save the assistant turn and its citations, and roll them into chat analytics.
+    Returns (assistant_turn, citations payload for the client).
+    """
+    ans_turn = ChatTurn.objects.create(session=sess, role="assistant", text=ans_text)
+    record_turn(ans_turn, sess.instrument_id)
+
+    # Create real citations from RAG results
+    cites = []
+    for cite_data in citations_data:
+        source = Source.objects.filter(id=cite_data['source_id']).first()
+        if source:
+            frag_id = _cited_fragment(source, cite_data.get('fragment_id'))
+            Citation.objects.create(turn=ans_turn, source=source, fragment_id=frag_id)
+            cites.append({
+                "source_id": str(source.id),
+                "source_title": cite_data.get('source_title', source.title),
+                "source_type": cite_data.get('source_type', source.type),
+                "fragment_id": frag_id,
+                "score": cite_data.get('score', 0.9)
+            })
+    record_citations(ans_turn, sess.instrument_id, [c["source_id"] for c in cites])
+    return ans_turn, cites
+
+def _busy_response(e: LLMBusy):
+    """429 with Retry-After, instead of saving an '[LLM error: ...]' answer."""
+    return Response({"detail": str(e), "retry_after": e.retry_after}, status=429,
+                    headers={"Retry-After": str(e.retry_after)})
+
+def _complete_chunks(prompt, instrument_id):
+    ans_text, citations = _openai_complete(prompt, instrument_id=instrument_id)
+    yield ans_text or ""
+    yield {"citations": citations}
+
+def _shared_complete(question, instrument_id):
+    """
+    _openai_complete, deduplicated against identical in-flight asks.
+    Returns (answer_text, citations_list).
+    """
+    parts, citations = [], []
+    key = flight_key(instrument_id, question, "complete")
+    for chunk in shared_generation(key, lambda: _complete_chunks(question, instrument_id)):
+        if isinstance(chunk, dict):
+            citations = chunk.get("citations", [])
+        else:
+            parts.append(chunk)
+    return "".join(parts), citations
+
 # --- Chat (non-stream) ---
 @api_view(["POST"])
 @permission_classes([AllowAny])
@@ -297,6 +427,10 @@ def chat_ask(request):
     question = (request.data.get("question") or "").strip()
     if not instrument_id:
         return Response({"detail": "instrument_id is required"}, status=400)
+    try:
+        llm_limiter().admit(STANDARD)
+    except LLMBusy as e:
+        return _busy_response(e)
 
     sess = ChatSession.objects.create(instrument_id=instrument_id)
     user_turn = ChatTurn.objects.create(session=sess, role="user", text=question)
@@ -304,50 +438,41 @@ def chat_ask(request):
     ans_text = None
     citations_data = []
     try:
-        ans_text, citations_data = _openai_complete(question or "Say hello.", instrument_id=instrument_id)
+        ans_text, citations_data = _shared_complete(question or "Say hello.", instrument_id)
+    except LLMBusy as e:
+        sess.delete()
+        return _busy_response(e)
     except Exception as e:
         ans_text = f"[LLM error: {e}]"
 
     if not ans_text:
         ans_text = "This is a placeholder answer. Set OPENAI_API_KEY to enable real LLM responses."
 
-    ans_turn = ChatTurn.objects.create(session=sess, role="assistant", text=ans_text)
-
-    # Create real citations from RAG results
-    cites = []
-    for cite_data in citations_data:
-        source = Source.objects.filter(id=cite_data['source_id']).first()
-        if source:
-            # Create a fragment ID (for now, just use UUID; later can point to actual fragments)
-            frag_id = uuid.uuid4()
-            Citation.objects.create(turn=ans_turn, source=source, fragment_id=frag_id)
-            cites.append({
-                "source_id": str(source.id),
-                "source_title": cite_data.get('source_title', source.title),
-                "source_type": cite_data.get('source_type', source.type),
-                "fragment_id": str(frag_id),
-                "score": cite_data.get('score', 0.9)
-            })
+    record_turn(user_turn, instrument_id)
+    ans_turn, cites = _persist_answer(sess, ans_text, citations_data)
 
     return Response({"turn_id": str(ans_turn.id), "answer": ans_turn.text, "citations": cites})
 
 # --- OpenAI streaming helper with RAG ---
-def _stream_tokens_openai(question, instrument_id=None):
+def _stream_tokens_openai(question, instrument_id=None, priority=INTERACTIVE):
     """
     Stream tokens from OpenAI with RAG support.
+    Holds an LLM limiter slot for the whole stream; raises LLMBusy when it cannot be admitted.
 
     Args:
         question: User's question
         instrument_id: UUID of instrument for RAG context
+        priority: Limiter priority class (interactive by default)
 
     Yields:
-        Token strings OR dict with 'citations' key at the end
+        Token strings, a {'citation': {...}} dict right after the chunk that completes
+        each new [Source N] marker, and a dict with all 'citations' at the end
     """
     from django.conf import settings
-    from .rag_utils import search_sources, build_context_prompt, parse_citations_from_response
+    from .rag_utils import search_sources, build_context_prompt, CitationParser
     import os
     try:
-        from openai import OpenAI
+        from openai import OpenAI, RateLimitError
         import httpx
 
         api_key = os.environ.get("OPENAI_API_KEY") or getattr(settings, "OPENAI_API_KEY", None)
@@ -389,101 +514,136 @@ def _stream_tokens_openai(question, instrument_id=None):
             http_client=http_client
         )
 
-        stream = client.chat.completions.create(
-            model=model,
-            messages=[{"role":"user","content":question}],
-            stream=True
-        )
-
-        full_text = ""
-        for chunk in stream:
-            delta = chunk.choices[0].delta.content or ""
-            if delta:
-                full_text += delta
-                yield delta
-
-        http_client.close()
-
-        # Parse citations after streaming complete
-        _, citations = parse_citations_from_response(full_text, sources)
-        yield {"citations": citations}
-
+        limiter = llm_limiter()
+        est_output = getattr(settings, "LLM_EST_OUTPUT_TOKENS", 600)
+        parts = []
+        cited = CitationParser(sources)
+        with limiter.slot(priority, estimate_tokens(question) + est_output) as lease:
+            try:
+                stream = client.chat.completions.create(
+                    model=model,
+                    messages=[{"role":"user","content":question}],
+                    stream=True
+                )
+
+                for chunk in stream:
+                    delta = chunk.choices[0].delta.content or ""
+                    if delta:
+                        parts.append(delta)
+                        yield delta
+                        for cite in cited.feed(delta):
+                            yield {"citation": cite}
+            except RateLimitError as e:
+                retry_after = parse_retry_after(e.response.headers.get("retry-after"))
+                limiter.penalize(retry_after)
+                raise LLMBusy(retry_after, "LLM provider rate limit")
+            finally:
+                http_client.close()
+            lease.used_tokens = estimate_tokens(question) + estimate_tokens("".join(parts))
+
+        # Everything cited along the way; no second pass over the answer
+        yield {"citations": cited.citations}
+
+    except LLMBusy:
+        raise
     except Exception as e:
         yield f"[OpenAI error: {e}]"
 
 # --- Chat (SSE stream) WITHOUT DRF negotiation ---
 from django.views.decorators.http import require_GET
 from django.views.decorators.csrf import csrf_exempt
+from .streams import start_stream, stream_response, parse_last_event_id, coalesce_tokens, token_data, is_asgi
+
+def _mock_tokens():
+    # mock tokens if no key
+    for tok in ["Working ", "through ", "your ", "question...", " Done."]:
+        time.sleep(0.15)
+        yield tok
+
+def _chat_stream_events(user_turn, question, instrument_id):
+    """
+    Produce the (event, data_json) pairs for one streamed answer.
+    Runs in a background thread (see core.streams.start_stream), so the assistant
+    turn is persisted even if the client disconnects mid-answer.
+    """
+    # tell client which turn this is
+    yield "start", dumps_str({'turn_id': user_turn.id})
+
+    text_parts = []
+    citations_data = []
+
+    from django.conf import settings
+    if getattr(settings, "OPENAI_API_KEY", None):
+        # Coalesce tiny deltas so each buffered/sent event carries a useful amount of text
+        mode, upstream = "stream", lambda: coalesce_tokens(_stream_tokens_openai(question, instrument_id=instrument_id))
+    else:
+        mode, upstream = "mock", _mock_tokens
+
+    # Identical concurrent streamed questions share one upstream generation
+    try:
+        for tok in shared_generation(flight_key(instrument_id, question, mode), upstream):
+            # A citation as soon as its marker is complete (lets the UI prefetch viewer meta),
+            # or the full citations list at the end
+            if isinstance(tok, dict):
+                if "citation" in tok:
+                    cite = tok["citation"]
+                    yield "citation", dumps_str({k: cite.get(k) for k in ("source_id", "source_title", "source_type", "fragment_id", "citation_text")})
+                else:
+                    citations_data = tok.get('citations', [])
+                continue
+
+            # Regular token
+            text_parts.append(tok)
+            yield "token", token_data(tok)
+    except LLMBusy as e:
+        # Tell the client when to retry instead of saving an error as the answer
+        yield "error", dumps_str({"detail": str(e), "retry_after": e.retry_after})
+        return
+    except RuntimeError as e:
+        # e.g. a stalled shared generation: end the answer the way a failed solo stream does
+        tok = f"[OpenAI error: {e}]"
+        text_parts.append(tok)
+        yield "token", token_data(tok)
+
+    # finalize and create assistant turn
+    ans_turn, cites = _persist_answer(user_turn.session, "".join(text_parts), citations_data)
+
+    yield "done", dumps_str({'turn_id': ans_turn.id, 'citations': cites})
 
 @csrf_exempt
 @require_GET
 def chat_stream(request):
+    # Reconnect: EventSource resends the same URL with Last-Event-ID; replay the
+    # buffered stream from that point instead of paying for a new generation.
+    last_event_id = request.headers.get("Last-Event-ID") or request.GET.get("last_event_id")
+    if last_event_id:
+        resume = parse_last_event_id(last_event_id)
+        if not resume:
+            return HttpResponse(status=204)
+        return stream_response(*resume, asynchronous=is_asgi(request))
+
     question = request.GET.get("q", "")
     instrument_id = request.GET.get("instrument_id")
 
+    # Backpressure before any work: 429 + Retry-After when the LLM queue is saturated
+    try:
+        llm_limiter().admit(INTERACTIVE)
+    except LLMBusy as e:
+        resp = JsonResponse({"detail": str(e), "retry_after": e.retry_after}, status=429)
+        resp["Retry-After"] = str(e.retry_after)
+        return resp
+
     # create session + user turn
     sess = ChatSession.objects.create(instrument_id=instrument_id)
     user_turn = ChatTurn.objects.create(session=sess, role="user", text=question)
+    record_turn(user_turn, instrument_id)
 
-    def gen():
-        # tell client which turn this is
-        yield "event: start\n"
-        yield f"data: {json.dumps({'turn_id': str(user_turn.id)})}\n\n"
-
-        text_accum = ""
-        citations_data = []
-
-        from django.conf import settings
-        if getattr(settings, "OPENAI_API_KEY", None):
-            for tok in _stream_tokens_openai(question, instrument_id=instrument_id):
-                if not tok:
-                    continue
-
-                # Check if this is a citations dict (sent at the end)
-                if isinstance(tok, dict) and 'citations' in tok:
-                    citations_data = tok['citations']
-                    continue
-
-                # Regular token
-                text_accum += tok
-                yield "event: token\n"
-                yield f"data: {json.dumps({'t': tok})}\n\n"
-        else:
-            # mock tokens if no key
-            for tok in ["Working ", "through ", "your ", "question...", " Done."]:
-                time.sleep(0.15)
-                text_accum += tok
-                yield "event: token\n"
-                yield f"data: {json.dumps({'t': tok})}\n\n"
-
-        # finalize and create assistant turn
-        ans_turn = ChatTurn.objects.create(session=user_turn.session, role="assistant", text=text_accum)
-
-        # Create real citations from RAG results
-        cites = []
-        for cite_data in citations_data:
-            source = Source.objects.filter(id=cite_data['source_id']).first()
-            if source:
-                frag_id = uuid.uuid4()
-                Citation.objects.create(turn=ans_turn, source=source, fragment_id=frag_id)
-                cites.append({
-                    "source_id": str(source.id),
-                    "source_title": cite_data.get('source_title', source.title),
-                    "source_type": cite_data.get('source_type', source.type),
-                    "fragment_id": str(frag_id),
-                    "score": cite_data.get('score', 0.9)
-                })
-
-        yield "event: done\n"
-        yield f"data: {json.dumps({'turn_id': str(ans_turn.id), 'citations': cites})}\n\n"
-
-    resp = StreamingHttpResponse(gen(), content_type="text/event-stream")
-    # help the browser/proxies treat it as a live stream
-    resp["Cache-Control"] = "no-cache"
-    resp["X-Accel-Buffering"] = "no"
+    stream_id = str(user_turn.id)
+    start_stream(stream_id, _chat_stream_events(user_turn, question, instrument_id))
     # CORS is handled by corsheaders middleware (settings.py)
     # Do NOT set Access-Control-Allow-Origin here as it conflicts with credentials mode
-    return resp
+    return stream_response(stream_id, asynchronous=is_asgi(request))
+
 @api_view(["POST"])
 @permission_classes([AllowAny])
 def chat_attach(request):
@@ -498,6 +658,10 @@ def chat_attach(request):
 
     if not instrument_id:
         return Response({"detail": "instrument_id is required"}, status=400)
+    try:
+        llm_limiter().admit(STANDARD)
+    except LLMBusy as e:
+        return _busy_response(e)
 
     try:
         sess = ChatSession.objects.create(instrument_id=instrument_id)
@@ -535,6 +699,9 @@ def chat_attach(request):
         citations_data = []
         try:
             ans_text, citations_data = _openai_complete(enhanced_question, instrument_id=instrument_id)
+        except LLMBusy as e:
+            sess.delete()
+            return _busy_response(e)
         except Exception as e:
             print(f"OpenAI error: {e}")
             ans_text = f"[LLM error: {e}]"
@@ -542,22 +709,8 @@ def chat_attach(request):
         if not ans_text:
             ans_text = "This is a placeholder answer. Set OPENAI_API_KEY to enable real LLM responses."
 
-        ans_turn = ChatTurn.objects.create(session=sess, role="assistant", text=ans_text)
-
-        # Create citations
-        cites = []
-        for cite_data in citations_data:
-            source = Source.objects.filter(id=cite_data['source_id']).first()
-            if source:
-                frag_id = uuid.uuid4()
-                Citation.objects.create(turn=ans_turn, source=source, fragment_id=frag_id)
-                cites.append({
-                    "source_id": str(source.id),
-                    "source_title": cite_data.get('source_title', source.title),
-                    "source_type": cite_data.get('source_type', source.type),
-                    "fragment_id": str(frag_id),
-                    "score": cite_data.get('score', 0.9)
-                })
+        record_turn(user_turn, instrument_id)
+        ans_turn, cites = _persist_answer(sess, ans_text, citations_data)
 
         return Response({"turn_id": str(ans_turn.id), "answer": ans_turn.text, "citations": cites})
 
@@ -578,28 +731,44 @@ def chat_regen(request, turn_id):
 @api_view(["POST"])
 @permission_classes([AllowAny])
 def chat_turn_feedback(request, turn_id):
-    t = get_object_or_404(ChatTurn, id=turn_id)
-    t.rating = request.data.get("rating"); t.feedback_tag = request.data.get("tag"); t.save()
+    t = get_object_or_404(ChatTurn.objects.select_related("session"), id=turn_id)
+    old_rating, old_tag = t.rating, t.feedback_tag
+    t.rating = request.data.get("rating"); t.feedback_tag = request.data.get("tag")
+    t.save(update_fields=["rating", "feedback_tag"])
+    record_feedback(t, t.session.instrument_id, old_rating, old_tag, t.rating, t.feedback_tag)
     return Response({"status":"ok"})
 
+@api_view(["GET"])
+@permission_classes([AllowAny])
+def chat_analytics(request, instrument_id):
+    """Daily turn/rating/tag/citation rollups for dashboards (served from summary tables)."""
+    try:
+        days = min(max(int(request.GET.get("days", 30)), 1), 366)
+    except ValueError:
+        return Response({"detail": "days must be an integer"}, status=400)
+    return Response(instrument_summary(instrument_id, days))
+
 @api_view(["GET"])
 @permission_classes([AllowAny])
 def citations_for_turn(request, turn_id):
     cites = Citation.objects.filter(turn_id=turn_id)
-    out = [{"source_id":str(c.source_id), "fragment_id":str(c.fragment_id), "score":0.8} for c in cites]
+    out = [{"source_id":str(c.source_id), "fragment_id":str(c.fragment_id) if c.fragment_id else None, "score":0.8} for c in cites]
     return Response({"items": out})
 
 # --- Support & Feedback ---
+FAQ_ITEMS = [
+    {"id":"upload","q":"How do I upload documents?","a":"Go to Knowledge Store → Upload. Supported: PDF, video, images, notes."},
+    {"id":"access","q":"How do I request access?","a":"Open the instrument and click Request Access; you’ll get an email when approved."},
+    {"id":"citations","q":"How do I verify an answer?","a":"Click a citation chip to open the Proof Viewer at the exact fragment."},
+    {"id":"contact","q":"How do I contact support?","a":"Open the help widget, or email support@rayni.ai."},
+]
+# static content: its ETag changes when the text does
+_FAQ_HASH = hashlib.sha1(json.dumps(FAQ_ITEMS).encode()).hexdigest()
+
 @api_view(["GET"])
 @permission_classes([AllowAny])
 def faq(request):
-    data = [
-        {"id":"upload","q":"How do I upload documents?","a":"Go to Knowledge Store → Upload. Supported: PDF, video, images, notes."},
-        {"id":"access","q":"How do I request access?","a":"Open the instrument and click Request Access; you’ll get an email when approved."},
-        {"id":"citations","q":"How do I verify an answer?","a":"Click a citation chip to open the Proof Viewer at the exact fragment."},
-        {"id":"contact","q":"How do I contact support?","a":"Open the help widget, or email support@rayni.ai."},
-    ]
-    return Response({"items": data})
+    return cached_response(request, "faq", [], lambda: {"items": FAQ_ITEMS}, extra=_FAQ_HASH)
 
 @api_view(["GET"])
 @permission_classes([AllowAny])
@@ -630,30 +799,85 @@ def feedback_respond(request, fb_id):
     return Response(FeedbackSerializer(fb).data)
 
 # --- Uploads ---
+def _upload_or_404(upload_id):
+    return Upload.objects.filter(id=upload_id).first()
+
+def _absolute_parts(request, parts):
+    return [{**p, "url": request.build_absolute_uri(p["url"])} for p in parts]
+
 @api_view(["POST"])
 @permission_classes([AllowAny])
 def uploads_initiate(request):
-    upload_id = uuid.uuid4()
-    return Response({"upload_id": str(upload_id), "signed_url": f"http://localhost:9000/bucket/{upload_id}", "headers": {"x-amz-acl":"private"}}, status=201)
+    """
+    Start a multipart upload. Body: filename, size (bytes), content_type.
+    Returns presigned part URLs; PUT each part (in parallel), keep the ETag response
+    header, then PATCH .../complete. `signed_url` is part 1, for single-part clients.
+    """
+    size = request.data.get("size")
+    try:
+        size = int(size) if size not in (None, "") else None
+    except (TypeError, ValueError):
+        return Response({"detail": "invalid size"}, status=400)
+    try:
+        upload = start_upload(request.data.get("filename") or request.data.get("title") or "file", size,
+                              request.data.get("content_type"))
+    except StorageError as e:
+        return Response({"detail": str(e)}, status=502)
+    _, count = plan_parts(size)
+    parts = _absolute_parts(request, part_urls(upload, range(1, (count or 1) + 1)))
+    return Response({
+        "upload_id": str(upload.id), "part_size": upload.part_size, "part_count": count,
+        "parts": parts, "signed_url": parts[0]["url"], "headers": {},
+    }, status=201)
+
+@api_view(["GET", "DELETE"])
+@permission_classes([AllowAny])
+def uploads_status(request, upload_id):
+    """Resume: which parts arrived, plus fresh URLs for the missing ones. DELETE aborts."""
+    upload = _upload_or_404(upload_id)
+    if not upload:
+        return Response({"detail": "upload not found"}, status=404)
+    if request.method == "DELETE":
+        abort_upload(upload)
+        return Response(status=204)
+    try:
+        data = upload_status(upload)
+    except StorageError as e:
+        return Response({"detail": str(e)}, status=410)
+    data["parts"] = _absolute_parts(request, part_urls(upload, data["missing"])) if upload.status == "pending" else []
+    return Response(data)
+
+@csrf_exempt
+def uploads_put_part(request):
+    """Part PUT target for the local storage backend (S3/MinIO clients PUT to the bucket)."""
+    if request.method != "PUT":
+        return JsonResponse({"detail": "method not allowed"}, status=405)
+    from django.conf import settings
+    storage = get_storage()
+    if not isinstance(storage, LocalStorage):
+        return JsonResponse({"detail": "parts go to object storage"}, status=404)
+    try:
+        claims = storage.verify_part_token(request.GET.get("token", ""), settings.UPLOAD_URL_EXPIRY)
+        etag = storage.put_part(claims["m"], claims["n"], request)
+    except StorageError as e:
+        return JsonResponse({"detail": str(e)}, status=403)
+    resp = HttpResponse(status=200)
+    resp["ETag"] = f'"{etag}"'
+    return resp
 
 @api_view(["PATCH"])
 @permission_classes([AllowAny])
 def uploads_complete(request, upload_id):
-    instrument_id = request.data.get("instrument_id")
-    folder_id = request.data.get("folder_id")
-    s = Source.objects.create(
-        instrument_id=instrument_id,
-        folder_id=folder_id,
-        type=request.data.get("type", "pdf"),
-        title=request.data.get("title", "Uploaded File"),
-        category=request.data.get("category"),
-        description=request.data.get("description"),
-        version=request.data.get("version"),
-        model_tags=request.data.get("model_tags", []),
-        storage_uri=f"minio://{upload_id}",
-        status="uploaded"
-    )
-    return Response({"source_id": str(s.id), "status": s.status})
+    upload = _upload_or_404(upload_id)
+    if not upload:
+        return Response({"detail": "upload not found"}, status=404)
+    try:
+        s, deduplicated = complete_upload(upload, request.data)
+    except UploadError as e:
+        return Response({"detail": str(e), **e.extra}, status=409)
+    except StorageError as e:
+        return Response({"detail": str(e)}, status=502)
+    return Response({"source_id": str(s.id), "status": s.status, "checksum": s.checksum, "deduplicated": deduplicated})
 
 # --- Connectors scaffold ---
 @api_view(["GET"])
@@ -670,7 +894,23 @@ def connectors_create(request):
 @api_view(["POST"])
 @permission_classes([AllowAny])
 def connectors_sync(request, conn_id):
-    return Response({"status":"scheduled"}, status=202)
+    """Start an incremental sync (202), or run it inline with ?wait=1 and return its stats."""
+    c = get_object_or_404(Connector, id=conn_id)
+    try:
+        validate_connector(c)
+    except ConnectorError as e:
+        return Response({"detail": str(e)}, status=400)
+    if request.GET.get("wait") == "1":
+        try:
+            stats = try_sync(c)
+        except ConnectorError as e:
+            return Response({"detail": str(e)}, status=502)
+        if stats is None:
+            return Response({"detail": "sync already running"}, status=409)
+        return Response({"status": "done", "stats": stats})
+    if not start_sync(c):
+        return Response({"detail": "sync already running"}, status=409)
+    return Response({"status": "scheduled", "last_sync_stats": c.last_sync_stats}, status=202)
 
 # --- Archive endpoint (admin-only) ---
 @api_view(["PATCH"])
@@ -680,21 +920,196 @@ def archive_source(request, source_id):
     source.archived = True
     source.archived_at = now()
     source.status = "archived"
-    source.save()
+    source.save(update_fields=["archived", "archived_at", "status"])
     return Response(SourceSerializer(source).data)
 
+@api_view(["POST"])
+@permission_classes([AllowAny])
+def sources_bulk(request):
+    """
+    Body: { op: archive|move|retag|recategorize, ids: [...] | filter: {instrument, folder, q, type, status, category},
+            folder_id (move), model_tags + mode set|add|remove (retag), category (recategorize), dry_run }
+    Small selections are updated inline (200); large ones return a job (202) to poll.
+    """
+    try:
+        result = run_bulk(request.data.get("op"), request.data)
+    except BulkError as e:
+        return Response({"detail": str(e)}, status=400)
+    if "job_id" in result:
+        return Response(result, status=202, headers={"Location": f"/api/sources/bulk/{result['job_id']}"})
+    return Response(result)
+
+@api_view(["GET"])
+@permission_classes([AllowAny])
+def sources_bulk_job(request, job_id):
+    job = get_bulk_job(job_id)
+    if job is None:
+        return Response({"detail": "job not found"}, status=404)
+    return Response(job)
+
 # --- Viewer meta endpoints (used by frontend to draw highlights) ---
+def _viewer_lookup(request, source_id, kind):
+    """
+    Resolve ?fragment_id= (or the source's first fragment) against the cached fragment index.
+    Returns (index, row) where row is None if the source has no fragments, or a Response on error.
+    """
+    idx = get_fragment_index(source_id, kind)
+    if idx is None:
+        return Response({"detail": "source not found"}, status=404)
+    fragment_id = request.GET.get("fragment_id")
+    if not fragment_id:
+        return idx, (0 if len(idx) else None)
+    try:
+        row = idx.find(fragment_id)
+    except ValueError:
+        return Response({"detail": "invalid fragment_id"}, status=400)
+    if row is None:
+        return Response({"detail": "fragment not found"}, status=404)
+    return idx, row
+
+def _region(idx, row, offset=0):
+    x, y, w, h = (idx.field(row, offset + i) for i in range(4))
+    if min(x, y, w, h) < 0:
+        return None
+    return {"x": x, "y": y, "w": w, "h": h}
+
 @api_view(["GET"])
 @permission_classes([AllowAny])
 def viewer_pdf_meta(request, source_id):
-    return Response({"type":"pdf","page":1,"bbox":{"x":120,"y":200,"w":260,"h":40},"filename":"manual.pdf","version":"v3.1","checksum":"abc123"})
+    found = _viewer_lookup(request, source_id, "pdf")
+    if isinstance(found, Response):
+        return found
+    idx, row = found
+    src = idx.source
+    return Response({
+        "type": "pdf",
+        "fragment_id": idx.fragment_id(row) if row is not None else None,
+        "page": idx.field(row, 0) if row is not None else 1,
+        "bbox": _region(idx, row, 1) if row is not None else None,
+        "filename": src["title"], "version": src["version"], "checksum": src["checksum"],
+    })
 
 @api_view(["GET"])
 @permission_classes([AllowAny])
 def viewer_video_meta(request, source_id):
-    return Response({"type":"video","t_start":12.4,"t_end":22.0,"transcript":[{"t":10,"text":"Intro"}, {"t":12.4,"text":"Load flow cell (highlight)"},{"t":23,"text":"Next step"}]})
+    found = _viewer_lookup(request, source_id, "video")
+    if isinstance(found, Response):
+        return found
+    idx, row = found
+    t = request.GET.get("t")
+    if t is not None and not request.GET.get("fragment_id"):
+        # ?t=<seconds>: the fragment playing at that point of the video
+        try:
+            row = idx.at_time(float(t))
+        except ValueError:
+            return Response({"detail": "invalid t"}, status=400)
+    if row is None:
+        return Response({"type": "video", "fragment_id": None, "t_start": 0, "t_end": 0, "transcript": []})
+    # transcript window: the cited fragment plus its neighbours
+    window = range(max(0, row - 2), min(len(idx), row + 3))
+    return Response({
+        "type": "video",
+        "fragment_id": idx.fragment_id(row),
+        "t_start": idx.field(row, 0),
+        "t_end": idx.field(row, 1),
+        "transcript": [{"t": idx.field(r, 0), "text": idx.text(r) or ""} for r in window],
+    })
 
 @api_view(["GET"])
 @permission_classes([AllowAny])
 def viewer_image_meta(request, source_id):
-    return Response({"type":"image","region":{"x":40,"y":60,"w":180,"h":120},"alt_text":"Latch mechanism area"})
+    found = _viewer_lookup(request, source_id, "image")
+    if isinstance(found, Response):
+        return found
+    idx, row = found
+    return Response({
+        "type": "image",
+        "fragment_id": idx.fragment_id(row) if row is not None else None,
+        "region": _region(idx, row) if row is not None else None,
+        "alt_text": (idx.text(row) if row is not None else None) or idx.source["title"],
+    })
+
+# --- Viewer file download (HTTP Range, zero-copy for local files) ---
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+def _byte_range(header, size):
+    """(start, length) for a single-range Range header; None to send everything; False if unsatisfiable."""
+    m = _RANGE.match((header or "").strip())
+    if not m or m.group(1) == m.group(2) == "":
+        return None  # absent, malformed or multi-range: serve the whole file
+    if m.group(1) == "":
+        length = min(int(m.group(2)), size)
+        return (size - length, length) if length else False
+    start = int(m.group(1))
+    end = min(int(m.group(2)), size - 1) if m.group(2) else size - 1
+    if start >= size or end < start:
+        return False
+    return start, end - start + 1
+
+def viewer_file(request, source_id):
+    """
+    Stream a source's file, honouring Range / If-Range / If-None-Match.
+    Local and cached objects go out through FileResponse, which the WSGI server can
+    sendfile(); remote objects are proxied as a ranged stream, never read whole.
+    """
+    if request.method not in ("GET", "HEAD"):
+        return JsonResponse({"detail": "method not allowed"}, status=405)
+    src = Source.objects.filter(id=source_id).values("title", "storage_uri", "checksum").first()
+    if not src:
+        return JsonResponse({"detail": "source not found"}, status=404)
+    try:
+        backend, key = resolve(src["storage_uri"])
+        path = local_path(src["storage_uri"])
+        size = os.path.getsize(path) if path else backend.size(key)
+    except (StorageError, OSError):
+        return JsonResponse({"detail": "file not available"}, status=404)
+
+    etag = f'"{src["checksum"]}"' if src["checksum"] else None
+    if etag and request.headers.get("If-None-Match") == etag:
+        resp = HttpResponse(status=304)
+        resp["ETag"] = etag
+        return resp
+    rng = _byte_range(request.headers.get("Range"), size)
+    if_range = request.headers.get("If-Range")
+    if rng is not None and if_range and if_range != etag:
+        rng = None
+    if rng is False:
+        resp = HttpResponse(status=416)
+        resp["Content-Range"] = f"bytes */{size}"
+        return resp
+    start, length = rng or (0, size)
+
+    filename = os.path.basename(key)
+    content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    if request.method == "HEAD":
+        resp = HttpResponse(status=206 if rng else 200, content_type=content_type)
+    else:
+        if not length:
+            body = io.BytesIO(b"")
+        elif path:
+            fh = open(path, "rb")
+            fh.seek(start)
+            body = RangeFile(fh, length)
+        else:
+            body = backend.open_range(key, start, length)
+        resp = FileResponse(body, status=206 if rng else 200, content_type=content_type,
+                            as_attachment=request.GET.get("download") == "1", filename=filename)
+    resp["Content-Length"] = str(length)
+    resp["Accept-Ranges"] = "bytes"
+    if rng:
+        resp["Content-Range"] = f"bytes {start}-{start + length - 1}/{size}"
+    if etag:
+        resp["ETag"] = etag
+    resp["Cache-Control"] = "private, max-age=3600"
+    return resp
+
+# --- Ops ---
+@api_view(["GET"])
+@permission_classes([AllowAny])
+def ops_db_connections(request):
+    """Connect / reuse / pool counters and replica rotation of the worker process that serves this request."""
+    from django.conf import settings
+    from .dbbackend.base import connection_stats
+    from .dbrouter import replica_status
+    return Response({**connection_stats(), "conn_max_age": settings.DATABASES["default"]["CONN_MAX_AGE"],
+                     "pool": bool(settings.DB_POOL), "pgbouncer": settings.DB_PGBOUNCER, **replica_status()})
@@ -1,4 +1,14 @@
 #!/bin/sh
 set -e
-python manage.py migrate --noinput
-exec python manage.py runserver 0.0.0.0:8000
+# SERVER_MODE=dev (default): Django dev server with autoreload.
+# SERVER_MODE=gunicorn: multi-process server configured by gunicorn.conf.py;
+#   SERVER_ROLE=api (WSGI, runs migrations) or SERVER_ROLE=stream (ASGI, /stream/chat).
+if [ "${SERVER_ROLE:-api}" = "api" ]; then
+  python manage.py migrate --noinput
+  # upcoming monthly chat history partitions (a no-op until `partition_chat --convert`)
+  python manage.py partition_chat --no-retention
+fi
+case "${SERVER_MODE:-dev}" in
+  gunicorn) exec gunicorn ;;
+  *) exec python manage.py runserver 0.0.0.0:8000 ;;
+esac
@@ -0,0 +1,60 @@
+"""
+Gunicorn settings for SERVER_MODE=gunicorn (see entrypoint.sh).
+
+SERVER_ROLE=api serves the WSGI app with threaded workers. SERVER_ROLE=stream
+serves the ASGI app with uvicorn workers, for the long-lived /stream/chat
+responses. The app is preloaded in the master, so workers share its imported
+code copy-on-write. On SIGTERM, workers stop accepting connections, finish
+in-flight requests and wait for running generations to end, up to
+SERVER_GRACEFUL_TIMEOUT.
+"""
+import multiprocessing
+import os
+
+
+def _int(name, default):
+    return int(os.environ.get(name) or default)
+
+
+role = os.environ.get("SERVER_ROLE", "api")
+cpus = multiprocessing.cpu_count()
+
+if role == "stream":
+    wsgi_app = "rayni.asgi:application"
+    worker_class = "uvicorn.workers.UvicornWorker"
+    bind = os.environ.get("SERVER_BIND", "0.0.0.0:8001")
+    # one event loop per core; waiting streams cost a socket and a buffer-follow thread, not a worker
+    workers = _int("WEB_CONCURRENCY", cpus)
+    max_requests = 0
+else:
+    wsgi_app = "rayni.wsgi:application"
+    worker_class = "gthread"
+    bind = os.environ.get("SERVER_BIND", "0.0.0.0:8000")
+    # requests mostly wait on Postgres / Redis / the LLM: 2 x cores + 1 processes, a few threads each
+    workers = _int("WEB_CONCURRENCY", min(2 * cpus + 1, 16))
+    threads = _int("SERVER_THREADS", 4)
+    # recycle workers now and then to bound memory growth
+    max_requests = _int("SERVER_MAX_REQUESTS", 5000)
+    max_requests_jitter = max_requests // 10
+
+preload_app = True
+timeout = _int("SERVER_TIMEOUT", 60)
+graceful_timeout = _int("SERVER_GRACEFUL_TIMEOUT", 30)
+keepalive = 5
+worker_tmp_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+accesslog = os.environ.get("SERVER_ACCESS_LOG", "-") or None
+
+
+def post_fork(server, worker):
+    # nothing opened while preloading may be shared across processes
+    from django.db import connections
+    connections.close_all()
+
+
+def worker_exit(server, worker):
+    from core.streams import drain_streams
+    left = drain_streams(max(graceful_timeout - 2, 0))
+    if left:
+        server.log.warning("worker %s exiting with %d generation(s) still running", worker.pid, left)
+    from core.dbbackend.base import connection_stats
+    server.log.info("worker %s database connections: %s", worker.pid, connection_stats())
@@ -36,6 +36,41 @@ WSGI_APPLICATION="rayni.wsgi.application"
 DATABASES={
  "default": env.db_url("DATABASE_URL", default="postgres://rayni:rayni@db:5432/rayni")
 }
+# Postgres connections (core.dbbackend instruments connects and reuse).
+# Persistent: keep a connection DB_CONN_MAX_AGE seconds across requests, checking it is alive on reuse.
+# DB_POOL=1: in-process pool instead (connections go back to the pool after each request).
+# DB_PGBOUNCER=1: behind PgBouncer in transaction mode, which is the pool: no server-side cursors, no in-process pool.
+DB_CONN_MAX_AGE=env.int("DB_CONN_MAX_AGE", default=60)
+DB_CONN_HEALTH_CHECKS=env.bool("DB_CONN_HEALTH_CHECKS", default=True)
+DB_PGBOUNCER=env.bool("DB_PGBOUNCER", default=False)
+DB_POOL=env.bool("DB_POOL", default=False) and not DB_PGBOUNCER
+DB_POOL_MAX_SIZE=env.int("DB_POOL_MAX_SIZE", default=20)
+DB_POOL_TIMEOUT=env.float("DB_POOL_TIMEOUT", default=10)
+DATABASES["default"].update(
+    ENGINE="core.dbbackend",
+    CONN_MAX_AGE=0 if DB_POOL else DB_CONN_MAX_AGE,
+    CONN_HEALTH_CHECKS=DB_CONN_HEALTH_CHECKS,
+    DISABLE_SERVER_SIDE_CURSORS=DB_PGBOUNCER,
+)
+if DB_POOL:
+    DATABASES["default"].setdefault("OPTIONS", {})["pool"]={"max_size": DB_POOL_MAX_SIZE, "timeout": DB_POOL_TIMEOUT}
+# Read replicas (core/dbrouter.py): DATABASE_REPLICA_URLS=url1,url2 adds aliases replica1, replica2, ... that serve
+# reads while their replay lag is under DB_REPLICA_MAX_LAG seconds (checked every DB_REPLICA_CHECK_SECONDS).
+# After a write, the request and that client's requests for DB_REPLICA_PIN_SECONDS read from the primary.
+DATABASE_REPLICA_URLS=env.list("DATABASE_REPLICA_URLS", default=[])
+DB_REPLICA_MAX_LAG=env.float("DB_REPLICA_MAX_LAG", default=5)
+DB_REPLICA_CHECK_SECONDS=env.float("DB_REPLICA_CHECK_SECONDS", default=5)
+DB_REPLICA_PIN_SECONDS=env.int("DB_REPLICA_PIN_SECONDS", default=10)
+for i, url in enumerate(DATABASE_REPLICA_URLS, 1):
+    DATABASES[f"replica{i}"]={
+        **env.db_url_config(url),
+        **{k: v for k, v in DATABASES["default"].items() if k in ("ENGINE", "CONN_MAX_AGE", "CONN_HEALTH_CHECKS", "DISABLE_SERVER_SIDE_CURSORS")},
+        "OPTIONS": dict(DATABASES["default"].get("OPTIONS", {})),
+        "TEST": {"MIRROR": "default"},
+    }
+if DATABASE_REPLICA_URLS:
+    DATABASE_ROUTERS=["core.dbrouter.PrimaryReplicaRouter"]
+    MIDDLEWARE.insert(MIDDLEWARE.index("django.contrib.sessions.middleware.SessionMiddleware"), "core.dbrouter.ReplicaPinMiddleware")
 
 LANGUAGE_CODE="en-us"; TIME_ZONE="UTC"; USE_I18N=True; USE_TZ=True
 STATIC_URL="/static/"
@@ -47,11 +82,15 @@ CORS_ALLOWED_ORIGINS=[
     "http://localhost:3000",
 ]
 CORS_ALLOW_CREDENTIALS=True
+CORS_EXPOSE_HEADERS=["ETag"] # multipart upload clients read each part's ETag
 
 REST_FRAMEWORK={
  "DEFAULT_SCHEMA_CLASS":"drf_spectacular.openapi.AutoSchema",
  "DEFAULT_PERMISSION_CLASSES":["rest_framework.permissions.AllowAny"],
- "DEFAULT_FILTER_BACKENDS":["django_filters.rest_framework.DjangoFilterBackend"]
+ "DEFAULT_FILTER_BACKENDS":["django_filters.rest_framework.DjangoFilterBackend"],
+ # orjson when installed (stdlib json otherwise); UUIDs/datetimes are encoded natively
+ "DEFAULT_RENDERER_CLASSES":["core.fastjson.FastJSONRenderer","rest_framework.renderers.BrowsableAPIRenderer"],
+ "DEFAULT_PARSER_CLASSES":["core.fastjson.FastJSONParser","rest_framework.parsers.FormParser","rest_framework.parsers.MultiPartParser"],
 }
 SPECTACULAR_SETTINGS={"TITLE":"Rayni API","VERSION":"1.0.0"}
 
@@ -59,3 +98,82 @@ OPENAI_API_KEY=env("OPENAI_API_KEY", default=None)
 
 CELERY_BROKER_URL=env("CELERY_BROKER_URL", default="redis://redis:6379/0")
 CELERY_RESULT_BACKEND=CELERY_BROKER_URL
+
+# Redis for cross-process state (SSE stream buffers). Unset -> in-process fallback.
+REDIS_URL=env("REDIS_URL", default=None)
+
+# Resumable SSE: buffered events expire SSE_STREAM_TTL seconds after the last write
+SSE_STREAM_TTL=env.int("SSE_STREAM_TTL", default=600)
+SSE_HEARTBEAT_SECONDS=env.float("SSE_HEARTBEAT_SECONDS", default=15)
+SSE_RETRY_MS=env.int("SSE_RETRY_MS", default=3000)
+# Token coalescing: flush a token event every SSE_COALESCE_BYTES chars or SSE_COALESCE_MS ms (0 disables)
+SSE_COALESCE_BYTES=env.int("SSE_COALESCE_BYTES", default=64)
+SSE_COALESCE_MS=env.float("SSE_COALESCE_MS", default=20)
+# ASGI serving (SERVER_ROLE=stream): threads that wait on stream buffers for open SSE responses
+SSE_ASGI_THREADS=env.int("SSE_ASGI_THREADS", default=256)
+
+# Shared cache (version counters, single-flight registry). Falls back to per-process locmem.
+if REDIS_URL:
+    CACHES={"default":{"BACKEND":"django.core.cache.backends.redis.RedisCache","LOCATION":REDIS_URL}}
+
+# Sessions live in that cache. SESSION_STORE=cached_db (default) also writes them through to the DB,
+# so they survive cache eviction/restarts; "cache" is cache-only; "db" is Django's DB-only engine.
+# Views only modify the session when its content changes, so reads never write.
+SESSION_STORE=env("SESSION_STORE", default="cached_db")
+SESSION_ENGINE=f"django.contrib.sessions.backends.{SESSION_STORE}"
+
+# Shared response cache for catalog lists (instruments, folders, sources, faq); entries are keyed
+# on version counters, so the TTL only bounds how long superseded entries linger
+RESPONSE_CACHE_TTL=env.int("RESPONSE_CACHE_TTL", default=3600)
+
+# Single-flight: identical in-flight questions share one LLM generation
+SINGLEFLIGHT_ENABLED=env.bool("SINGLEFLIGHT_ENABLED", default=True)
+SINGLEFLIGHT_WAIT_SECONDS=env.float("SINGLEFLIGHT_WAIT_SECONDS", default=90)
+
+# LLM admission control (per process): RPM/TPM token buckets, concurrency cap, bounded priority queue
+LLM_RPM=env.int("LLM_RPM", default=500)
+LLM_TPM=env.int("LLM_TPM", default=200000)
+LLM_MAX_CONCURRENCY=env.int("LLM_MAX_CONCURRENCY", default=16)
+LLM_MAX_QUEUE=env.int("LLM_MAX_QUEUE", default=64)
+LLM_MAX_WAIT_SECONDS=env.float("LLM_MAX_WAIT_SECONDS", default=20)
+LLM_EST_OUTPUT_TOKENS=env.int("LLM_EST_OUTPUT_TOKENS", default=600)
+
+# PDF fragment layout for new ingestions: "rows" (one PDFFragment per fragment) or "packed" (one row per page)
+FRAGMENT_STORAGE=env("FRAGMENT_STORAGE", default="rows")
+
+# Video transcript ingestion: cues are grouped into VideoFragments of about this many seconds
+TRANSCRIPT_WINDOW_SECONDS=env.int("TRANSCRIPT_WINDOW_SECONDS", default=30)
+
+# Object storage for uploads: "local" (files under STORAGE_LOCAL_ROOT), "minio" or "s3" (boto3)
+STORAGE_BACKEND=env("STORAGE_BACKEND", default="local")
+STORAGE_LOCAL_ROOT=env("STORAGE_LOCAL_ROOT", default=str(BASE_DIR/"storage"))
+S3_BUCKET=env("S3_BUCKET", default="rayni")
+S3_ENDPOINT_URL=env("S3_ENDPOINT_URL", default=None)
+# Endpoint baked into presigned URLs, when clients reach storage under another host than the API does
+S3_PUBLIC_ENDPOINT_URL=env("S3_PUBLIC_ENDPOINT_URL", default=None)
+S3_REGION=env("S3_REGION", default="us-east-1")
+AWS_ACCESS_KEY_ID=env("AWS_ACCESS_KEY_ID", default=None)
+AWS_SECRET_ACCESS_KEY=env("AWS_SECRET_ACCESS_KEY", default=None)
+# Multipart uploads: part size (S3 minimum is 5 MiB) and presigned URL lifetime
+UPLOAD_PART_SIZE=env.int("UPLOAD_PART_SIZE", default=16 * 1024 * 1024)
+UPLOAD_URL_EXPIRY=env.int("UPLOAD_URL_EXPIRY", default=3600)
+# Bounded local disk cache of remote objects read by workers (ingestion, downloads)
+STORAGE_CACHE_DIR=env("STORAGE_CACHE_DIR", default=str(BASE_DIR/"storage-cache"))
+STORAGE_CACHE_MAX_BYTES=env.int("STORAGE_CACHE_MAX_BYTES", default=10 * 1024 ** 3)
+
+# Connector sync: parallel file fetches per sync, and how long a sync may hold its lock
+CONNECTOR_MAX_WORKERS=env.int("CONNECTOR_MAX_WORKERS", default=8)
+CONNECTOR_SYNC_TIMEOUT=env.int("CONNECTOR_SYNC_TIMEOUT", default=3600)
+# Directory that local_directory connectors must point inside; unset disables them
+CONNECTOR_LOCAL_ROOT=env("CONNECTOR_LOCAL_ROOT", default="")
+
+# Chat history partitions (manage.py partition_chat): monthly, created CHAT_PARTITION_MONTHS_AHEAD ahead.
+# Months older than CHAT_RETENTION_MONTHS (0 keeps everything) are exported to object storage as
+# CHAT_ARCHIVE_FORMAT ("parquet" or "arrow", needs pyarrow) and dropped
+CHAT_PARTITION_MONTHS_AHEAD=env.int("CHAT_PARTITION_MONTHS_AHEAD", default=3)
+CHAT_RETENTION_MONTHS=env.int("CHAT_RETENTION_MONTHS", default=0)
+CHAT_ARCHIVE_FORMAT=env("CHAT_ARCHIVE_FORMAT", default="parquet")
+
+# Bulk source operations: selections above the limit run as a chunked background job
+BULK_SYNC_LIMIT=env.int("BULK_SYNC_LIMIT", default=5000)
+BULK_CHUNK_SIZE=env.int("BULK_CHUNK_SIZE", default=1000)
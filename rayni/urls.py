@@ -4,14 +4,15 @@ from rest_framework.routers import DefaultRouter
 from core.views import (
     InstrumentViewSet, FolderViewSet, SourceViewSet, SourceVersionViewSet,
     request_access, auth_me, auth_login, auth_logout,
-    chat_ask, chat_attach, chat_stream, chat_regen, chat_turn_feedback,
+    chat_ask, chat_attach, chat_stream, chat_regen, chat_turn_feedback, chat_analytics,
     citations_for_turn,
     faq, feedback_list, feedback_submit, feedback_respond,
-    uploads_initiate, uploads_complete,
+    uploads_initiate, uploads_status, uploads_put_part, uploads_complete,
     users_list, users_invite, access_requests, access_request_action, access_grants, access_grant_create, access_grant_update,
     connectors_list, connectors_create, connectors_sync,
-    archive_source,
-    viewer_pdf_meta, viewer_video_meta, viewer_image_meta,
+    archive_source, sources_bulk, sources_bulk_job, folders_tree, sources_stats,
+    viewer_pdf_meta, viewer_video_meta, viewer_image_meta, viewer_file,
+    ops_db_connections,
 )
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView
 
@@ -37,6 +38,7 @@ urlpatterns=[
  path("api/chat/turns/<uuid:turn_id>/regenerate", chat_regen),
  path("api/chat/turns/<uuid:turn_id>/feedback", chat_turn_feedback),
  path("api/chat/turns/<uuid:turn_id>/citations", citations_for_turn),
+ path("api/chat/analytics/<uuid:instrument_id>", chat_analytics),
  # access - BEFORE router
  path("api/instruments/<uuid:instrument_id>/request-access", request_access),
  path("api/instruments/<uuid:instrument_id>/access/requests", access_requests),
@@ -51,6 +53,8 @@ urlpatterns=[
  path("api/support/feedback/<uuid:fb_id>/respond", feedback_respond),
  # uploads - BEFORE router
  path("api/uploads/initiate", uploads_initiate),
+ path("api/uploads/parts", uploads_put_part),
+ path("api/uploads/<uuid:upload_id>", uploads_status),
  path("api/uploads/<uuid:upload_id>/complete", uploads_complete),
  # users - BEFORE router
  path("api/users", users_list),
@@ -59,12 +63,19 @@ urlpatterns=[
  path("api/connectors", connectors_list),
  path("api/connectors/create", connectors_create),
  path("api/connectors/<uuid:conn_id>/sync", connectors_sync),
- # sources - BEFORE router
+ # folders / sources - BEFORE router
+ path("api/folders/tree", folders_tree),
  path("api/sources/<uuid:source_id>/archive", archive_source),
+ path("api/sources/bulk", sources_bulk),
+ path("api/sources/stats", sources_stats),
+ path("api/sources/bulk/<uuid:job_id>", sources_bulk_job),
  # viewer meta - BEFORE router
  path("api/viewer/pdf/<uuid:source_id>", viewer_pdf_meta),
  path("api/viewer/video/<uuid:source_id>", viewer_video_meta),
  path("api/viewer/image/<uuid:source_id>", viewer_image_meta),
+ path("api/viewer/file/<uuid:source_id>", viewer_file),
+ # ops
+ path("api/ops/db", ops_db_connections),
  # Router MUST be last - catches all remaining /api/ routes
  path("api/", include(router.urls)),
 ]